@@ -1,61 +1,300 @@
 # chat/consumers.py
+import asyncio
 import json
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from usuarios.models import Mensaje, Conversacion, Usuario
-from rest_framework.authtoken.models import Token
+from django.utils import timezone
+from usuarios.autenticacion import obtener_resolutor
+from usuarios import notificaciones, presencia
+from usuarios.membresias import obtener_cache_membresias
+from usuarios.mensajeria import historial_despues_de
+from usuarios.models import Mensaje
+from .escritor import ajuste as ajuste_chat, datos_mensaje, grupo_conversacion, obtener_escritor
+from . import limites
 from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
 # --- Funciones asíncronas para interactuar con la base de datos ---
 # Es una buena práctica separar la lógica de la base de datos del consumer.
 
-@sync_to_async
-def get_user_from_token(token_key):
-    """Obtiene un usuario a partir de un token de autenticación."""
-    try:
-        token = Token.objects.select_related('user').get(key=token_key)
-        return token.user
-    except Token.DoesNotExist:
+async def get_user_from_token(token_key):
+    """Obtiene un usuario a partir de un token, usando la caché compartida con la API REST."""
+    resolutor = obtener_resolutor()
+    # Un acierto en la LRU local no necesita salir del event loop
+    user = resolutor.buscar_local(token_key)
+    if user is None:
+        user = await sync_to_async(resolutor.resolver)(token_key)
+    if user is None or not user.is_active:
         return AnonymousUser()
+    return user
 
-@sync_to_async
-def user_is_participant(user, conversacion_id):
-    """Verifica si un usuario es participante de una conversación."""
+async def user_is_participant(user, conversacion_id):
+    """Verifica si un usuario es participante de una conversación, usando la caché de membresías."""
     if user.is_anonymous:
         return False
     try:
-        conversacion = Conversacion.objects.get(id=conversacion_id)
-        return conversacion.participantes.filter(id=user.id).exists()
-    except Conversacion.DoesNotExist:
+        conversacion_id = int(conversacion_id)
+    except (TypeError, ValueError):
         return False
+    membresias = obtener_cache_membresias()
+    # Con la caché caliente no se sale del event loop ni se toca la base de datos
+    participantes = membresias.buscar_local(conversacion_id)
+    if participantes is None:
+        participantes = await sync_to_async(membresias.participantes)(conversacion_id)
+    return user.id in participantes
+
+class SalaChatMixin:
+    """
+    Lo común a los consumers de chat: presencia del usuario (ver
+    usuarios/presencia.py), avisos de "escribiendo", envío de mensajes por el
+    escritor por lotes y los frames de los eventos de los grupos de sala.
+    Cada evento de grupo lleva 'conversacion'; marco() decide si el frame
+    que recibe el cliente la incluye.
+
+    Protección frente a clientes que abusan o no leen (ver settings.CHAT):
+    - Frames de más de MAXIMO_FRAME_BYTES, mensajes de más de
+      MAXIMO_CONTENIDO caracteres y JSON inválido se rechazan.
+    - Cada frame toma un token del cubo de la conexión y del de su usuario
+      (chat/limites.py); sin tokens se descarta.
+    - Lo que se envía al cliente pasa por una cola de COLA_SALIDA_MAXIMA
+      frames. Si se llena, presencia, "escribiendo" y errores se descartan;
+      un mensaje de chat cierra la conexión con CIERRE_CLIENTE_LENTO.
+    Los rechazos se avisan con {"tipo": "error", "codigo", "detalle"}.
+
+    Al reconectar, el cliente puede pedir lo que se perdió desde el último
+    mensaje que vio (ver repetir_historial).
+    """
+    CIERRE_CLIENTE_LENTO = 4008
+    presencia_activa = False
+    salida = None
+    envios = None
+    cerrando = False
+
+    def marco(self, event, datos):
+        return datos
+
+    def frame_mensaje(self, event):
+        return self.marco(event, event['message'])
+
+    async def procesar(self, datos):
+        """ Atiende un frame ya validado (un objeto JSON). """
+        raise NotImplementedError
+
+    # --- Entrada ---
+
+    def iniciar_limites(self):
+        self.cubos = (limites.cubo_conexion(), limites.cubo_usuario(self.user.id))
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            self.enviar_error('formato_no_soportado', "Solo se aceptan frames de texto con JSON.")
+            return
+        maximo = ajuste_chat('MAXIMO_FRAME_BYTES', 16 * 1024)
+        # Un carácter ocupa como mucho 4 bytes en UTF-8: solo se codifica si hace falta
+        if len(text_data) * 4 > maximo and len(text_data.encode('utf-8')) > maximo:
+            self.enviar_error('frame_demasiado_grande', f"El frame supera los {maximo} bytes.")
+            return
+        espera = limites.tomar(*self.cubos)
+        if espera:
+            self.enviar_error('limite_excedido', "Demasiados frames; espera antes de reintentar.",
+                              reintentar_en_ms=int(espera * 1000) + 1)
+            return
+        try:
+            datos = json.loads(text_data)
+        except ValueError:
+            datos = None
+        if not isinstance(datos, dict):
+            self.enviar_error('json_invalido', "El frame debe ser un objeto JSON.")
+            return
+        try:
+            await self.procesar(datos)
+        except Exception:
+            logger.exception("Error en el consumer de chat al procesar un frame")
+            self.enviar_error('error_interno', "No se pudo procesar el frame.")
+
+    def contenido_valido(self, contenido):
+        if not isinstance(contenido, str) or not contenido.strip():
+            self.enviar_error('mensaje_invalido', "El mensaje debe ser un texto no vacío.")
+            return False
+        maximo = ajuste_chat('MAXIMO_CONTENIDO', 5000)
+        if len(contenido) > maximo:
+            self.enviar_error('contenido_demasiado_largo', f"El mensaje supera los {maximo} caracteres.")
+            return False
+        return True
+
+    # --- Salida ---
+
+    def iniciar_salida(self):
+        self.salida = asyncio.Queue(ajuste_chat('COLA_SALIDA_MAXIMA', 256))
+        # Por conversación, ids que repetir_historial envió y aún pueden llegar en vivo
+        self.repetidos = {}
+        self.envios = asyncio.create_task(self.vaciar_salida())
+
+    def terminar_salida(self):
+        if self.envios is not None:
+            self.envios.cancel()
+
+    async def vaciar_salida(self):
+        while True:
+            texto = await self.salida.get()
+            await super().send(text_data=texto)
+
+    def enviar(self, datos, descartable=False):
+        """ Deja un frame en la cola de salida sin esperar a que el cliente lo lea. """
+        if self.salida is None or self.cerrando:
+            return
+        try:
+            self.salida.put_nowait(json.dumps(datos))
+        except asyncio.QueueFull:
+            if descartable:
+                return
+            # Un cliente que no lee no debe acumular mensajes en memoria: se
+            # cierra y, al reconectar, pide lo que le falte
+            self.cerrando = True
+            logger.info("Se cierra un websocket de chat del usuario %s por no leer sus frames", self.user.id)
+            asyncio.ensure_future(self.close(code=self.CIERRE_CLIENTE_LENTO))
+
+    def enviar_error(self, codigo, detalle, **extra):
+        self.enviar({'tipo': 'error', 'codigo': codigo, 'detalle': detalle, **extra}, descartable=True)
+
+    # --- Historial al reconectar ---
+
+    async def repetir_historial(self, conversacion_id, desde):
+        """
+        Envía los mensajes posteriores a `desde` (el último que vio el cliente;
+        0 para todos) en frames {"tipo": "historial", "mensajes", "fin",
+        "completo"} de hasta LOTE_HISTORIAL mensajes, cada uno un rango del
+        índice (conversacion, fecha_envio, id). Se para en MAXIMO_HISTORIAL con
+        "completo": false; el resto se pide a la API con ?despues_de=.
+
+        Se llama ya unido al grupo de la sala: lo que confirme mientras tanto
+        llega también en vivo y chat_message descarta lo ya repetido, así que
+        no hay huecos ni duplicados entre el historial y el vivo.
+        """
+        if desde is None:
+            self.enviar_error('cursor_invalido', "El cursor debe ser el id de un mensaje.", conversacion=conversacion_id)
+            return
+        fecha = None
+        if desde:
+            fecha = await Mensaje.objects.filter(
+                conversacion_id=conversacion_id, pk=desde
+            ).values_list('fecha_envio', flat=True).afirst()
+            if fecha is None:
+                self.enviar_error('cursor_invalido', "El mensaje de referencia no existe en esta conversación.",
+                                  conversacion=conversacion_id)
+                return
+
+        lote, maximo = ajuste_chat('LOTE_HISTORIAL', 100), ajuste_chat('MAXIMO_HISTORIAL', 1000)
+        reciente = timezone.now() - notificaciones.MARGEN_DUPLICADOS
+        repetidos = self.repetidos.setdefault(conversacion_id, set())
+        enviados = 0
+        while True:
+            pedidos = min(lote, maximo - enviados)
+            mensajes = await sync_to_async(historial_despues_de)(conversacion_id, fecha, desde, pedidos)
+            enviados += len(mensajes)
+            if mensajes:
+                fecha, desde = mensajes[-1].fecha_envio, mensajes[-1].id
+            repetidos.update(mensaje.id for mensaje in mensajes if mensaje.fecha_envio >= reciente)
+            completo = len(mensajes) < pedidos
+            fin = completo or enviados >= maximo
+            self.enviar(self.marco({'conversacion': conversacion_id}, {
+                'tipo': 'historial', 'mensajes': [datos_mensaje(mensaje) for mensaje in mensajes],
+                'fin': fin, 'completo': completo,
+            }))
+            if fin:
+                return
+
+    # --- Presencia y mensajes ---
+
+    async def iniciar_presencia(self):
+        self.presencia_activa = True
+        self.hueco_presencia = await presencia.conectar(self.user.id, self.channel_name)
+        self.latidos = asyncio.create_task(self.latir())
+
+    async def terminar_presencia(self, conversaciones):
+        if self.presencia_activa:
+            self.presencia_activa = False
+            self.latidos.cancel()
+            # Puede seguir en línea por otra pestaña o dispositivo
+            en_linea = not await presencia.desconectar(self.user.id, self.channel_name, self.hueco_presencia)
+            for conversacion_id in conversaciones:
+                await self.anunciar_presencia(conversacion_id, en_linea)
+
+    async def latir(self):
+        while True:
+            await asyncio.sleep(presencia.ajuste('LATIDO_SEGUNDOS', 30))
+            self.hueco_presencia = await presencia.latido(self.user.id, self.channel_name, self.hueco_presencia)
+
+    async def anunciar_presencia(self, conversacion_id, en_linea):
+        await self.channel_layer.group_send(grupo_conversacion(conversacion_id), {
+            'type': 'presencia_evento', 'conversacion': conversacion_id, 'usuario': self.user.id, 'en_linea': en_linea,
+        })
+
+    async def avisar_escritura(self, conversacion_id):
+        # Los avisos repetidos dentro de la ventana se descartan aquí
+        if await presencia.avisar_escritura(conversacion_id, self.user.id):
+            await self.channel_layer.group_send(grupo_conversacion(conversacion_id), {
+                'type': 'escribiendo_evento', 'conversacion': conversacion_id,
+                'usuario': self.user.id, 'username': self.user.username,
+            })
+
+    def encolar_mensaje(self, conversacion_id, contenido):
+        # El escritor lo guarda junto con los demás mensajes del proceso y,
+        # cuando el lote confirma, lo envía al grupo de la sala en orden.
+        # No se espera aquí para que el siguiente frame entre en el mismo lote.
+        futuro = obtener_escritor().encolar(conversacion_id, self.user, contenido)
+        futuro.add_done_callback(self.mensaje_guardado)
+
+    def mensaje_guardado(self, futuro):
+        if not futuro.cancelled() and futuro.exception() is not None:
+            logger.warning("No se guardó un mensaje del usuario %s: %s", self.user.id, futuro.exception())
+            self.enviar_error('mensaje_no_guardado', "El mensaje no se pudo guardar.")
+
+    async def chat_message(self, event):
+        repetidos = self.repetidos.get(event['conversacion'])
+        if repetidos and event['message']['id'] in repetidos:
+            repetidos.discard(event['message']['id'])
+            return
+        self.enviar(self.frame_mensaje(event))
+
+    async def presencia_evento(self, event):
+        if self.quiere_presencia and event['usuario'] != self.user.id:
+            self.enviar(self.marco(event, {
+                'tipo': 'presencia', 'usuario': event['usuario'], 'en_linea': event['en_linea'],
+            }), descartable=True)
+
+    async def escribiendo_evento(self, event):
+        if self.quiere_presencia and event['usuario'] != self.user.id:
+            self.enviar(self.marco(event, {
+                'tipo': 'escribiendo', 'usuario': event['usuario'], 'username': event['username'],
+                'expira_en': presencia.ajuste('ESCRIBIENDO_SEGUNDOS', 3),
+            }), descartable=True)
+
+
+class ChatConsumer(SalaChatMixin, AsyncWebsocketConsumer):
+    """
+    Sala de chat de una conversación. Además de los mensajes, con ?presencia=1
+    el cliente recibe frames {"tipo": "presencia"} y {"tipo": "escribiendo"}
+    (ver usuarios/presencia.py); sin él, solo mensajes, como siempre.
+    Para avisar que escribe, el cliente manda {"tipo": "escribiendo"}.
+    Con ?desde=<id del último mensaje visto> recibe primero lo que se perdió
+    (frames {"tipo": "historial"}) y después los mensajes en vivo.
+    Para varias conversaciones en un solo socket, ver ChatMultiplexadoConsumer.
+    """
 
-@sync_to_async
-def save_message(user, conversacion_id, content):
-    """Guarda un nuevo mensaje en la base de datos."""
-    conversacion = Conversacion.objects.get(id=conversacion_id)
-    mensaje = Mensaje.objects.create(
-        conversacion=conversacion,
-        autor=user,
-        contenido=content
-    )
-    # Devolvemos un diccionario simple y serializable para enviarlo como JSON
-    return {
-        'id': mensaje.id,
-        'autor': mensaje.autor.id,
-        'autor_username': mensaje.autor.username,
-        'contenido': mensaje.contenido,
-        'fecha_envio': mensaje.fecha_envio.isoformat(),
-    }
-
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.conversacion_id = self.scope['url_route']['kwargs']['conversacion_id']
-        self.room_group_name = f'chat_{self.conversacion_id}'
+        self.room_group_name = grupo_conversacion(self.conversacion_id)
 
         # Extraer token de los query parameters de la URL
         query_string = self.scope.get('query_string', b'').decode('utf-8')
         query_params = parse_qs(query_string)
         token_key = query_params.get('token', [None])[0]
+        self.quiere_presencia = query_params.get('presencia', ['0'])[0] == '1'
+        desde = query_params.get('desde', [None])[0]
 
         if not token_key:
             await self.close()
@@ -70,37 +309,182 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
 
         # Si todo es válido, unirse al grupo y aceptar la conexión
+        self.conversacion_id = int(self.conversacion_id)
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         await self.accept()
+        self.iniciar_limites()
+        self.iniciar_salida()
+
+        await self.iniciar_presencia()
+        await self.anunciar_presencia(self.conversacion_id, True)
+        if desde is not None:
+            await self.repetir_historial(self.conversacion_id, notificaciones.cursor_de(desde))
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        self.terminar_salida()
+        await self.terminar_presencia([self.conversacion_id])
 
-    async def receive(self, text_data):
-        try:
-            text_data_json = json.loads(text_data)
-            message_content = text_data_json['message']
-
-            # Guardar el nuevo mensaje (el usuario ya está autenticado)
-            new_message = await save_message(self.user, self.conversacion_id, message_content)
-
-            # Enviar el mensaje al grupo de la sala
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': new_message
-                }
-            )
-        except Exception as e:
-            print(f"Error en el consumer al recibir mensaje: {e}")
+    async def procesar(self, datos):
+        if datos.get('tipo') == 'escribiendo':
+            await self.avisar_escritura(self.conversacion_id)
+        elif self.contenido_valido(datos.get('message')):
+            self.encolar_mensaje(self.conversacion_id, datos['message'])
 
-    async def chat_message(self, event):
-        message = event['message']
-        await self.send(text_data=json.dumps(message))
+
+class ChatMultiplexadoConsumer(SalaChatMixin, AsyncWebsocketConsumer):
+    """
+    Varias conversaciones en un solo socket: ws/chat/?token=...[&presencia=1].
+    El token se valida una vez al conectar; después el cliente manda
+
+        {"accion": "suscribir", "conversaciones": [1, 2], "desde": {"1": 120}}
+        {"accion": "desuscribir", "conversaciones": [2]}
+        {"conversacion": 1, "message": "hola"}
+        {"conversacion": 1, "tipo": "escribiendo"}
+
+    y recibe {"tipo": "suscrito", "conversaciones": [...], "rechazadas": [...]},
+    {"tipo": "desuscrito", ...} y los mismos frames que ChatConsumer, con
+    "conversacion"; los mensajes llevan además "tipo": "mensaje". "desde"
+    (opcional) pide el historial perdido de cada conversación, como en ChatConsumer.
+    """
+
+    async def connect(self):
+        query_params = parse_qs(self.scope.get('query_string', b'').decode('utf-8'))
+        token_key = query_params.get('token', [None])[0]
+        self.quiere_presencia = query_params.get('presencia', ['0'])[0] == '1'
+        self.conversaciones = set()
+        if not token_key:
+            await self.close()
+            return
+
+        self.user = await get_user_from_token(token_key)
+        if self.user.is_anonymous:
+            await self.close()
+            return
+        await self.accept()
+        self.iniciar_limites()
+        self.iniciar_salida()
+        await self.iniciar_presencia()
+
+    async def disconnect(self, close_code):
+        for conversacion_id in self.conversaciones:
+            await self.channel_layer.group_discard(grupo_conversacion(conversacion_id), self.channel_name)
+        self.terminar_salida()
+        await self.terminar_presencia(self.conversaciones)
+
+    def marco(self, event, datos):
+        return {'conversacion': event['conversacion'], **datos}
+
+    def frame_mensaje(self, event):
+        return self.marco(event, {'tipo': 'mensaje', **event['message']})
+
+    async def procesar(self, datos):
+        accion = datos.get('accion')
+        if accion == 'suscribir':
+            await self.suscribir(datos.get('conversaciones'), datos.get('desde'))
+        elif accion == 'desuscribir':
+            await self.desuscribir(datos.get('conversaciones'))
+        elif datos.get('conversacion') not in self.conversaciones:
+            self.enviar_error('no_suscrito', "No estás suscrito a esa conversación.", conversacion=datos.get('conversacion'))
+        elif datos.get('tipo') == 'escribiendo':
+            await self.avisar_escritura(datos['conversacion'])
+        elif self.contenido_valido(datos.get('message')):
+            self.encolar_mensaje(datos['conversacion'], datos['message'])
+
+    @staticmethod
+    def ids_de(valor):
+        if not isinstance(valor, list):
+            return []
+        return list(dict.fromkeys(
+            conversacion_id for conversacion_id in valor
+            if isinstance(conversacion_id, int) and not isinstance(conversacion_id, bool)
+        ))
+
+    async def suscribir(self, valor, desde=None):
+        aceptadas, rechazadas = [], []
+        maximo = ajuste_chat('MAXIMO_SUSCRIPCIONES', 50)
+        for conversacion_id in self.ids_de(valor):
+            if conversacion_id in self.conversaciones:
+                aceptadas.append(conversacion_id)
+            elif len(self.conversaciones) < maximo and await user_is_participant(self.user, conversacion_id):
+                await self.channel_layer.group_add(grupo_conversacion(conversacion_id), self.channel_name)
+                self.conversaciones.add(conversacion_id)
+                aceptadas.append(conversacion_id)
+                await self.anunciar_presencia(conversacion_id, True)
+            else:
+                rechazadas.append(conversacion_id)
+        self.enviar({'tipo': 'suscrito', 'conversaciones': aceptadas, 'rechazadas': rechazadas})
+        if isinstance(desde, dict):
+            for conversacion_id in aceptadas:
+                if str(conversacion_id) in desde:
+                    await self.repetir_historial(conversacion_id, notificaciones.cursor_de(desde[str(conversacion_id)]))
+
+    async def desuscribir(self, valor):
+        quitadas = [conversacion_id for conversacion_id in self.ids_de(valor) if conversacion_id in self.conversaciones]
+        for conversacion_id in quitadas:
+            self.conversaciones.discard(conversacion_id)
+            self.repetidos.pop(conversacion_id, None)
+            await self.channel_layer.group_discard(grupo_conversacion(conversacion_id), self.channel_name)
+        self.enviar({'tipo': 'desuscrito', 'conversaciones': quitadas})
+
+
+class NotificacionesConsumer(AsyncWebsocketConsumer):
+    """
+    Flujo de notificaciones del usuario (ver usuarios/notificaciones.py):
+    ws/notificaciones/?token=...&desde=<id del último evento recibido>.
+    Envía frames {"tipo": "notificaciones", "eventos": [...]}: primero lo
+    guardado después del cursor, en bloques, y luego lo que llega en vivo,
+    agrupado en ventanas de NOTIFICACIONES['VENTANA_MS'].
+    """
+    suscripcion = None
+
+    async def connect(self):
+        query_params = parse_qs(self.scope.get('query_string', b'').decode('utf-8'))
+        token_key = query_params.get('token', [None])[0]
+        desde = notificaciones.cursor_de(query_params.get('desde', ['0'])[0])
+        if not token_key or desde is None:
+            await self.close()
+            return
+
+        self.user = await get_user_from_token(token_key)
+        if self.user.is_anonymous:
+            await self.close()
+            return
+
+        # Suscrito antes de repetir: lo que confirme mientras tanto llega por el
+        # grupo y la suscripción descarta lo que ya se repitió
+        self.grupo = notificaciones.grupo_notificaciones(self.user.id)
+        self.suscripcion = notificaciones.Suscripcion(self.user.id, desde)
+        self.pendientes = []
+        self.envio = None
+        await self.channel_layer.group_add(self.grupo, self.channel_name)
+        await self.accept()
+        async for eventos in self.suscripcion.repetir():
+            await self.enviar_eventos(eventos)
+
+    async def disconnect(self, close_code):
+        if self.suscripcion is None:
+            return
+        if self.envio is not None:
+            self.envio.cancel()
+        await self.channel_layer.group_discard(self.grupo, self.channel_name)
+
+    async def notificaciones_evento(self, event):
+        self.pendientes.extend(self.suscripcion.en_vivo(event['eventos']))
+        if self.pendientes and (self.envio is None or self.envio.done()):
+            self.envio = asyncio.create_task(self.enviar_ventana())
+
+    async def enviar_ventana(self):
+        # Lo que llegue durante la ventana sale en el mismo frame
+        await asyncio.sleep(notificaciones.ajuste('VENTANA_MS', 200) / 1000)
+        eventos, self.pendientes = self.pendientes, []
+        await self.enviar_eventos(eventos)
+
+    async def enviar_eventos(self, eventos):
+        await self.send(text_data=json.dumps({'tipo': 'notificaciones', 'eventos': eventos}))
@@ -0,0 +1,163 @@
+# chat/escritor.py
+"""
+Escritor de mensajes por lotes para los websockets.
+
+En lugar de un INSERT (y un hilo de sync_to_async) por cada frame, los
+consumers del proceso dejan sus mensajes en una cola y una sola tarea los
+guarda juntos con registrar_mensajes(): el lote se cierra al llegar a
+LOTE_MAXIMO mensajes o cuando pasan ESPERA_LOTE_MS desde el primero.
+
+Solo después de que la transacción del lote confirma se hace el group_send
+de cada mensaje, uno tras otro y en el orden de llegada, así que dentro de
+cada conversación los mensajes se reparten en el mismo orden que sus ids.
+
+Ver settings.CHAT y el comando carga_chat para medir el efecto.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from usuarios.mensajeria import registrar_mensaje, registrar_mensajes
+
+logger = logging.getLogger(__name__)
+
+
+def ajuste(nombre, por_defecto):
+    return getattr(settings, 'CHAT', {}).get(nombre, por_defecto)
+
+
+def grupo_conversacion(conversacion_id):
+    return f'chat_{conversacion_id}'
+
+
+def datos_mensaje(mensaje):
+    """ Diccionario serializable que reciben los clientes del chat. """
+    return {
+        'id': mensaje.id,
+        'autor': mensaje.autor_id,
+        'autor_username': mensaje.autor.username,
+        'contenido': mensaje.contenido,
+        'fecha_envio': mensaje.fecha_envio.isoformat(),
+    }
+
+
+def _guardar(lote):
+    """
+    Guarda el lote en una transacción. Si falla (p. ej. una conversación
+    borrada entre medias), reintenta cada mensaje por separado para que el
+    error afecte solo a los suyos. Devuelve [Mensaje o excepción].
+    """
+    try:
+        return registrar_mensajes(lote)
+    except Exception:
+        logger.warning("Falló el lote de %s mensajes; se guardan uno a uno.", len(lote), exc_info=True)
+    resultados = []
+    for conversacion_id, autor, contenido in lote:
+        try:
+            resultados.append(registrar_mensaje(conversacion_id, autor, contenido))
+        except Exception as exc:
+            resultados.append(exc)
+    return resultados
+
+
+class EscritorMensajes:
+
+    def __init__(self, lote_maximo=None, espera_ms=None):
+        self.lote_maximo = lote_maximo or ajuste('LOTE_MAXIMO', 100)
+        self.espera = (espera_ms if espera_ms is not None else ajuste('ESPERA_LOTE_MS', 5)) / 1000
+        self._loop = None
+        self._cola = None
+        self._tarea = None
+        self.lotes = 0
+        self.mensajes = 0
+
+    def _preparar(self):
+        # La cola y la tarea viven en el event loop del servidor; en pruebas
+        # cada test puede tener su propio loop y se vuelven a crear
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._tarea is None or self._tarea.done():
+            self._loop = loop
+            self._cola = asyncio.Queue()
+            self._tarea = loop.create_task(self._bucle())
+
+    def encolar(self, conversacion_id, autor, contenido):
+        """
+        Deja un mensaje en la cola sin esperar y devuelve un futuro que se
+        resuelve con el diccionario enviado al grupo, o con el error al guardarlo.
+        Los mensajes de un mismo consumer se guardan en el orden en que se encolan.
+        """
+        self._preparar()
+        futuro = self._loop.create_future()
+        self._cola.put_nowait((int(conversacion_id), autor, contenido, futuro))
+        return futuro
+
+    async def enviar(self, conversacion_id, autor, contenido):
+        """ Como encolar(), pero espera a que el lote se guarde y se reparta. """
+        return await self.encolar(conversacion_id, autor, contenido)
+
+    async def _bucle(self):
+        while True:
+            lote = [await self._cola.get()]
+            limite = self._loop.time() + self.espera
+            while len(lote) < self.lote_maximo:
+                if not self._cola.empty():
+                    lote.append(self._cola.get_nowait())
+                    continue
+                restante = limite - self._loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self._cola.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+            await self._escribir(lote)
+
+    async def _escribir(self, lote):
+        try:
+            resultados = await sync_to_async(_guardar)([
+                (conversacion_id, autor, contenido) for conversacion_id, autor, contenido, _ in lote
+            ])
+        except Exception as exc:
+            resultados = [exc] * len(lote)
+        self.lotes += 1
+        self.mensajes += len(lote)
+
+        capa = get_channel_layer()
+        for (conversacion_id, _, _, futuro), resultado in zip(lote, resultados):
+            if isinstance(resultado, Exception):
+                if not futuro.done():
+                    futuro.set_exception(resultado)
+                continue
+            datos = datos_mensaje(resultado)
+            try:
+                await capa.group_send(grupo_conversacion(conversacion_id), {
+                    'type': 'chat_message', 'conversacion': conversacion_id, 'message': datos,
+                })
+            except Exception as exc:
+                logger.exception("No se pudo repartir el mensaje %s", resultado.id)
+                if not futuro.done():
+                    futuro.set_exception(exc)
+                continue
+            if not futuro.done():
+                futuro.set_result(datos)
+
+
+_escritor = None
+
+
+def obtener_escritor():
+    global _escritor
+    if _escritor is None:
+        _escritor = EscritorMensajes()
+    return _escritor
+
+
+def reiniciar_escritor(**opciones):
+    """ Para pruebas y para el comando de carga: descarta el escritor actual. """
+    global _escritor
+    if _escritor is not None and _escritor._tarea is not None and not _escritor._loop.is_closed():
+        _escritor._tarea.cancel()
+    _escritor = EscritorMensajes(**opciones) if opciones else None
+    return _escritor
@@ -0,0 +1,76 @@
+# chat/limites.py
+"""
+Límites de frecuencia de los websockets del chat: cubos de tokens por
+conexión y por usuario (ver settings.CHAT).
+
+Cada frame entrante toma un token del cubo de su conexión y otro del de su
+usuario; el de usuario lo comparten todas sus pestañas en este proceso. Los
+cubos viven en memoria: no cuestan una ida a Redis por frame, a cambio de
+que un usuario repartido entre procesos tenga un cubo en cada uno.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .escritor import ajuste
+
+MAXIMO_CUBOS_USUARIO = 10000
+
+
+class CuboTokens:
+
+    def __init__(self, capacidad, por_segundo):
+        self.capacidad = capacidad
+        self.por_segundo = por_segundo
+        self.tokens = float(capacidad)
+        self.actualizado = time.monotonic()
+
+    def rellenar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.por_segundo)
+        self.actualizado = ahora
+
+    def espera(self):
+        """ Segundos que faltan para tener un token entero. """
+        return max(0.0, (1 - self.tokens) / self.por_segundo)
+
+
+def tomar(*cubos):
+    """
+    Toma un token de cada cubo si todos tienen alguno. Si no, no toma
+    ninguno y devuelve los segundos que hay que esperar; 0 si se tomaron.
+    """
+    for cubo in cubos:
+        cubo.rellenar()
+    espera = max(cubo.espera() for cubo in cubos)
+    if espera > 0:
+        return espera
+    for cubo in cubos:
+        cubo.tokens -= 1
+    return 0
+
+
+def cubo_conexion():
+    return CuboTokens(ajuste('RAFAGA_CONEXION', 20), ajuste('FRAMES_POR_SEGUNDO_CONEXION', 5))
+
+
+_cubos_usuario = OrderedDict()
+_lock = threading.Lock()
+
+
+def cubo_usuario(usuario_id):
+    """ El cubo compartido por las conexiones del usuario en este proceso (LRU acotada). """
+    with _lock:
+        cubo = _cubos_usuario.pop(usuario_id, None)
+        if cubo is None:
+            cubo = CuboTokens(ajuste('RAFAGA_USUARIO', 40), ajuste('FRAMES_POR_SEGUNDO_USUARIO', 10))
+        _cubos_usuario[usuario_id] = cubo
+        while len(_cubos_usuario) > MAXIMO_CUBOS_USUARIO:
+            _cubos_usuario.popitem(last=False)
+    return cubo
+
+
+def reiniciar_cubos():
+    """ Para pruebas: olvida los cubos de los usuarios. """
+    with _lock:
+        _cubos_usuario.clear()
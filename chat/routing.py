@@ -3,5 +3,8 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
+    # Un solo socket para varias conversaciones (suscribir / desuscribir)
+    re_path(r'ws/chat/$', consumers.ChatMultiplexadoConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<conversacion_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    re_path(r'ws/notificaciones/$', consumers.NotificacionesConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,3 +1,456 @@
-from django.test import TestCase
+import asyncio
+import json
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import re_path, reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from usuarios import autenticacion, membresias, notificaciones, presencia
+from usuarios.mensajeria import actualizar_ultimo_mensaje, registrar_mensajes
+from usuarios.models import (
+    Conversacion, Mensaje, Notificacion, ParticipanteConversacion, Postulacion, Usuario, VacanteEmpresa,
+)
+
+from . import escritor, limites
+from .consumers import ChatConsumer
+from .routing import websocket_urlpatterns
+
+aplicacion = URLRouter(websocket_urlpatterns)
+
+
+class ChatTestMixin:
+    """ Dos participantes con token y una conversación entre ellos. """
+
+    def setUp(self):
+        cache.clear()
+        caches[presencia.ajuste('CACHE', 'default')].clear()
+        limites.reiniciar_cubos()
+        autenticacion.reiniciar_resolutor()
+        membresias.reiniciar_cache_membresias()
+        self.ana = Usuario.objects.create_user(username='ana')
+        self.beto = Usuario.objects.create_user(username='beto')
+        self.tokens = {usuario.pk: Token.objects.create(user=usuario).key for usuario in (self.ana, self.beto)}
+        self.conversacion = Conversacion.objects.create()
+        self.conversacion.participantes.add(self.ana, self.beto)
+
+    def tearDown(self):
+        escritor.reiniciar_escritor()
+        autenticacion.reiniciar_resolutor()
+        membresias.reiniciar_cache_membresias()
+
+    async def conectar(self, usuario, conversacion=None, aceptado=True, parametros=''):
+        conversacion_id = (conversacion or self.conversacion).pk
+        comunicador = WebsocketCommunicator(
+            aplicacion, f'/ws/chat/{conversacion_id}/?token={self.tokens[usuario.pk]}{parametros}'
+        )
+        conectado, _ = await comunicador.connect()
+        self.assertEqual(conectado, aceptado)
+        return comunicador
+
+
+class MembresiasTests(ChatTestMixin, TransactionTestCase):
+
+    async def conectar_y_cerrar(self, usuario, aceptado=True):
+        comunicador = await self.conectar(usuario, aceptado=aceptado)
+        await comunicador.disconnect()
+
+    def test_conexion_sin_consultas_con_cache_caliente(self):
+        async_to_sync(self.conectar_y_cerrar)(self.ana)
+        with CaptureQueriesContext(connection) as consultas:
+            async_to_sync(self.conectar_y_cerrar)(self.beto)
+        # Token de beto (aún no cacheado) y nada más: la membresía ya está en caché
+        self.assertEqual(len(consultas), 1)
+        with CaptureQueriesContext(connection) as consultas:
+            async_to_sync(self.conectar_y_cerrar)(self.ana)
+        self.assertEqual(len(consultas), 0)
+
+    def test_cambios_de_participantes_invalidan(self):
+        async_to_sync(self.conectar_y_cerrar)(self.beto)
+        self.conversacion.participantes.remove(self.beto)
+        async_to_sync(self.conectar_y_cerrar)(self.beto, False)
+        self.beto.conversaciones.add(self.conversacion)
+        async_to_sync(self.conectar_y_cerrar)(self.beto)
+
+
+class EscritorMensajesTests(ChatTestMixin, TransactionTestCase):
+
+    async def test_mensajes_en_un_lote_y_en_orden(self):
+        escritor.reiniciar_escritor(lote_maximo=50, espera_ms=200)
+        ana, beto = await self.conectar(self.ana), await self.conectar(self.beto)
+        for numero in range(10):
+            await (ana if numero % 2 else beto).send_json_to({'message': f'm{numero}'})
+
+        recibidos = [await ana.receive_json_from(timeout=2) for _ in range(10)]
+        # Se reparten en el orden de sus ids, y los de cada autor en el orden en que los mandó
+        self.assertEqual([mensaje['id'] for mensaje in recibidos], sorted(mensaje['id'] for mensaje in recibidos))
+        for autor, paridad in ((self.ana.pk, 1), (self.beto.pk, 0)):
+            self.assertEqual(
+                [mensaje['contenido'] for mensaje in recibidos if mensaje['autor'] == autor],
+                [f'm{numero}' for numero in range(10) if numero % 2 == paridad],
+            )
+        self.assertEqual(escritor.obtener_escritor().lotes, 1)
+        await ana.disconnect()
+        await beto.disconnect()
+
+        conversacion = await Conversacion.objects.aget(pk=self.conversacion.pk)
+        self.assertEqual(conversacion.ultimo_mensaje_id, recibidos[-1]['id'])
+        no_leidos = {
+            fila.usuario_id: fila.no_leidos
+            async for fila in ParticipanteConversacion.objects.filter(conversacion=self.conversacion)
+        }
+        # Cada uno tiene sin leer los 5 mensajes del otro
+        self.assertEqual(no_leidos, {self.ana.pk: 5, self.beto.pk: 5})
+
+    async def test_un_error_no_tumba_el_lote(self):
+        escritor.reiniciar_escritor(lote_maximo=50, espera_ms=50)
+        enviar = escritor.obtener_escritor().enviar
+        with self.assertLogs('chat.escritor', 'WARNING'):
+            resultados = await asyncio.gather(
+                enviar(self.conversacion.pk, self.ana, 'hola'),
+                enviar(self.conversacion.pk + 1000, self.ana, 'perdido'),
+                return_exceptions=True,
+            )
+        self.assertEqual(resultados[0]['contenido'], 'hola')
+        self.assertIsInstance(resultados[1], Exception)
+        self.assertEqual(await Mensaje.objects.acount(), 1)
+
+    def test_un_lote_lento_no_pisa_un_ultimo_mensaje_posterior(self):
+        anterior, posterior = registrar_mensajes([(self.conversacion.pk, self.ana, 'uno'), (self.conversacion.pk, self.beto, 'dos')])
+        # El lote de `anterior` confirma después del de `posterior`
+        self.assertEqual(actualizar_ultimo_mensaje(anterior), 0)
+        self.conversacion.refresh_from_db()
+        self.assertEqual((self.conversacion.ultimo_mensaje_id, self.conversacion.ultimo_mensaje_preview), (posterior.id, 'dos'))
+
+
+class PresenciaTests(ChatTestMixin, TransactionTestCase):
+
+    def presencia(self):
+        cliente = APIClient()
+        cliente.force_authenticate(self.ana)
+        datos = cliente.get(reverse('api_presencia'), {'ids': f'{self.ana.pk},{self.beto.pk}'}).data
+        return datos[self.ana.pk]['en_linea'], datos[self.beto.pk]['en_linea']
+
+    async def test_presencia_y_escribiendo(self):
+        ana = await self.conectar(self.ana, parametros='&presencia=1')
+        beto = await self.conectar(self.beto)
+        self.assertEqual(await ana.receive_json_from(), {'tipo': 'presencia', 'usuario': self.beto.pk, 'en_linea': True})
+        # beto no pidió eventos de presencia: solo recibiría mensajes
+        self.assertTrue(await beto.receive_nothing())
+
+        for _ in range(5):
+            await beto.send_json_to({'tipo': 'escribiendo'})
+        aviso = await ana.receive_json_from()
+        self.assertEqual((aviso['tipo'], aviso['usuario']), ('escribiendo', self.beto.pk))
+        # Los otros cuatro se agrupan en el servidor
+        self.assertTrue(await ana.receive_nothing())
+
+        # Otra pestaña de beto: cerrar una no lo desconecta
+        otra = await self.conectar(self.beto)
+        await ana.receive_json_from()
+        await otra.disconnect()
+        self.assertEqual(await ana.receive_json_from(), {'tipo': 'presencia', 'usuario': self.beto.pk, 'en_linea': True})
+        await beto.disconnect()
+        self.assertEqual(await ana.receive_json_from(), {'tipo': 'presencia', 'usuario': self.beto.pk, 'en_linea': False})
+        self.assertEqual(await sync_to_async(self.presencia)(), (True, False))
+        await ana.disconnect()
+
+    async def test_las_conexiones_de_un_proceso_muerto_caducan(self):
+        with override_settings(PRESENCIA={'CACHE': presencia.ajuste('CACHE', 'default'), 'EXPIRA_SEGUNDOS': 1}):
+            # Un proceso muere sin desconectar su conexión; la de otro sigue latiendo
+            await presencia.conectar(self.beto.pk, 'muerto!1')
+            hueco = await presencia.conectar(self.beto.pk, 'vivo!1')
+            for _ in range(3):
+                await asyncio.sleep(0.5)
+                hueco = await presencia.latido(self.beto.pk, 'vivo!1', hueco)
+            self.assertTrue(await presencia.en_linea(self.beto.pk))
+            # Los latidos del superviviente no mantienen viva la muerta
+            self.assertTrue(await presencia.desconectar(self.beto.pk, 'vivo!1', hueco))
+            self.assertFalse(await presencia.en_linea(self.beto.pk))
+
+
+class ChatMultiplexadoTests(ChatTestMixin, TransactionTestCase):
+
+    async def test_varias_conversaciones_en_un_socket(self):
+        escritor.reiniciar_escritor(espera_ms=0)
+        otra = await Conversacion.objects.acreate()
+        ajena = await Conversacion.objects.acreate()
+        await otra.participantes.aadd(self.ana, self.beto)
+        multiplexado = WebsocketCommunicator(aplicacion, f'/ws/chat/?token={self.tokens[self.ana.pk]}')
+        conectado, _ = await multiplexado.connect()
+        self.assertTrue(conectado)
+
+        await multiplexado.send_json_to({
+            'accion': 'suscribir', 'conversaciones': [self.conversacion.pk, otra.pk, ajena.pk, 'x'],
+        })
+        self.assertEqual(await multiplexado.receive_json_from(), {
+            'tipo': 'suscrito', 'conversaciones': [self.conversacion.pk, otra.pk], 'rechazadas': [ajena.pk],
+        })
+
+        # Los mensajes de cualquier sala llegan con su conversación
+        beto = await self.conectar(self.beto, otra)
+        await beto.send_json_to({'message': 'desde la sala'})
+        recibido = await multiplexado.receive_json_from(timeout=2)
+        self.assertEqual(
+            (recibido['tipo'], recibido['conversacion'], recibido['contenido']), ('mensaje', otra.pk, 'desde la sala')
+        )
+        # Y lo que se manda por el socket multiplexado llega igual a la ruta de siempre
+        await beto.receive_json_from(timeout=2)
+        await multiplexado.send_json_to({'conversacion': otra.pk, 'message': 'hola'})
+        self.assertEqual((await beto.receive_json_from(timeout=2))['contenido'], 'hola')
+        self.assertEqual((await multiplexado.receive_json_from(timeout=2))['conversacion'], otra.pk)
+
+        await multiplexado.send_json_to({'accion': 'desuscribir', 'conversaciones': [otra.pk]})
+        self.assertEqual(await multiplexado.receive_json_from(), {'tipo': 'desuscrito', 'conversaciones': [otra.pk]})
+        await beto.send_json_to({'message': 'ya no lo ve'})
+        await beto.receive_json_from(timeout=2)
+        self.assertTrue(await multiplexado.receive_nothing())
+        await multiplexado.send_json_to({'conversacion': otra.pk, 'message': 'sin suscripción'})
+        error = await multiplexado.receive_json_from()
+        self.assertEqual((error['tipo'], error['codigo'], error['conversacion']), ('error', 'no_suscrito', otra.pk))
+        await beto.disconnect()
+        await multiplexado.disconnect()
+        self.assertEqual(await Mensaje.objects.filter(conversacion=otra).acount(), 3)
+
+    async def test_sin_token_no_conecta(self):
+        multiplexado = WebsocketCommunicator(aplicacion, '/ws/chat/')
+        conectado, _ = await multiplexado.connect()
+        self.assertFalse(conectado)
+
+
+class ChatConsumerLento(ChatConsumer):
+    """ Un cliente que no lee: nada sale de la cola hasta abrir la puerta. """
+    puerta = None
+
+    async def vaciar_salida(self):
+        await self.puerta.wait()
+        await super().vaciar_salida()
+
+
+class LimitesChatTests(ChatTestMixin, TransactionTestCase):
+
+    async def error(self, comunicador):
+        frame = await comunicador.receive_json_from(timeout=2)
+        self.assertEqual(frame['tipo'], 'error')
+        return frame
+
+    @override_settings(CHAT={'MAXIMO_FRAME_BYTES': 200, 'MAXIMO_CONTENIDO': 50})
+    async def test_frames_invalidos(self):
+        ana = await self.conectar(self.ana)
+        await ana.send_to(text_data='x' * 201)
+        self.assertEqual((await self.error(ana))['codigo'], 'frame_demasiado_grande')
+        # 60 caracteres de 2 bytes caben en el frame pero no en el mensaje
+        await ana.send_to(text_data=json.dumps({'message': 'ñ' * 60}, ensure_ascii=False))
+        self.assertEqual((await self.error(ana))['codigo'], 'contenido_demasiado_largo')
+        await ana.send_json_to({'message': '   '})
+        self.assertEqual((await self.error(ana))['codigo'], 'mensaje_invalido')
+        await ana.send_to(text_data='{no es json')
+        self.assertEqual((await self.error(ana))['codigo'], 'json_invalido')
+        await ana.send_to(bytes_data=b'\x00')
+        self.assertEqual((await self.error(ana))['codigo'], 'formato_no_soportado')
+        await ana.disconnect()
+        self.assertEqual(await Mensaje.objects.acount(), 0)
+
+    @override_settings(CHAT={'ESPERA_LOTE_MS': 0, 'RAFAGA_CONEXION': 3, 'FRAMES_POR_SEGUNDO_CONEXION': 0.01})
+    async def test_limite_por_conexion(self):
+        ana = await self.conectar(self.ana)
+        for numero in range(4):
+            await ana.send_json_to({'message': f'm{numero}'})
+        recibidos = [await ana.receive_json_from(timeout=2) for _ in range(4)]
+        [error] = [frame for frame in recibidos if frame.get('tipo') == 'error']
+        self.assertEqual(error['codigo'], 'limite_excedido')
+        self.assertGreater(error['reintentar_en_ms'], 0)
+        await ana.disconnect()
+        self.assertEqual(await Mensaje.objects.acount(), 3)
+
+    @override_settings(CHAT={'ESPERA_LOTE_MS': 0, 'RAFAGA_USUARIO': 3, 'FRAMES_POR_SEGUNDO_USUARIO': 0.01})
+    async def test_limite_por_usuario_entre_pestañas(self):
+        pestañas = [await self.conectar(self.ana), await self.conectar(self.ana)]
+        for pestaña in pestañas:
+            await pestaña.send_json_to({'message': 'a'})
+            await pestaña.send_json_to({'message': 'b'})
+        # La segunda pestaña recibe los tres mensajes guardados y el error del cuarto
+        frames = [await pestañas[1].receive_json_from(timeout=2) for _ in range(4)]
+        self.assertEqual([frame['codigo'] for frame in frames if frame.get('tipo') == 'error'], ['limite_excedido'])
+        for pestaña in pestañas:
+            await pestaña.disconnect()
+        self.assertEqual(await Mensaje.objects.acount(), 3)
+
+    @override_settings(CHAT={'ESPERA_LOTE_MS': 0, 'COLA_SALIDA_MAXIMA': 2})
+    async def test_cliente_lento_se_cierra(self):
+        ChatConsumerLento.puerta = asyncio.Event()
+        lenta = URLRouter([re_path(r'ws/chat/(?P<conversacion_id>\w+)/$', ChatConsumerLento.as_asgi())])
+        ana = WebsocketCommunicator(lenta, f'/ws/chat/{self.conversacion.pk}/?token={self.tokens[self.ana.pk]}')
+        self.assertTrue((await ana.connect())[0])
+        enviar = escritor.obtener_escritor().enviar
+        for numero in range(3):
+            await enviar(self.conversacion.pk, self.beto, f'm{numero}')
+        salida = await ana.receive_output(timeout=2)
+        self.assertEqual((salida['type'], salida['code']), ('websocket.close', ChatConsumer.CIERRE_CLIENTE_LENTO))
+        ChatConsumerLento.puerta.set()
+        await ana.disconnect()
+
+
+class HistorialReconexionTests(ChatTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mensajes = registrar_mensajes([(self.conversacion.pk, self.beto, f'm{numero}') for numero in range(5)])
+
+    async def historial(self, comunicador):
+        frames = []
+        while not frames or not frames[-1]['fin']:
+            frames.append(await comunicador.receive_json_from(timeout=2))
+            self.assertEqual(frames[-1]['tipo'], 'historial')
+        return frames
+
+    @override_settings(CHAT={'ESPERA_LOTE_MS': 0, 'LOTE_HISTORIAL': 2})
+    async def test_repite_lo_perdido_por_bloques_y_sigue_en_vivo(self):
+        ana = await self.conectar(self.ana, parametros=f'&desde={self.mensajes[1].id}')
+        frames = await self.historial(ana)
+        self.assertEqual(
+            [[mensaje['contenido'] for mensaje in frame['mensajes']] for frame in frames], [['m2', 'm3'], ['m4']]
+        )
+        self.assertTrue(frames[-1]['completo'])
+
+        # Un mensaje ya repetido que además llega por el grupo no se duplica
+        await get_channel_layer().group_send(escritor.grupo_conversacion(self.conversacion.pk), {
+            'type': 'chat_message', 'conversacion': self.conversacion.pk,
+            'message': escritor.datos_mensaje(self.mensajes[-1]),
+        })
+        await ana.send_json_to({'message': 'm5'})
+        self.assertEqual((await ana.receive_json_from(timeout=2))['contenido'], 'm5')
+        self.assertTrue(await ana.receive_nothing())
+        await ana.disconnect()
+
+    @override_settings(CHAT={'LOTE_HISTORIAL': 5, 'MAXIMO_HISTORIAL': 2})
+    async def test_historial_acotado_y_cursor_invalido(self):
+        ana = await self.conectar(self.ana, parametros='&desde=0')
+        [frame] = await self.historial(ana)
+        # Se corta en MAXIMO_HISTORIAL; el resto se pide a la API
+        self.assertEqual([mensaje['id'] for mensaje in frame['mensajes']], [m.id for m in self.mensajes[:2]])
+        self.assertFalse(frame['completo'])
+        await ana.disconnect()
+
+        otra = await Conversacion.objects.acreate()
+        ajeno = (await sync_to_async(registrar_mensajes)([(otra.pk, self.ana, 'x')]))[0]
+        ana = await self.conectar(self.ana, parametros=f'&desde={ajeno.id}')
+        error = await ana.receive_json_from()
+        self.assertEqual((error['tipo'], error['codigo']), ('error', 'cursor_invalido'))
+        await ana.disconnect()
+
+    async def test_multiplexado_con_desde(self):
+        multiplexado = WebsocketCommunicator(aplicacion, f'/ws/chat/?token={self.tokens[self.ana.pk]}')
+        self.assertTrue((await multiplexado.connect())[0])
+        await multiplexado.send_json_to({
+            'accion': 'suscribir', 'conversaciones': [self.conversacion.pk],
+            'desde': {str(self.conversacion.pk): self.mensajes[3].id},
+        })
+        self.assertEqual((await multiplexado.receive_json_from())['tipo'], 'suscrito')
+        [frame] = await self.historial(multiplexado)
+        self.assertEqual(frame['conversacion'], self.conversacion.pk)
+        self.assertEqual([mensaje['contenido'] for mensaje in frame['mensajes']], ['m4'])
+        await multiplexado.disconnect()
+
+
+class NotificacionesTests(ChatTestMixin, TransactionTestCase):
+
+    async def conectar_notificaciones(self, usuario, desde=''):
+        comunicador = WebsocketCommunicator(
+            aplicacion, f'/ws/notificaciones/?token={self.tokens[usuario.pk]}&desde={desde}'
+        )
+        conectado, _ = await comunicador.connect()
+        self.assertTrue(conectado)
+        return comunicador
+
+    async def test_mensajes_agrupados_y_repeticion(self):
+        escritor.reiniciar_escritor(lote_maximo=50, espera_ms=100)
+        ana = await self.conectar_notificaciones(self.ana)
+        enviar = escritor.obtener_escritor().enviar
+        await asyncio.gather(*(enviar(self.conversacion.pk, self.beto, f'm{numero}') for numero in range(3)))
+
+        # Un solo evento por conversación y lote, con el último mensaje
+        frame = await ana.receive_json_from(timeout=2)
+        self.assertEqual(frame['tipo'], 'notificaciones')
+        [evento] = frame['eventos']
+        self.assertEqual(evento['tipo'], 'mensaje')
+        self.assertEqual(evento['datos']['nuevos'], 3)
+        self.assertEqual(evento['datos']['preview'], 'm2')
+        self.assertTrue(await ana.receive_nothing())
+        await ana.disconnect()
+        # El autor no recibe aviso de sus propios mensajes
+        self.assertFalse(await Notificacion.objects.filter(usuario=self.beto).aexists())
+
+        # Al reconectar: desde el principio se repite, desde el último id no hay nada
+        ana = await self.conectar_notificaciones(self.ana, desde=0)
+        self.assertEqual((await ana.receive_json_from())['eventos'], [evento])
+        await ana.disconnect()
+        ana = await self.conectar_notificaciones(self.ana, desde=evento['id'])
+        self.assertTrue(await ana.receive_nothing())
+        await ana.disconnect()
+
+    async def test_repeticion_por_bloques_sin_duplicados(self):
+        antiguas = await sync_to_async(notificaciones.publicar)([
+            (self.ana.pk, 'mensaje', {'numero': numero}) for numero in range(5)
+        ])
+        with self.settings(NOTIFICACIONES={'LOTE_REPETICION': 2, 'VENTANA_MS': 0}):
+            ana = await self.conectar_notificaciones(self.ana, desde=antiguas[0].id)
+            # Un evento repetido que además llega por el grupo (confirmó tras suscribirse)
+            await sync_to_async(notificaciones.repartir)(antiguas[-1:])
+            bloques = [await ana.receive_json_from() for _ in range(2)]
+            self.assertEqual(
+                [[evento['id'] for evento in bloque['eventos']] for bloque in bloques],
+                [[antiguas[1].id, antiguas[2].id], [antiguas[3].id, antiguas[4].id]],
+            )
+            self.assertTrue(await ana.receive_nothing())
+            await ana.disconnect()
+
+    def test_postulaciones_y_cambios_de_estado(self):
+        empresa = Usuario.objects.create_user(username='acme', tipo_usuario='empresa')
+        vacante = VacanteEmpresa.objects.create(
+            empresa=empresa, titulo_vacante='Backend', descripcion_puesto='...', requisitos='...'
+        )
+        postulacion = Postulacion.objects.create(profesional=self.ana, vacante=vacante)
+        Postulacion.cambiar_estado_en_lote([postulacion.pk], 'en_revision', empresa)
+        # Un cambio rechazado no notifica
+        Postulacion.cambiar_estado_en_lote([postulacion.pk], 'recibida', empresa)
+
+        self.assertEqual(
+            list(Notificacion.objects.filter(usuario=empresa).values_list('tipo', 'datos')),
+            [('postulacion', {
+                'postulacion_id': postulacion.pk, 'vacante_id': vacante.pk,
+                'profesional_id': self.ana.pk, 'estado': 'recibida',
+            })],
+        )
+        self.assertEqual(
+            list(Notificacion.objects.filter(usuario=self.ana).values_list('tipo', 'datos')),
+            [('estado_postulacion', {
+                'postulacion_id': postulacion.pk, 'vacante_id': vacante.pk,
+                'estado_anterior': 'recibida', 'estado': 'en_revision',
+            })],
+        )
+
+    async def test_flujo_sse(self):
+        [antigua] = await sync_to_async(notificaciones.publicar)([(self.ana.pk, 'mensaje', {'numero': 1})])
+        self.assertEqual((await self.async_client.get(reverse('api_notificaciones_flujo'))).status_code, 401)
+        respuesta = await self.async_client.get(
+            reverse('api_notificaciones_flujo'), {'token': self.tokens[self.ana.pk]}, headers={'Last-Event-ID': '0'}
+        )
+        self.assertEqual(respuesta['Content-Type'], 'text/event-stream')
+        flujo = aiter(respuesta.streaming_content)
+        try:
+            self.assertTrue((await anext(flujo)).startswith(b'retry:'))
+            self.assertIn(f'id: {antigua.id}\nevent: mensaje\n'.encode(), await anext(flujo))
+            with self.settings(NOTIFICACIONES={'VENTANA_MS': 0}):
+                siguiente = asyncio.ensure_future(anext(flujo))
+                await asyncio.sleep(0.05)
+                [nueva] = await sync_to_async(notificaciones.publicar)([(self.ana.pk, 'postulacion', {'numero': 2})])
+                self.assertIn(f'id: {nueva.id}\nevent: postulacion\n'.encode(), await asyncio.wait_for(siguiente, 2))
+        finally:
+            await flujo.aclose()
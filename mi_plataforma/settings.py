@@ -40,6 +40,66 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Escritor de mensajes por lotes de los websockets (ver chat/escritor.py):
+# un lote se guarda al juntar LOTE_MAXIMO mensajes o ESPERA_LOTE_MS después del primero.
+CHAT = {
+    'LOTE_MAXIMO': 100,
+    'ESPERA_LOTE_MS': 5,
+    # Conversaciones a la vez en un socket multiplexado (ws/chat/)
+    'MAXIMO_SUSCRIPCIONES': 50,
+    # Límites por frame entrante (ver SalaChatMixin en chat/consumers.py)
+    'MAXIMO_FRAME_BYTES': 16 * 1024,
+    'MAXIMO_CONTENIDO': 5000,
+    # Cubos de tokens (chat/limites.py): ráfaga y frames por segundo sostenidos
+    'RAFAGA_CONEXION': 20,
+    'FRAMES_POR_SEGUNDO_CONEXION': 5,
+    'RAFAGA_USUARIO': 40,
+    'FRAMES_POR_SEGUNDO_USUARIO': 10,
+    # Frames pendientes de enviar a un cliente antes de darlo por lento
+    'COLA_SALIDA_MAXIMA': 256,
+    # Historial perdido al reconectar (?desde=): mensajes por frame y en total
+    'LOTE_HISTORIAL': 100,
+    'MAXIMO_HISTORIAL': 1000,
+}
+
+# 'default' es por proceso; 'compartida' la ven todos los procesos (mismo
+# Redis que la capa de canales, otra base) para el estado que debe ser común.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
+
+# Presencia e indicadores de "escribiendo" (usuarios/presencia.py). El estado
+# vive en esta caché, que debe ser compartida entre procesos: una por proceso
+# mostraría en cada uno solo las conexiones que atiende. Cada conexión ocupa
+# uno de los MAXIMO_CONEXIONES huecos de su usuario.
+PRESENCIA = {
+    'CACHE': 'compartida',
+    'MAXIMO_CONEXIONES': 10,
+    'LATIDO_SEGUNDOS': 30,
+    'EXPIRA_SEGUNDOS': 75,
+    'ESCRIBIENDO_SEGUNDOS': 3,
+    'MAXIMO_IDS': 200,
+}
+
+# Flujo de notificaciones por usuario (usuarios/notificaciones.py): websocket
+# ws/notificaciones/ o Server-Sent Events en api/usuarios/notificaciones/flujo/.
+# Los eventos en vivo se agrupan en ventanas de VENTANA_MS; al reconectar se
+# repiten en bloques de LOTE_REPETICION los guardados tras el cursor del cliente.
+# Las de más de RETENCION_DIAS las borra el comando purgar_notificaciones.
+NOTIFICACIONES = {
+    'VENTANA_MS': 200,
+    'LOTE_REPETICION': 200,
+    'RETENCION_DIAS': 14,
+    'SSE_LATIDO_SEGUNDOS': 25,
+    'SSE_REINTENTO_MS': 3000,
+}
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -103,18 +163,69 @@ AUTH_USER_MODEL = 'usuarios.Usuario'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'usuarios.autenticacion.TokenAuthenticationCacheada',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 9
 }
 
+# ==================================================================
+# BÚSQUEDA DE TEXTO COMPLETO (servicios y vacantes)
+# ==================================================================
+# 'usuarios.busqueda.BackendBaseDatos' guarda el índice en la base de datos;
+# 'usuarios.busqueda.BackendMemoria' lo mantiene en el proceso (pruebas/desarrollo).
+BUSQUEDA = {
+    'BACKEND': 'usuarios.busqueda.BackendBaseDatos',
+    'LIMITE_RESULTADOS': 500,
+}
+
+# Caché de tokens de autenticación (usuarios/autenticacion.py).
+# CACHE_COMPARTIDA es un alias de CACHES (p. ej. 'default') o None para usar solo la LRU local.
+AUTENTICACION_TOKENS = {
+    'MAXIMO_ENTRADAS': 10000,
+    'TTL_SEGUNDOS': 60,
+    'CACHE_COMPARTIDA': None,
+}
+
+# Caché de participantes por conversación para autorizar websockets y la API
+# de mensajes (usuarios/membresias.py); mismos niveles que AUTENTICACION_TOKENS.
+MEMBRESIAS_CHAT = {
+    'MAXIMO_ENTRADAS': 10000,
+    'TTL_SEGUNDOS': 60,
+    'CACHE_COMPARTIDA': None,
+}
+
+# Caché de fragmentos serializados de servicios, vacantes y perfiles públicos
+# (usuarios/fragmentos.py). Debe ser compartida: con una por proceso, invalidar()
+# solo cambiaría la versión en el proceso que atendió el cambio y los demás
+# seguirían sirviendo el fragmento obsoleto hasta TTL_SEGUNDOS.
+FRAGMENTOS = {
+    'CACHE': 'compartida',
+    'TTL_SEGUNDOS': 3600,
+}
+
+# Cola de tareas en base de datos (usuarios/tareas.py, comando procesar_tareas).
+# SINCRONO=True ejecuta cada tarea al confirmar la transacción, sin trabajador.
+TAREAS = {
+    'SINCRONO': False,
+    'TIEMPO_MAXIMO_SEGUNDOS': 600,
+}
+
 # ==================================================================
 # CONFIGURACIÓN DE ARCHIVOS MEDIA (IMÁGENES SUBIDAS)
 # ==================================================================
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Servicio de media (usuarios/medios.py). MODO: 'django' envía los bytes desde
+# Django; 'x-accel' (nginx, con una location interna en PREFIJO_INTERNO que
+# apunte a MEDIA_ROOT) o 'x-sendfile' (Apache/lighttpd) los delega al proxy.
+MEDIA_SERVIR = {
+    'MODO': 'django',
+    'PREFIJO_INTERNO': '/media-interno/',
+    'FIRMA_TTL_SEGUNDOS': 3600,
+}
+
 # ==================================================================
 # CONFIGURACIÓN DE CORS (FINAL Y CORRECTA)
 # ==================================================================
@@ -1,15 +1,14 @@
 # mi_plataforma/urls.py (VERSIÓN FINAL Y LIMPIA)
 
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from usuarios.medios import ServirMedioView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/usuarios/', include('usuarios.urls')), # <-- Esta es la única ruta principal de la API
+    # Archivos subidos (media), en desarrollo y en producción: ETag, Range,
+    # permisos de los CV y, si se configura, envío por el proxy (ver usuarios/medios.py)
+    re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<nombre>.+)$', ServirMedioView.as_view(), name='servir_medio'),
 ]
-
-# Esto permite a Django servir los archivos subidos (media) en desarrollo
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,77 @@
+# usuarios/almacenamiento.py
+"""
+Almacenamiento direccionado por contenido para los CV (Usuario.cv) y las
+imágenes de la galería (ImagenServicio.imagen).
+
+Cada archivo se guarda una sola vez bajo el SHA-256 de su contenido:
+
+    cvs/3f/3fa1...c9.pdf
+    servicios_galeria/a0/a04b...11.jpg
+
+Subir dos veces el mismo archivo devuelve el mismo nombre y no escribe nada
+nuevo. BlobAlmacenado (usuarios/models.py) lleva la cuenta de cuántas filas
+apuntan a cada blob y lo borra, junto con sus variantes, cuando la última
+referencia desaparece (ver usuarios/signals.py).
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+TAMAÑO_BLOQUE = 64 * 1024
+
+
+def digest_de(contenido):
+    """ SHA-256 de un File de Django, leído por bloques para no cargarlo entero en memoria. """
+    sha = hashlib.sha256()
+    for bloque in contenido.chunks(TAMAÑO_BLOQUE):
+        sha.update(bloque if isinstance(bloque, bytes) else bloque.encode())
+    return sha.hexdigest()
+
+
+def nombre_blob(directorio, digest, extension):
+    return os.path.join(directorio, digest[:2], f"{digest}{extension.lower()}").replace(os.sep, '/')
+
+
+def es_nombre_blob(nombre):
+    base = os.path.splitext(os.path.basename(nombre))[0]
+    return len(base) == 64 and all(c in '0123456789abcdef' for c in base)
+
+
+class AlmacenamientoDeduplicado(FileSystemStorage):
+
+    @property
+    def derivados(self):
+        """ Storage normal (mismo directorio) para las variantes, que tienen nombre fijo. """
+        return FileSystemStorage(location=self.location, base_url=self.base_url)
+
+    def get_available_name(self, name, max_length=None):
+        # El nombre final depende del contenido y se decide en _save()
+        return name
+
+    def _save(self, name, content):
+        directorio, archivo = os.path.split(name)
+        extension = os.path.splitext(archivo)[1]
+        nombre = nombre_blob(directorio, digest_de(content), extension)
+        if self.exists(nombre):
+            # Si un borrado concurrente lo recolecta antes de que la fila sume su
+            # referencia, BlobAlmacenado.sumar_referencia() lo vuelve a escribir
+            return nombre
+        return self.escribir(nombre, content)
+
+    def escribir(self, nombre, content):
+        """ Escribe el blob `nombre` con `content`, aunque ya exista (mismo contenido). """
+        # Se escribe con un nombre temporal y se renombra de forma atómica: si dos
+        # subidas del mismo archivo coinciden, ambas dejan el mismo contenido.
+        temporal = super()._save(f"{nombre}.{uuid.uuid4().hex}.tmp", content)
+        os.replace(self.path(temporal), self.path(nombre))
+        return nombre
+
+
+almacenamiento_deduplicado = AlmacenamientoDeduplicado()
+
+
+def obtener_almacenamiento():
+    """ Callable para el parámetro storage= de los campos (las migraciones guardan la referencia, no la instancia). """
+    return almacenamiento_deduplicado
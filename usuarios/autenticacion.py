@@ -0,0 +1,169 @@
+# usuarios/autenticacion.py
+"""
+Resolución de tokens de autenticación con caché, compartida por la API REST
+(TokenAuthenticationCacheada) y los websockets (chat.consumers).
+
+Niveles:
+  1. LRU en el proceso con TTL (settings.AUTENTICACION_TOKENS).
+  2. Opcional: una caché compartida de Django (p. ej. Redis) entre procesos.
+  3. La base de datos (Token + Usuario en una sola consulta).
+
+Al borrar un token o guardar un usuario (p. ej. al desactivarlo) se invalidan
+sus entradas en este proceso y en la caché compartida (ver usuarios/signals.py).
+Las LRU de otros procesos caducan como máximo tras el TTL, por eso conviene
+mantenerlo corto.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class ResolutorTokens:
+
+    def __init__(self, maximo_entradas=10000, ttl_segundos=60, cache_compartida=None):
+        self.maximo_entradas = maximo_entradas
+        self.ttl_segundos = ttl_segundos
+        self.cache_compartida = caches[cache_compartida] if cache_compartida else None
+        self._entradas = OrderedDict()  # clave -> (usuario, expira)
+        self._claves_por_usuario = defaultdict(set)
+        self._lock = threading.Lock()
+        self._contadores = {'aciertos': 0, 'aciertos_compartida': 0, 'fallos': 0, 'invalidaciones': 0}
+
+    @staticmethod
+    def clave_compartida(clave):
+        return f'token_usuario:{clave}'
+
+    def buscar_local(self, clave):
+        """ Solo mira la LRU del proceso; nunca consulta la base de datos (seguro en código async). """
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            usuario, expira = entrada
+            if expira < time.monotonic():
+                self._quitar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            self._contadores['aciertos'] += 1
+        # Cada petición recibe su propia copia para no compartir estado entre hilos
+        return copy.copy(usuario)
+
+    def resolver(self, clave):
+        """ Devuelve el usuario del token (puede estar inactivo) o None si el token no existe. """
+        usuario = self.buscar_local(clave)
+        if usuario is not None:
+            return usuario
+
+        if self.cache_compartida is not None:
+            usuario = self.cache_compartida.get(self.clave_compartida(clave))
+            if usuario is not None:
+                with self._lock:
+                    self._contadores['aciertos_compartida'] += 1
+                self._guardar(clave, usuario)
+                return copy.copy(usuario)
+
+        with self._lock:
+            self._contadores['fallos'] += 1
+        try:
+            token = Token.objects.select_related('user').get(key=clave)
+        except Token.DoesNotExist:
+            return None
+        usuario = token.user
+        # Solo se cachean usuarios activos: los inactivos siempre van a la base de datos
+        if usuario.is_active:
+            self._guardar(clave, usuario)
+            if self.cache_compartida is not None:
+                self.cache_compartida.set(self.clave_compartida(clave), usuario, self.ttl_segundos)
+        return copy.copy(usuario)
+
+    def _guardar(self, clave, usuario):
+        with self._lock:
+            self._quitar(clave)
+            self._entradas[clave] = (copy.copy(usuario), time.monotonic() + self.ttl_segundos)
+            self._claves_por_usuario[usuario.pk].add(clave)
+            while len(self._entradas) > self.maximo_entradas:
+                self._quitar(next(iter(self._entradas)))
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            claves = self._claves_por_usuario.get(entrada[0].pk)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._claves_por_usuario[entrada[0].pk]
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._quitar(clave)
+            self._contadores['invalidaciones'] += 1
+        if self.cache_compartida is not None:
+            self.cache_compartida.delete(self.clave_compartida(clave))
+
+    def invalidar_usuario(self, usuario_id):
+        with self._lock:
+            claves = set(self._claves_por_usuario.get(usuario_id, ()))
+        if self.cache_compartida is not None:
+            # Las claves cacheadas en otros procesos solo se conocen en la base de datos
+            claves |= set(Token.objects.filter(user_id=usuario_id).values_list('key', flat=True))
+        for clave in claves:
+            self.invalidar(clave)
+
+    def vaciar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._claves_por_usuario.clear()
+
+    def metricas(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+            contadores['entradas'] = len(self._entradas)
+        consultas = contadores['aciertos'] + contadores['aciertos_compartida'] + contadores['fallos']
+        contadores['tasa_aciertos'] = (
+            round((contadores['aciertos'] + contadores['aciertos_compartida']) / consultas, 4) if consultas else None
+        )
+        return contadores
+
+
+_resolutor = None
+_resolutor_lock = threading.Lock()
+
+
+def obtener_resolutor():
+    global _resolutor
+    if _resolutor is None:
+        with _resolutor_lock:
+            if _resolutor is None:
+                ajustes = getattr(settings, 'AUTENTICACION_TOKENS', {})
+                _resolutor = ResolutorTokens(
+                    maximo_entradas=ajustes.get('MAXIMO_ENTRADAS', 10000),
+                    ttl_segundos=ajustes.get('TTL_SEGUNDOS', 60),
+                    cache_compartida=ajustes.get('CACHE_COMPARTIDA'),
+                )
+    return _resolutor
+
+
+def reiniciar_resolutor():
+    """ Olvida el resolutor actual (útil en pruebas que cambian settings.AUTENTICACION_TOKENS). """
+    global _resolutor
+    _resolutor = None
+
+
+class TokenAuthenticationCacheada(TokenAuthentication):
+    """ TokenAuthentication de DRF, pero resolviendo el token con ResolutorTokens. """
+
+    def authenticate_credentials(self, key):
+        usuario = obtener_resolutor().resolver(key)
+        if usuario is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not usuario.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return (usuario, key)
@@ -0,0 +1,430 @@
+# usuarios/busqueda.py
+"""
+Búsqueda de texto completo para servicios y vacantes.
+
+El texto de cada documento se normaliza (minúsculas y sin acentos), se
+tokeniza, se descartan palabras vacías y se reduce a su raíz con un
+lematizador ligero para español. Los términos resultantes se guardan en un
+índice invertido que se actualiza en cada guardado o borrado (ver
+usuarios/signals.py).
+
+El índice es intercambiable mediante settings.BUSQUEDA['BACKEND']:
+  - BackendBaseDatos: tabla TerminoIndexado, funciona igual en MySQL y SQLite.
+  - BackendMemoria: índice en el proceso, pensado para pruebas y desarrollo.
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils.module_loading import import_string
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+PALABRAS_VACIAS = {
+    'a', 'al', 'ante', 'con', 'de', 'del', 'desde', 'el', 'en', 'entre', 'es', 'la', 'las',
+    'lo', 'los', 'mas', 'me', 'mi', 'muy', 'no', 'o', 'para', 'por', 'que', 'se', 'sin',
+    'sobre', 'su', 'sus', 'te', 'tu', 'u', 'un', 'una', 'unas', 'unos', 'y', 'ya',
+}
+
+# Sufijos derivativos del más largo al más corto; se quita solo el primero que coincida.
+SUFIJOS = [
+    'amiento', 'imiento', 'acion', 'ucion', 'mente', 'adora', 'ador', 'ancia', 'encia',
+    'idad', 'able', 'ible', 'ista', 'oso', 'osa', 'ivo', 'iva',
+]
+LONGITUD_MINIMA_RAIZ = 3
+
+
+def normalizar(texto):
+    """ Minúsculas y sin acentos ni diéresis ("Diseñador Gráfico" -> "disenador grafico"). """
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    return re.findall(r'[a-z0-9]+', normalizar(texto or ''))
+
+
+def raiz(token):
+    """
+    Lematizador ligero: quita el plural, un sufijo derivativo y la vocal final,
+    conservando siempre al menos 3 letras ("diseñadores" y "diseño" -> "disen").
+    """
+    if token.isdigit():
+        return token
+
+    def quitar(palabra, sufijo):
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= LONGITUD_MINIMA_RAIZ:
+            return palabra[:-len(sufijo)]
+        return palabra
+
+    if token.endswith('es') and token[-3:-2] not in 'aeiou':
+        token = quitar(token, 'es')
+    else:
+        token = quitar(token, 's')
+    for sufijo in SUFIJOS:
+        recortado = quitar(token, sufijo)
+        if recortado != token:
+            token = recortado
+            break
+    if token[-1] in 'aeo':
+        token = quitar(token, token[-1])
+    return token
+
+
+def terminos(texto):
+    return [raiz(token) for token in tokenizar(texto) if token not in PALABRAS_VACIAS]
+
+
+# Lo que raiz() puede quitar al final de una palabra: vocal, sufijo y plural
+TERMINACIONES = {
+    vocal + sufijo + plural
+    for vocal in ('', 'a', 'e', 'o') for sufijo in [''] + SUFIJOS for plural in ('', 's', 'es')
+}
+COMIENZOS_TERMINACION = {terminacion[:fin] for terminacion in TERMINACIONES for fin in range(1, len(terminacion) + 1)}
+
+
+def raices_posibles(prefijo):
+    """
+    Raíces indexadas que puede tener una palabra que empieza por `prefijo`
+    (ya normalizado) y que ya no son prefijos suyos: "programaci" puede ser
+    "programacion" -> "program", "disenad" puede ser "disenador" -> "disen".
+    Las que empiezan por el prefijo se buscan aparte por rango.
+    """
+    if prefijo.isdigit():
+        return set()
+    posibles = {raiz(prefijo)}
+    for corte in range(LONGITUD_MINIMA_RAIZ, len(prefijo)):
+        if prefijo[corte:] in COMIENZOS_TERMINACION:
+            posibles.add(prefijo[:corte])
+    return posibles
+
+
+def coincide_prefijo(termino, prefijo, posibles):
+    return termino.startswith(prefijo) or termino in posibles
+
+
+# --- Documentos indexables ---
+# Para cada modelo, los textos que se indexan y el peso de cada uno.
+
+def documento_servicio(servicio):
+    return [
+        (servicio.titulo_servicio, 3),
+        (servicio.descripcion_servicio, 1),
+        (servicio.usuario_oferente.username, 2),
+    ]
+
+
+def documento_vacante(vacante):
+    return [
+        (vacante.titulo_vacante, 3),
+        (vacante.descripcion_puesto, 1),
+        (vacante.requisitos, 1),
+        (vacante.ubicacion, 2),
+        (vacante.empresa.username, 2),
+    ]
+
+
+DOCUMENTOS = {
+    'usuarios.servicioofrecido': documento_servicio,
+    'usuarios.vacanteempresa': documento_vacante,
+}
+
+
+def etiqueta(modelo):
+    return modelo._meta.label_lower
+
+
+def pesos_de(instancia):
+    """ Devuelve {termino: peso} para una instancia indexable. """
+    pesos = defaultdict(float)
+    for texto, peso in DOCUMENTOS[etiqueta(instancia)](instancia):
+        for termino in terminos(texto):
+            pesos[termino] += peso
+    return dict(pesos)
+
+
+def analizar_consulta(consulta, prefijo):
+    """
+    Convierte la consulta en una lista de (termino, es_prefijo). Con `prefijo`
+    el último token se busca como prefijo, para autocompletar mientras se
+    escribe: va normalizado pero sin reducir a su raíz, porque una palabra a
+    medias no se lematiza bien ("programaci"); ver raices_posibles().
+    """
+    tokens = [token for token in tokenizar(consulta) if token not in PALABRAS_VACIAS]
+    ultimo = tokens.pop() if prefijo and tokens else None
+    # Sin repetidos: cada término de la consulta debe aparecer en el documento
+    analizados = [(termino, False) for termino in dict.fromkeys(raiz(token) for token in tokens)]
+    if ultimo is not None:
+        analizados.append((ultimo, True))
+    return analizados
+
+
+# --- Backends ---
+
+class BackendBusqueda:
+    """
+    Interfaz común. `buscar` devuelve una lista de (pk, puntuacion) ordenada de
+    mayor a menor relevancia, con solo los documentos que contienen todos los
+    términos de la consulta.
+    """
+    def indexar(self, instancia):
+        raise NotImplementedError
+
+    def eliminar(self, modelo, pk):
+        raise NotImplementedError
+
+    def buscar(self, modelo, consulta, prefijo=True, limite=None, dentro_de=None):
+        """ `dentro_de`: queryset del modelo al que se restringen los resultados antes del límite. """
+        raise NotImplementedError
+
+    def vaciar(self, modelo):
+        raise NotImplementedError
+
+    def reconstruir(self, modelo, lote=500):
+        self.vaciar(modelo)
+        queryset = modelo.objects.all()
+        if etiqueta(modelo) == 'usuarios.servicioofrecido':
+            queryset = queryset.select_related('usuario_oferente')
+        elif etiqueta(modelo) == 'usuarios.vacanteempresa':
+            queryset = queryset.select_related('empresa')
+        total = 0
+        for instancia in queryset.iterator(chunk_size=lote):
+            self.indexar(instancia)
+            total += 1
+        return total
+
+    @staticmethod
+    def idf(total_documentos, frecuencia):
+        return math.log(1 + total_documentos / frecuencia)
+
+
+class BackendMemoria(BackendBusqueda):
+    """
+    Índice invertido en memoria del proceso. No se comparte entre procesos:
+    cada proceso lo construye desde la base de datos en su primera búsqueda.
+    """
+
+    def __init__(self):
+        self._construidos = set()
+        self._lock = threading.Lock()
+        self._listas = defaultdict(lambda: defaultdict(dict))  # modelo -> termino -> {pk: peso}
+        self._documentos = defaultdict(dict)  # modelo -> pk -> [terminos]
+        self._ordenados = {}  # modelo -> lista ordenada de términos, para prefijos
+
+    def indexar(self, instancia):
+        modelo, pesos = etiqueta(instancia), pesos_de(instancia)
+        with self._lock:
+            self._quitar(modelo, instancia.pk)
+            for termino, peso in pesos.items():
+                self._listas[modelo][termino][instancia.pk] = peso
+            self._documentos[modelo][instancia.pk] = list(pesos)
+            self._ordenados.pop(modelo, None)
+
+    def eliminar(self, modelo, pk):
+        with self._lock:
+            self._quitar(etiqueta(modelo), pk)
+            self._ordenados.pop(etiqueta(modelo), None)
+
+    def vaciar(self, modelo):
+        with self._lock:
+            self._construidos.discard(etiqueta(modelo))
+            self._listas.pop(etiqueta(modelo), None)
+            self._documentos.pop(etiqueta(modelo), None)
+            self._ordenados.pop(etiqueta(modelo), None)
+
+    def reconstruir(self, modelo, lote=500):
+        total = super().reconstruir(modelo, lote)
+        self._construidos.add(etiqueta(modelo))
+        return total
+
+    def _quitar(self, modelo, pk):
+        for termino in self._documentos[modelo].pop(pk, []):
+            lista = self._listas[modelo][termino]
+            lista.pop(pk, None)
+            if not lista:
+                del self._listas[modelo][termino]
+
+    def _expandir(self, modelo, termino, es_prefijo):
+        if not es_prefijo:
+            return [termino] if termino in self._listas[modelo] else []
+        if modelo not in self._ordenados:
+            self._ordenados[modelo] = sorted(self._listas[modelo])
+        ordenados = self._ordenados[modelo]
+        expandidos = [posible for posible in raices_posibles(termino) if posible in self._listas[modelo]]
+        for i in range(bisect_left(ordenados, termino), len(ordenados)):
+            if not ordenados[i].startswith(termino):
+                break
+            expandidos.append(ordenados[i])
+        # Una raíz posible puede empezar también por el prefijo
+        return list(dict.fromkeys(expandidos))
+
+    def buscar(self, modelo, consulta, prefijo=True, limite=None, dentro_de=None):
+        if etiqueta(modelo) not in self._construidos:
+            self.reconstruir(modelo)
+        modelo = etiqueta(modelo)
+        analizados = analizar_consulta(consulta, prefijo)
+        if not analizados:
+            return []
+        with self._lock:
+            total = len(self._documentos[modelo])
+            puntuaciones, coincidencias = defaultdict(float), defaultdict(int)
+            for termino, es_prefijo in analizados:
+                vistos = set()
+                for expandido in self._expandir(modelo, termino, es_prefijo):
+                    lista = self._listas[modelo][expandido]
+                    idf = self.idf(total, len(lista))
+                    for pk, peso in lista.items():
+                        puntuaciones[pk] += peso * idf
+                        vistos.add(pk)
+                for pk in vistos:
+                    coincidencias[pk] += 1
+        permitidos = set(dentro_de.values_list('pk', flat=True)) if dentro_de is not None else None
+        resultados = sorted(
+            (
+                (pk, puntuacion) for pk, puntuacion in puntuaciones.items()
+                if coincidencias[pk] == len(analizados) and (permitidos is None or pk in permitidos)
+            ),
+            key=lambda resultado: (-resultado[1], -resultado[0])
+        )
+        return resultados[:limite] if limite else resultados
+
+
+class BackendBaseDatos(BackendBusqueda):
+    """
+    Índice invertido en la tabla TerminoIndexado. Las búsquedas exactas y por
+    prefijo usan el índice (modelo, termino), y la puntuación se calcula en la
+    base de datos con una sola consulta agregada.
+    """
+
+    # El total de documentos solo se usa para el idf; basta con refrescarlo de vez en cuando
+    SEGUNDOS_TOTAL = 60
+
+    def __init__(self):
+        self._totales = {}
+
+    @property
+    def tabla(self):
+        from .models import TerminoIndexado
+        return TerminoIndexado
+
+    def total_documentos(self, modelo):
+        total, calculado = self._totales.get(modelo, (None, 0))
+        if total is None or time.monotonic() - calculado > self.SEGUNDOS_TOTAL:
+            total = self.tabla.objects.filter(modelo=modelo).values('objeto_id').distinct().count()
+            self._totales[modelo] = (total, time.monotonic())
+        return max(total, 1)
+
+    def indexar(self, instancia):
+        modelo = etiqueta(instancia)
+        filas = [
+            self.tabla(modelo=modelo, objeto_id=instancia.pk, termino=termino[:40], peso=peso)
+            for termino, peso in pesos_de(instancia).items()
+        ]
+        with transaction.atomic():
+            self.tabla.objects.filter(modelo=modelo, objeto_id=instancia.pk).delete()
+            self.tabla.objects.bulk_create(filas)
+
+    def eliminar(self, modelo, pk):
+        self.tabla.objects.filter(modelo=etiqueta(modelo), objeto_id=pk).delete()
+
+    def vaciar(self, modelo):
+        self.tabla.objects.filter(modelo=etiqueta(modelo)).delete()
+
+    def buscar(self, modelo, consulta, prefijo=True, limite=None, dentro_de=None):
+        modelo = etiqueta(modelo)
+        analizados = analizar_consulta(consulta, prefijo)
+        if not analizados:
+            return []
+        filas = self.tabla.objects.filter(modelo=modelo)
+
+        condicion = models.Q()
+        posibles = {}
+        for termino, es_prefijo in analizados:
+            if es_prefijo:
+                posibles[termino] = raices_posibles(termino)
+                condicion |= models.Q(termino__startswith=termino) | models.Q(termino__in=posibles[termino])
+            else:
+                condicion |= models.Q(termino=termino)
+
+        # Frecuencia de documento de cada término concreto que coincide con la consulta
+        frecuencias = dict(
+            filas.filter(condicion).values('termino').annotate(df=models.Count('objeto_id')).values_list('termino', 'df')
+        )
+        if not frecuencias:
+            return []
+        total = self.total_documentos(modelo)
+
+        # Cada término concreto aporta su idf y cuenta para el token de la consulta que lo generó
+        idf, token_de = [], []
+        for termino, df in frecuencias.items():
+            for posicion, (buscado, es_prefijo) in enumerate(analizados):
+                if termino == buscado or (es_prefijo and coincide_prefijo(termino, buscado, posibles[buscado])):
+                    token_de.append(models.When(termino=termino, then=models.Value(posicion)))
+                    break
+            idf.append(models.When(termino=termino, then=models.Value(self.idf(total, df))))
+
+        candidatas = filas.filter(termino__in=list(frecuencias))
+        if dentro_de is not None:
+            candidatas = candidatas.filter(objeto_id__in=dentro_de.values('pk'))
+        resultados = candidatas.values('objeto_id').annotate(
+            puntuacion=models.Sum(models.F('peso') * models.Case(*idf, output_field=models.FloatField())),
+            tokens=models.Count(models.Case(*token_de, output_field=models.IntegerField()), distinct=True),
+        ).filter(tokens=len(analizados)).order_by('-puntuacion', '-objeto_id').values_list('objeto_id', 'puntuacion')
+        if limite:
+            resultados = resultados[:limite]
+        return list(resultados)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def obtener_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                ruta = getattr(settings, 'BUSQUEDA', {}).get('BACKEND', 'usuarios.busqueda.BackendBaseDatos')
+                _backend = import_string(ruta)()
+    return _backend
+
+
+def reiniciar_backend():
+    """ Olvida el backend actual (útil en pruebas que cambian settings.BUSQUEDA). """
+    global _backend
+    _backend = None
+
+
+# --- Filtro para las vistas de DRF ---
+
+class BusquedaIndexadaFilter(BaseFilterBackend):
+    """
+    Sustituye a SearchFilter: usa el mismo parámetro (?search=) pero resuelve la
+    consulta en el índice invertido y ordena por relevancia. El último término
+    se busca como prefijo salvo que se envíe ?prefijo=0.
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        consulta = request.query_params.get(self.search_param, '').strip()
+        if not consulta:
+            return queryset
+        prefijo = request.query_params.get('prefijo', '1') != '0'
+        limite = getattr(settings, 'BUSQUEDA', {}).get('LIMITE_RESULTADOS', 500)
+        # Los filtros de la vista (p. ej. activo=True) se aplican antes del límite
+        resultados = obtener_backend().buscar(
+            queryset.model, consulta, prefijo=prefijo, limite=limite, dentro_de=queryset
+        )
+        if not resultados:
+            return queryset.none()
+        orden = models.Case(
+            *[models.When(pk=pk, then=models.Value(posicion)) for posicion, (pk, _) in enumerate(resultados)],
+            output_field=models.IntegerField(),
+        )
+        return queryset.filter(pk__in=[pk for pk, _ in resultados]).order_by(orden)
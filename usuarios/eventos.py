@@ -0,0 +1,14 @@
+# usuarios/eventos.py
+"""
+Señales propias del dominio para las operaciones en bloque, que guardan con
+bulk_create o UPDATE y por eso no disparan post_save. Se envían dentro de la
+transacción de la operación; los receptores viven en usuarios/signals.py.
+"""
+from django.dispatch import Signal
+
+# mensajes=[Mensaje] guardados por usuarios.mensajeria.registrar_mensajes()
+mensajes_registrados = Signal()
+
+# cambios=[{'id', 'vacante_id', 'profesional_id', 'estado_anterior', 'estado'}]
+# aplicados por Postulacion.cambiar_estado_en_lote()
+estados_postulacion_cambiados = Signal()
@@ -0,0 +1,133 @@
+# usuarios/fragmentos.py
+"""
+Caché de fragmentos serializados para las lecturas públicas (servicios,
+vacantes y perfiles públicos).
+
+Cada objeto serializado se guarda en la caché de Django bajo una clave que
+incluye la versión de todo aquello de lo que depende, p. ej. un servicio:
+
+    ('servicio', 12)  -> sus campos e imágenes
+    ('usuario', 7)    -> username, reseñas y promedio del oferente
+    ('perfil', 7)     -> totales del perfil público (servicios y vacantes)
+
+Las señales (usuarios/signals.py) cambian la versión al guardar o borrar,
+así que un fragmento obsoleto simplemente deja de encontrarse y caduca solo.
+Los campos que dependen de quién pregunta (p. ej. usuario_ha_contactado) se
+declaran en campos_fuera_del_fragmento y se calculan en cada petición.
+
+La caché debe ser compartida por todos los procesos (Redis/Memcached, ver
+settings.FRAGMENTOS): las versiones que cambia invalidar() solo se ven donde
+se guardan. LocMemCache, por proceso, sirve para pruebas con un solo proceso.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def ajuste(nombre, por_defecto):
+    return getattr(settings, 'FRAGMENTOS', {}).get(nombre, por_defecto)
+
+
+def _cache():
+    return caches[ajuste('CACHE', 'default')]
+
+
+def clave_version(dependencia):
+    modelo, pk = dependencia
+    return f"fragmento:version:{modelo}:{pk}"
+
+
+def _nueva_version():
+    return uuid.uuid4().hex[:12]
+
+
+def versiones(dependencias):
+    """ {dependencia: versión} para un conjunto de (modelo, pk), en una o dos idas a la caché. """
+    cache = _cache()
+    claves = {clave_version(dependencia): dependencia for dependencia in dependencias}
+    encontradas = cache.get_many(list(claves))
+    faltantes = [clave for clave in claves if clave not in encontradas]
+    if faltantes:
+        # Una versión aleatoria (no 1) para que nunca coincida con fragmentos de
+        # antes de que la versión se perdiera de la caché. add() no pisa la que
+        # otro proceso haya creado a la vez.
+        for clave in faltantes:
+            cache.add(clave, _nueva_version(), None)
+        encontradas.update(cache.get_many(faltantes))
+    return {claves[clave]: version for clave, version in encontradas.items()}
+
+
+def invalidar(modelo, pk):
+    if pk is not None:
+        _cache().set(clave_version((modelo, pk)), _nueva_version(), None)
+
+
+def obtener(serializer, objetos):
+    """
+    Busca los fragmentos de `objetos` para `serializer` (la instancia hija).
+    Devuelve ({pk: fragmento}, {pk: clave}); las claves sirven para guardar
+    después los que falten.
+    """
+    if not objetos or not serializer.usar_fragmentos():
+        return {}, {}
+    dependencias = {obj.pk: serializer.dependencias_fragmento(obj) for obj in objetos}
+    vigentes = versiones({dependencia for lista in dependencias.values() for dependencia in lista})
+    claves = {
+        pk: serializer.clave_fragmento(pk, [vigentes.get(dependencia, '') for dependencia in lista])
+        for pk, lista in dependencias.items()
+    }
+    encontrados = _cache().get_many(list(claves.values()))
+    return {pk: encontrados[clave] for pk, clave in claves.items() if clave in encontrados}, claves
+
+
+def guardar(clave, fragmento):
+    _cache().set(clave, fragmento, ajuste('TTL_SEGUNDOS', 3600))
+
+
+class FragmentoCacheadoMixin:
+    """
+    Para ModelSerializers de lectura pública. La subclase define
+    dependencias_fragmento(obj); su ListSerializer puede precargar todos los
+    fragmentos de la página con obtener() y dejarlos en self.fragmentos.
+    """
+    cachear_fragmento = True
+    campos_fuera_del_fragmento = ()
+
+    def dependencias_fragmento(self, obj):
+        raise NotImplementedError
+
+    def usar_fragmentos(self):
+        # Las URLs absolutas de las imágenes dependen del host de la petición
+        return self.cachear_fragmento and self.context.get('request') is not None
+
+    def clave_fragmento(self, pk, versiones_dependencias):
+        request = self.context['request']
+        return ':'.join([
+            'fragmento', type(self).__name__, request.scheme, request.get_host(), str(pk), *versiones_dependencias,
+        ])
+
+    def to_representation(self, instance):
+        if not self.usar_fragmentos():
+            return super().to_representation(instance)
+        encontrados = getattr(self.parent, 'fragmentos', None)
+        claves = getattr(self.parent, 'claves_fragmento', None)
+        if encontrados is None or claves is None:
+            encontrados, claves = obtener(self, [instance])
+
+        fragmento = encontrados.get(instance.pk)
+        if fragmento is None:
+            datos = super().to_representation(instance)
+            if instance.pk in claves:
+                guardar(claves[instance.pk], {
+                    campo: valor for campo, valor in datos.items() if campo not in self.campos_fuera_del_fragmento
+                })
+            return datos
+
+        datos = {}
+        for campo in self._readable_fields:
+            if campo.field_name in self.campos_fuera_del_fragmento:
+                datos[campo.field_name] = campo.to_representation(campo.get_attribute(instance))
+            else:
+                datos[campo.field_name] = fragmento[campo.field_name]
+        return datos
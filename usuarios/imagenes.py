@@ -0,0 +1,110 @@
+# usuarios/imagenes.py
+"""
+Derivados de las imágenes de la galería de servicios: miniatura y tamaño
+mediano en WebP y JPEG, guardados junto al original en el mismo storage:
+
+    servicios_galeria/foto.jpg
+    servicios_galeria/foto__miniatura.webp
+    servicios_galeria/foto__miniatura.jpg
+    servicios_galeria/foto__mediana.webp
+    ...
+
+Con AlmacenamientoDeduplicado el original es un blob por contenido y sus
+variantes se comparten entre todas las filas que lo usan; se escriben con
+nombre fijo a través de storage.derivados.
+
+Este módulo no importa modelos para que generar_variantes() pueda
+ejecutarse en procesos hijos (ver el comando generar_variantes_imagenes).
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# nombre -> caja máxima (ancho, alto); se respeta la proporción y nunca se amplía
+VARIANTES = {
+    'miniatura': (320, 320),
+    'mediana': (1024, 1024),
+}
+
+# formato de Pillow -> (extensión, opciones de guardado)
+FORMATOS = {
+    'WEBP': ('webp', {'quality': 80, 'method': 4}),
+    'JPEG': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def nombre_variante(nombre_original, variante, extension):
+    base, _ = os.path.splitext(nombre_original)
+    return f"{base}__{variante}.{extension}"
+
+
+def _a_rgb(imagen):
+    """ JPEG no admite transparencia: se compone sobre fondo blanco. """
+    if imagen.mode in ('RGBA', 'LA') or (imagen.mode == 'P' and 'transparency' in imagen.info):
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        return fondo
+    return imagen.convert('RGB')
+
+
+def generar_variantes(nombre_original, storage=None):
+    """
+    Genera todas las variantes de una imagen y devuelve el mapa que se guarda
+    en ImagenServicio.variantes:
+
+        {'miniatura': {'ancho': 320, 'alto': 180, 'webp': '<nombre>', 'jpg': '<nombre>'}, ...}
+    """
+    storage = storage or default_storage
+    destino = getattr(storage, 'derivados', storage)
+    caja_mayor = max(VARIANTES.values())
+    with storage.open(nombre_original, 'rb') as archivo:
+        imagen = Image.open(archivo)
+        # En JPEG, draft() decodifica directamente a una escala reducida (1/2, 1/4, 1/8),
+        # lo que evita descomprimir un 4K completo para sacar una miniatura.
+        imagen.draft('RGB', (caja_mayor[0] * 2, caja_mayor[1] * 2))
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.load()
+
+    resultado = {}
+    # De mayor a menor: cada variante se reduce a partir de la anterior
+    for variante, caja in sorted(VARIANTES.items(), key=lambda par: par[1], reverse=True):
+        imagen = imagen.copy()
+        imagen.thumbnail(caja, Image.Resampling.LANCZOS)
+        datos = {'ancho': imagen.width, 'alto': imagen.height}
+        for formato, (extension, opciones) in FORMATOS.items():
+            salida = BytesIO()
+            (imagen if formato == 'WEBP' else _a_rgb(imagen)).save(salida, formato, **opciones)
+            nombre = nombre_variante(nombre_original, variante, extension)
+            if destino.exists(nombre):
+                destino.delete(nombre)
+            datos[extension] = destino.save(nombre, ContentFile(salida.getvalue()))
+        resultado[variante] = datos
+    return resultado
+
+
+def borrar_variantes_de(nombre_original, storage=None):
+    storage = storage or default_storage
+    for variante in VARIANTES:
+        for extension, _ in FORMATOS.values():
+            nombre = nombre_variante(nombre_original, variante, extension)
+            if storage.exists(nombre):
+                storage.delete(nombre)
+
+
+def srcset(variantes, url):
+    """
+    Convierte el mapa de variantes en un srcset por formato:
+        {'webp': 'https://.../foto__miniatura.webp 320w, https://.../foto__mediana.webp 1024w', 'jpg': ...}
+    `url` convierte un nombre del storage en URL absoluta.
+    """
+    if not variantes:
+        return {}
+    ordenadas = sorted(variantes.values(), key=lambda datos: datos['ancho'])
+    return {
+        extension: ', '.join(f"{url(datos[extension])} {datos['ancho']}w" for datos in ordenadas if datos.get(extension))
+        for extension, _ in FORMATOS.values()
+    }
@@ -0,0 +1,94 @@
+# usuarios/management/commands/carga_chat.py
+import asyncio
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from chat import escritor, limites
+from chat.routing import websocket_urlpatterns
+from usuarios.models import Conversacion, Usuario
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga del chat: abre websockets en parejas dentro del proceso, cada "
+        "cliente manda sus mensajes sin esperar y se mide cuántos mensajes por segundo "
+        "se guardan y reparten con cada tamaño de lote. --lotes 1 equivale a guardar "
+        "mensaje por mensaje, como antes del escritor por lotes. Crea usuarios y "
+        "conversaciones temporales en la base de datos configurada y los borra al final; "
+        "úsese en desarrollo o staging. Durante la medición no se aplican los límites de "
+        "frecuencia ni la cola de salida acotada del chat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=20, help="Websockets abiertos (en parejas por conversación).")
+        parser.add_argument('--mensajes', type=int, default=50, help="Mensajes que manda cada cliente.")
+        parser.add_argument('--lotes', default='1,100',
+                            help="Tamaños máximos de lote a comparar, separados por comas.")
+        parser.add_argument('--espera-ms', type=float, default=5, help="Espera máxima para cerrar un lote.")
+
+    def handle(self, *args, **options):
+        clientes = max(options['clientes'] // 2 * 2, 2)
+        prefijo = f"carga_{uuid.uuid4().hex[:8]}_"
+        usuarios = [Usuario.objects.create_user(username=f"{prefijo}{numero}") for numero in range(clientes)]
+        try:
+            tokens = {usuario.pk: Token.objects.create(user=usuario).key for usuario in usuarios}
+            salas = []
+            for ana, beto in zip(usuarios[::2], usuarios[1::2]):
+                conversacion = Conversacion.objects.create()
+                conversacion.participantes.add(ana, beto)
+                salas.append((conversacion.pk, [tokens[ana.pk], tokens[beto.pk]]))
+
+            for lote in (int(valor) for valor in options['lotes'].split(',')):
+                escritor.reiniciar_escritor(lote_maximo=lote, espera_ms=0 if lote == 1 else options['espera_ms'])
+                # Se mide el escritor: cubos que no se vacían y cola de salida sin tope
+                sin_limites = {
+                    'RAFAGA_CONEXION': options['mensajes'] + 1, 'RAFAGA_USUARIO': options['mensajes'] + 1,
+                    'COLA_SALIDA_MAXIMA': 0,
+                }
+                limites.reiniciar_cubos()
+                with override_settings(CHAT={**getattr(settings, 'CHAT', {}), **sin_limites}):
+                    segundos = async_to_sync(self.medir)(salas, options['mensajes'])
+                total = clientes * options['mensajes']
+                actual = escritor.obtener_escritor()
+                self.stdout.write(
+                    f"lote máximo {lote:>4}: {total} mensajes en {segundos:.2f} s -> "
+                    f"{total / segundos:,.0f} mensajes/s ({actual.lotes} lotes)"
+                )
+        finally:
+            escritor.reiniciar_escritor()
+            limites.reiniciar_cubos()
+            Conversacion.objects.filter(participantes__username__startswith=prefijo).delete()
+            Usuario.objects.filter(username__startswith=prefijo).delete()
+
+    @staticmethod
+    async def medir(salas, mensajes):
+        aplicacion = URLRouter(websocket_urlpatterns)
+        comunicadores = []
+        for conversacion_id, tokens in salas:
+            for token in tokens:
+                comunicador = WebsocketCommunicator(aplicacion, f"/ws/chat/{conversacion_id}/?token={token}")
+                conectado, _ = await comunicador.connect()
+                if not conectado:
+                    raise RuntimeError(f"No se pudo conectar a la conversación {conversacion_id}.")
+                comunicadores.append(comunicador)
+
+        async def cliente(comunicador):
+            for numero in range(mensajes):
+                await comunicador.send_json_to({'message': f"mensaje {numero}"})
+            # Cada cliente recibe los suyos y los de su pareja
+            for _ in range(mensajes * 2):
+                await comunicador.receive_json_from(timeout=60)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente(comunicador) for comunicador in comunicadores))
+        segundos = time.perf_counter() - inicio
+        for comunicador in comunicadores:
+            await comunicador.disconnect()
+        return segundos
@@ -0,0 +1,114 @@
+# usuarios/management/commands/deduplicar_media.py
+import os
+from collections import Counter
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from usuarios import fragmentos
+from usuarios.almacenamiento import almacenamiento_deduplicado, digest_de, es_nombre_blob, nombre_blob
+from usuarios.imagenes import borrar_variantes_de
+from usuarios.models import BlobAlmacenado, ImagenServicio, Usuario
+from usuarios.tareas import encolar
+
+CAMPOS = ((Usuario, 'cv'), (ImagenServicio, 'imagen'))
+DIRECTORIOS = ('cvs', 'servicios', 'servicios_galeria')
+
+
+class Command(BaseCommand):
+    help = (
+        "Migra los CV e imágenes existentes al almacenamiento por contenido: guarda cada "
+        "archivo distinto una sola vez, apunta las filas al blob, recalcula las referencias "
+        "y borra las copias repetidas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true',
+                            help="Solo informa de lo que haría, sin tocar archivos ni filas.")
+        parser.add_argument('--borrar-huerfanos', action='store_true',
+                            help="Borra también los archivos de media que ninguna fila referencia.")
+
+    def handle(self, *args, **options):
+        storage = almacenamiento_deduplicado
+        simular = options['simular']
+        referencias = Counter()
+        reemplazados = set()
+        bytes_liberados = 0
+
+        for modelo, campo in CAMPOS:
+            filas = modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+            for pk, nombre in filas.values_list('pk', campo):
+                if es_nombre_blob(nombre):
+                    referencias[nombre] += 1
+                    continue
+                if not storage.exists(nombre):
+                    self.stderr.write(f"{modelo.__name__} {pk}: no existe {nombre}, se omite.")
+                    continue
+                with storage.open(nombre, 'rb') as archivo:
+                    if simular:
+                        directorio, base = os.path.split(nombre)
+                        nuevo = nombre_blob(directorio, digest_de(File(archivo)), os.path.splitext(base)[1])
+                    else:
+                        nuevo = storage.save(nombre, File(archivo))
+                if nombre not in reemplazados and nuevo in referencias:
+                    # Otro archivo con el mismo contenido ya se migró a este blob
+                    bytes_liberados += storage.size(nombre)
+                referencias[nuevo] += 1
+                reemplazados.add(nombre)
+                self.stdout.write(f"{nombre} -> {nuevo}")
+                if simular:
+                    continue
+                cambios = {campo: nuevo}
+                if modelo is ImagenServicio:
+                    # Las variantes se regeneran (una vez por blob) con el nombre nuevo
+                    cambios.update(variantes={}, estado='pendiente')
+                modelo.objects.filter(pk=pk).update(**cambios)
+                if modelo is ImagenServicio:
+                    servicio_id = ImagenServicio.objects.filter(pk=pk).values_list('servicio_id', flat=True).first()
+                    fragmentos.invalidar('servicio', servicio_id)
+                    encolar('procesar_imagen_servicio', imagen_id=pk)
+
+        huerfanos = self.huerfanos(storage, set(referencias) | reemplazados)
+        for nombre in huerfanos:
+            self.stdout.write(f"Huérfano: {nombre}")
+
+        if simular:
+            self.stdout.write(self.style.SUCCESS(
+                f"Simulación: {len(reemplazados)} archivos a migrar en {len(referencias)} blobs, "
+                f"~{bytes_liberados} bytes duplicados, {len(huerfanos)} huérfanos."
+            ))
+            return
+
+        with transaction.atomic():
+            BlobAlmacenado.objects.all().delete()
+            BlobAlmacenado.objects.bulk_create(
+                BlobAlmacenado(nombre=nombre, referencias=total, tamaño=BlobAlmacenado.tamaño_de(nombre))
+                for nombre, total in referencias.items()
+            )
+
+        for nombre in reemplazados:
+            storage.delete(nombre)
+            borrar_variantes_de(nombre, storage.derivados)
+        if options['borrar_huerfanos']:
+            for nombre in huerfanos:
+                storage.delete(nombre)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(reemplazados)} archivos migrados a {len(referencias)} blobs, "
+            f"{bytes_liberados} bytes duplicados liberados."
+        ))
+
+    @staticmethod
+    def huerfanos(storage, conocidos):
+        """ Archivos de media que no son un blob referenciado, un original migrado ni una variante de ellos. """
+        prefijos = {os.path.splitext(nombre)[0] + '__' for nombre in conocidos}
+        encontrados = []
+        for directorio in DIRECTORIOS:
+            raiz = os.path.join(storage.location, directorio)
+            for carpeta, _, archivos in os.walk(raiz):
+                for archivo in archivos:
+                    nombre = os.path.relpath(os.path.join(carpeta, archivo), storage.location).replace(os.sep, '/')
+                    if nombre in conocidos or any(nombre.startswith(prefijo) for prefijo in prefijos):
+                        continue
+                    encontrados.append(nombre)
+        return sorted(encontrados)
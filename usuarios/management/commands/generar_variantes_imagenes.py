@@ -0,0 +1,55 @@
+# usuarios/management/commands/generar_variantes_imagenes.py
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from usuarios import fragmentos
+from usuarios.imagenes import generar_variantes
+from usuarios.models import ImagenServicio
+
+
+def _procesar(imagen_id, nombre):
+    # Se ejecuta en un proceso hijo: solo toca el storage, nunca la base de datos
+    try:
+        return imagen_id, generar_variantes(nombre), None
+    except Exception as error:  # el proceso padre informa y sigue con las demás
+        return imagen_id, None, f"{type(error).__name__}: {error}"
+
+
+class Command(BaseCommand):
+    help = "Genera miniaturas y variantes WebP/JPEG de las imágenes de servicios que aún no las tienen."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help="Procesos en paralelo (por defecto, uno por CPU).")
+        parser.add_argument('--todas', action='store_true',
+                            help="Regenera también las imágenes que ya tienen variantes.")
+
+    def handle(self, *args, **options):
+        imagenes = ImagenServicio.objects.exclude(imagen='')
+        if not options['todas']:
+            imagenes = imagenes.filter(variantes={})
+        pendientes = list(imagenes.values_list('id', 'imagen', 'servicio_id'))
+        if not pendientes:
+            self.stdout.write("No hay imágenes pendientes.")
+            return
+
+        # Las conexiones abiertas no deben heredarse en los procesos hijos
+        connections.close_all()
+        correctas = errores = 0
+        with ProcessPoolExecutor(max_workers=max(1, options['procesos']), initializer=django.setup) as pool:
+            tareas = [pool.submit(_procesar, imagen_id, nombre) for imagen_id, nombre, _ in pendientes]
+            servicios = {imagen_id: servicio_id for imagen_id, _, servicio_id in pendientes}
+            for tarea in as_completed(tareas):
+                imagen_id, variantes, error = tarea.result()
+                if error:
+                    errores += 1
+                    self.stderr.write(f"Imagen {imagen_id}: {error}")
+                    continue
+                ImagenServicio.objects.filter(pk=imagen_id).update(variantes=variantes, estado='listo', error='')
+                fragmentos.invalidar('servicio', servicios[imagen_id])
+                correctas += 1
+
+        self.stdout.write(self.style.SUCCESS(f"{correctas} imágenes procesadas, {errores} con errores."))
@@ -0,0 +1,36 @@
+# usuarios/management/commands/procesar_tareas.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from usuarios import tareas
+
+
+class Command(BaseCommand):
+    help = "Trabajador de la cola de tareas en base de datos (imágenes, CV...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=10, help="Tareas reclamadas por consulta.")
+        parser.add_argument('--intervalo', type=float, default=2.0,
+                            help="Segundos de espera cuando la cola está vacía.")
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Procesa lo pendiente y termina en lugar de quedarse esperando.")
+
+    def handle(self, *args, **options):
+        trabajador = tareas.nombre_trabajador()
+        self.stdout.write(f"Trabajador {trabajador} iniciado.")
+        try:
+            while True:
+                close_old_connections()
+                liberadas = tareas.liberar_abandonadas()
+                if liberadas:
+                    self.stdout.write(f"{liberadas} tareas abandonadas liberadas (reintentadas o fallidas).")
+                ejecutadas = tareas.procesar_pendientes(options['lote'], trabajador)
+                if ejecutadas:
+                    self.stdout.write(f"{ejecutadas} tareas ejecutadas.")
+                if options['una_vez']:
+                    break
+                if not ejecutadas:
+                    time.sleep(options['intervalo'])
+        except KeyboardInterrupt:
+            self.stdout.write("Trabajador detenido.")
@@ -0,0 +1,18 @@
+# usuarios/management/commands/purgar_notificaciones.py
+from django.core.management.base import BaseCommand
+from usuarios import notificaciones
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra las notificaciones más antiguas que NOTIFICACIONES['RETENCION_DIAS']. "
+        "Un cliente que vuelva con un cursor anterior solo recibe lo que quede; "
+        "pensado para ejecutarse a diario (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None, help="Retención en días (por defecto, la de settings).")
+
+    def handle(self, *args, **options):
+        borradas = notificaciones.purgar(options['dias'])
+        self.stdout.write(self.style.SUCCESS(f"{borradas} notificaciones borradas."))
@@ -0,0 +1,24 @@
+# usuarios/management/commands/recalcular_calificaciones.py
+from django.core.management.base import BaseCommand
+from usuarios.models import Reseña, ResumenCalificacion
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde cero los resúmenes de calificación de todos los usuarios reseñados."
+
+    def handle(self, *args, **options):
+        # Resúmenes huérfanos (usuarios que ya no tienen reseñas)
+        borrados, _ = ResumenCalificacion.objects.exclude(
+            evaluado_id__in=Reseña.objects.values('evaluado_id')
+        ).delete()
+
+        evaluados = Reseña.objects.values_list('evaluado_id', flat=True).order_by().distinct()
+        total = 0
+
+        for usuario_id in evaluados:
+            ResumenCalificacion.recalcular(usuario_id)
+            total += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Resúmenes recalculados para {total} usuarios ({borrados} huérfanos eliminados)."
+        ))
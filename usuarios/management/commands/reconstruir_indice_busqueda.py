@@ -0,0 +1,15 @@
+# usuarios/management/commands/reconstruir_indice_busqueda.py
+from django.core.management.base import BaseCommand
+from usuarios.busqueda import obtener_backend
+from usuarios.models import ServicioOfrecido, VacanteEmpresa
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde cero el índice de búsqueda de servicios y vacantes."
+
+    def handle(self, *args, **options):
+        backend = obtener_backend()
+        for modelo in (ServicioOfrecido, VacanteEmpresa):
+            total = backend.reconstruir(modelo)
+            self.stdout.write(f"{modelo._meta.verbose_name_plural}: {total} documentos indexados.")
+        self.stdout.write(self.style.SUCCESS("Índice de búsqueda reconstruido."))
@@ -0,0 +1,272 @@
+# usuarios/medios.py
+"""
+Servicio de archivos de MEDIA_ROOT en producción.
+
+- ETag fuerte: el SHA-256 del contenido. Para los blobs (ver
+  usuarios/almacenamiento.py) es su propio nombre; para el resto se calcula
+  una vez y se recuerda mientras no cambien tamaño ni fecha.
+- If-None-Match / If-Modified-Since -> 304 sin leer el archivo.
+- Range de un solo intervalo (visores de PDF, descargas reanudables) -> 206.
+- Los nombres por contenido nunca cambian de contenido: caché "immutable" de un año.
+- Con settings.MEDIA_SERVIR['MODO'] = 'x-accel' o 'x-sendfile' Django solo
+  decide (permisos, 304, cabeceras) y el proxy envía los bytes.
+
+Los CV (cvs/...) solo se entregan con una firma temporal emitida por los
+serializers que ya deciden quién puede ver cada CV, o a un usuario autenticado
+con permiso: el dueño, staff o una empresa que recibió su postulación.
+"""
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+
+from .almacenamiento import es_nombre_blob
+from .autenticacion import TokenAuthenticationCacheada
+from .models import Postulacion
+
+PREFIJO_CV = 'cvs/'
+TAMAÑO_BLOQUE = 64 * 1024
+UN_AÑO = 365 * 24 * 3600
+_firmador = signing.TimestampSigner(salt='usuarios.medios')
+
+
+def ajuste(nombre, por_defecto):
+    return getattr(settings, 'MEDIA_SERVIR', {}).get(nombre, por_defecto)
+
+
+# --- Firmas de los CV ---
+
+def firmar(nombre):
+    return _firmador.sign(nombre)[len(nombre) + 1:]
+
+
+def firma_valida(nombre, firma):
+    try:
+        _firmador.unsign(f"{nombre}:{firma}", max_age=ajuste('FIRMA_TTL_SEGUNDOS', 3600))
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def url_firmada(request, archivo):
+    """ URL absoluta de un CV con su firma temporal. """
+    if not archivo:
+        return None
+    return request.build_absolute_uri(f"{archivo.url}?firma={firmar(archivo.name)}")
+
+
+def puede_ver_cv(usuario, nombre):
+    if usuario is None or not usuario.is_authenticated:
+        return False
+    if usuario.is_staff or (usuario.cv and usuario.cv.name == nombre):
+        return True
+    return Postulacion.objects.filter(vacante__empresa=usuario, profesional__cv=nombre).exists()
+
+
+# --- ETags ---
+
+class _CacheEtags:
+    """ sha256 de archivos sin nombre por contenido, indexado por (ruta, tamaño, mtime). """
+
+    def __init__(self, maximo=2048):
+        self.maximo = maximo
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, ruta, estado):
+        clave = (ruta, estado.st_size, estado.st_mtime_ns)
+        with self._lock:
+            etag = self._entradas.get(clave)
+            if etag is not None:
+                self._entradas.move_to_end(clave)
+                return etag
+        sha = hashlib.sha256()
+        with open(ruta, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(TAMAÑO_BLOQUE), b''):
+                sha.update(bloque)
+        etag = sha.hexdigest()
+        with self._lock:
+            self._entradas[clave] = etag
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+        return etag
+
+
+_etags = _CacheEtags()
+
+
+def etag_de(nombre, ruta, estado):
+    base = os.path.basename(nombre)
+    if es_nombre_blob(nombre):
+        return os.path.splitext(base)[0]
+    return _etags.obtener(ruta, estado)
+
+
+def es_inmutable(nombre):
+    """ Blobs y sus variantes (<digest>__miniatura.webp): el nombre identifica el contenido. """
+    base = os.path.splitext(os.path.basename(nombre))[0].split('__', 1)[0]
+    return es_nombre_blob(base)
+
+
+# --- Condicionales y rangos ---
+
+def _coincide_etag(cabecera, etag):
+    if cabecera.strip() == '*':
+        return True
+    candidatos = {valor.strip().removeprefix('W/') for valor in cabecera.split(',')}
+    return quote_etag(etag) in candidatos
+
+
+def no_modificado(request, etag, mtime):
+    si_no_coincide = request.headers.get('If-None-Match')
+    if si_no_coincide is not None:
+        # Si viene If-None-Match, If-Modified-Since se ignora (RFC 9110, 13.2.2)
+        return _coincide_etag(si_no_coincide, etag)
+    desde = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return desde is not None and int(mtime) <= desde
+
+
+def rango_pedido(request, etag, mtime, tamaño):
+    """
+    Devuelve (inicio, fin) inclusivo, None para enviar el archivo completo o
+    'invalido' si el rango no se puede satisfacer. Solo se atiende un intervalo.
+    """
+    cabecera = request.headers.get('Range', '')
+    if not cabecera.startswith('bytes=') or ',' in cabecera:
+        return None
+    si_rango = request.headers.get('If-Range')
+    if si_rango is not None:
+        fecha = parse_http_date_safe(si_rango)
+        vigente = si_rango.strip() == quote_etag(etag) if fecha is None else int(mtime) <= fecha
+        if not vigente:
+            return None
+    inicio, _, fin = cabecera[len('bytes='):].strip().partition('-')
+    try:
+        if inicio == '':
+            # Sufijo: los últimos N bytes
+            largo = int(fin)
+            if largo <= 0:
+                return 'invalido'
+            return max(tamaño - largo, 0), tamaño - 1
+        inicio = int(inicio)
+        fin = int(fin) if fin else tamaño - 1
+    except ValueError:
+        return None
+    if inicio >= tamaño or fin < inicio:
+        return 'invalido'
+    return inicio, min(fin, tamaño - 1)
+
+
+def _leer_intervalo(ruta, inicio, largo):
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        while largo > 0:
+            bloque = archivo.read(min(TAMAÑO_BLOQUE, largo))
+            if not bloque:
+                return
+            largo -= len(bloque)
+            yield bloque
+
+
+class ServirMedioView(View):
+    http_method_names = ['get', 'head']
+
+    def get(self, request, nombre):
+        try:
+            ruta = safe_join(settings.MEDIA_ROOT, nombre)
+        except SuspiciousFileOperation:
+            raise Http404
+        nombre = os.path.relpath(ruta, settings.MEDIA_ROOT).replace(os.sep, '/')
+
+        es_cv = nombre.startswith(PREFIJO_CV)
+        if es_cv and not self.autorizado(request, nombre):
+            return JsonResponse({'error': 'No tienes permiso para ver este archivo.'}, status=403)
+
+        try:
+            estado = os.stat(ruta)
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404
+        if not os.path.isfile(ruta):
+            raise Http404
+
+        etag = etag_de(nombre, ruta, estado)
+        cabeceras = {
+            'ETag': quote_etag(etag),
+            'Last-Modified': http_date(estado.st_mtime),
+            'Cache-Control': self.cache_control(nombre, es_cv),
+            'Accept-Ranges': 'bytes',
+            'X-Content-Type-Options': 'nosniff',
+        }
+        if no_modificado(request, etag, estado.st_mtime):
+            respuesta = HttpResponseNotModified()
+            for clave, valor in cabeceras.items():
+                respuesta.headers[clave] = valor
+            return respuesta
+
+        tipo, codificacion = mimetypes.guess_type(ruta)
+        tipo = tipo or 'application/octet-stream'
+
+        modo = ajuste('MODO', 'django')
+        if modo in ('x-accel', 'x-sendfile'):
+            # El proxy envía el archivo (y resuelve Range); Django solo firma las cabeceras
+            respuesta = HttpResponse(content_type=tipo)
+            if modo == 'x-accel':
+                respuesta.headers['X-Accel-Redirect'] = ajuste('PREFIJO_INTERNO', '/media-interno/') + nombre
+            else:
+                respuesta.headers['X-Sendfile'] = ruta
+            for clave, valor in cabeceras.items():
+                respuesta.headers[clave] = valor
+            if es_cv:
+                respuesta.headers['Content-Disposition'] = 'inline'
+            return respuesta
+
+        rango = rango_pedido(request, etag, estado.st_mtime, estado.st_size)
+        if rango == 'invalido':
+            respuesta = HttpResponse(status=416)
+            respuesta.headers['Content-Range'] = f"bytes */{estado.st_size}"
+            return respuesta
+        if rango is None:
+            respuesta = FileResponse(open(ruta, 'rb'), content_type=tipo)
+            respuesta.headers['Content-Length'] = str(estado.st_size)
+        else:
+            inicio, fin = rango
+            largo = fin - inicio + 1
+            respuesta = StreamingHttpResponse(_leer_intervalo(ruta, inicio, largo), status=206, content_type=tipo)
+            respuesta.headers['Content-Range'] = f"bytes {inicio}-{fin}/{estado.st_size}"
+            respuesta.headers['Content-Length'] = str(largo)
+        if codificacion:
+            respuesta.headers['Content-Encoding'] = codificacion
+        for clave, valor in cabeceras.items():
+            respuesta.headers[clave] = valor
+        if es_cv:
+            respuesta.headers['Content-Disposition'] = 'inline'
+        return respuesta
+
+    def autorizado(self, request, nombre):
+        firma = request.GET.get('firma')
+        if firma and firma_valida(nombre, firma):
+            return True
+        try:
+            autenticado = TokenAuthenticationCacheada().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        return autenticado is not None and puede_ver_cv(autenticado[0], nombre)
+
+    @staticmethod
+    def cache_control(nombre, es_cv):
+        if es_cv:
+            # Nunca en cachés compartidas; el navegador revalida con el ETag
+            return 'private, no-cache'
+        if es_inmutable(nombre):
+            return f'public, max-age={UN_AÑO}, immutable'
+        return 'public, max-age=3600'
@@ -0,0 +1,134 @@
+# usuarios/membresias.py
+"""
+Caché de participantes por conversación, compartida por los websockets
+(chat.consumers) y la API REST de mensajes.
+
+Niveles, igual que usuarios/autenticacion.py:
+  1. LRU en el proceso con TTL (settings.MEMBRESIAS_CHAT).
+  2. Opcional: una caché compartida de Django (p. ej. Redis) entre procesos.
+  3. La base de datos (una consulta a la tabla de participantes).
+
+Una conversación que no existe se guarda como "sin participantes". Al cambiar
+los participantes (m2m_changed de Conversacion.participantes, o al guardar o
+borrar un ParticipanteConversacion) se invalida la entrada en este proceso y
+en la caché compartida (ver usuarios/signals.py); las LRU de otros procesos
+caducan tras el TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import ParticipanteConversacion
+
+
+class CacheMembresias:
+
+    def __init__(self, maximo_entradas=10000, ttl_segundos=60, cache_compartida=None):
+        self.maximo_entradas = maximo_entradas
+        self.ttl_segundos = ttl_segundos
+        self.cache_compartida = caches[cache_compartida] if cache_compartida else None
+        self._entradas = OrderedDict()  # conversacion_id -> (frozenset de usuario_id, expira)
+        self._lock = threading.Lock()
+        self._contadores = {'aciertos': 0, 'aciertos_compartida': 0, 'fallos': 0, 'invalidaciones': 0}
+
+    @staticmethod
+    def clave_compartida(conversacion_id):
+        return f'membresia_conversacion:{conversacion_id}'
+
+    def buscar_local(self, conversacion_id):
+        """ Solo mira la LRU del proceso; nunca sale del proceso (seguro en código async). """
+        with self._lock:
+            entrada = self._entradas.get(conversacion_id)
+            if entrada is None:
+                return None
+            participantes, expira = entrada
+            if expira < time.monotonic():
+                del self._entradas[conversacion_id]
+                return None
+            self._entradas.move_to_end(conversacion_id)
+            self._contadores['aciertos'] += 1
+        return participantes
+
+    def participantes(self, conversacion_id):
+        """ frozenset con los ids de los participantes (vacío si la conversación no existe). """
+        conversacion_id = int(conversacion_id)
+        participantes = self.buscar_local(conversacion_id)
+        if participantes is not None:
+            return participantes
+
+        if self.cache_compartida is not None:
+            participantes = self.cache_compartida.get(self.clave_compartida(conversacion_id))
+            if participantes is not None:
+                with self._lock:
+                    self._contadores['aciertos_compartida'] += 1
+                self._guardar(conversacion_id, participantes)
+                return participantes
+
+        with self._lock:
+            self._contadores['fallos'] += 1
+        participantes = frozenset(ParticipanteConversacion.objects.filter(
+            conversacion_id=conversacion_id
+        ).values_list('usuario_id', flat=True))
+        self._guardar(conversacion_id, participantes)
+        if self.cache_compartida is not None:
+            self.cache_compartida.set(self.clave_compartida(conversacion_id), participantes, self.ttl_segundos)
+        return participantes
+
+    def es_participante(self, conversacion_id, usuario_id):
+        return usuario_id in self.participantes(conversacion_id)
+
+    def _guardar(self, conversacion_id, participantes):
+        with self._lock:
+            self._entradas.pop(conversacion_id, None)
+            self._entradas[conversacion_id] = (participantes, time.monotonic() + self.ttl_segundos)
+            while len(self._entradas) > self.maximo_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, conversacion_id):
+        conversacion_id = int(conversacion_id)
+        with self._lock:
+            self._entradas.pop(conversacion_id, None)
+            self._contadores['invalidaciones'] += 1
+        if self.cache_compartida is not None:
+            self.cache_compartida.delete(self.clave_compartida(conversacion_id))
+
+    def vaciar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def metricas(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+            contadores['entradas'] = len(self._entradas)
+        consultas = contadores['aciertos'] + contadores['aciertos_compartida'] + contadores['fallos']
+        contadores['tasa_aciertos'] = (
+            round((contadores['aciertos'] + contadores['aciertos_compartida']) / consultas, 4) if consultas else None
+        )
+        return contadores
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_membresias():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                ajustes = getattr(settings, 'MEMBRESIAS_CHAT', {})
+                _cache = CacheMembresias(
+                    maximo_entradas=ajustes.get('MAXIMO_ENTRADAS', 10000),
+                    ttl_segundos=ajustes.get('TTL_SEGUNDOS', 60),
+                    cache_compartida=ajustes.get('CACHE_COMPARTIDA'),
+                )
+    return _cache
+
+
+def reiniciar_cache_membresias():
+    """ Olvida la caché actual (útil en pruebas que cambian settings.MEMBRESIAS_CHAT). """
+    global _cache
+    _cache = None
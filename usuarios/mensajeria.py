@@ -0,0 +1,88 @@
+# usuarios/mensajeria.py
+"""
+Punto único para guardar mensajes de chat. Lo usan la API REST
+(MensajeListCreateAPIView) y el consumer de websockets (por lotes, ver
+chat/escritor.py), de modo que los datos desnormalizados de la conversación
+siempre se actualizan igual.
+"""
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from .eventos import mensajes_registrados
+from .models import Conversacion, Mensaje, ParticipanteConversacion
+
+LONGITUD_PREVIEW = Conversacion._meta.get_field('ultimo_mensaje_preview').max_length
+
+
+def registrar_mensaje(conversacion_id, autor, contenido):
+    """
+    Crea el mensaje y, en la misma transacción, actualiza el último mensaje de
+    la conversación y suma uno a los no leídos de los demás participantes.
+    """
+    return registrar_mensajes([(conversacion_id, autor, contenido)])[0]
+
+
+def registrar_mensajes(lote):
+    """
+    Guarda una lista de (conversacion_id, autor, contenido) en una sola
+    transacción y devuelve los Mensaje en el mismo orden, con id y fecha.
+
+    Los mensajes se insertan con un solo INSERT si la base de datos devuelve
+    los ids de un bulk_create (PostgreSQL, SQLite, MariaDB); en MySQL, donde no
+    los devuelve, se insertan uno a uno dentro de la misma transacción. Después
+    hay un UPDATE por conversación para su último mensaje (si no tiene ya uno posterior) y uno por
+    (conversación, autor) para los no leídos de los demás. Al final se envía
+    mensajes_registrados (ver usuarios/eventos.py) dentro de la transacción.
+    """
+    mensajes = [
+        Mensaje(conversacion_id=conversacion_id, autor=autor, contenido=contenido)
+        for conversacion_id, autor, contenido in lote
+    ]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Mensaje.objects.bulk_create(mensajes)
+        else:
+            for mensaje in mensajes:
+                mensaje.save(force_insert=True)
+
+        ultimos = {mensaje.conversacion_id: mensaje for mensaje in mensajes}
+        for mensaje in ultimos.values():
+            actualizar_ultimo_mensaje(mensaje)
+        # Cada mensaje suma uno a todos los participantes menos a su autor
+        por_autor = Counter((mensaje.conversacion_id, mensaje.autor_id) for mensaje in mensajes)
+        for (conversacion_id, autor_id), total in por_autor.items():
+            ParticipanteConversacion.objects.filter(conversacion_id=conversacion_id).exclude(
+                usuario_id=autor_id
+            ).update(no_leidos=F('no_leidos') + total)
+        mensajes_registrados.send(sender=Mensaje, mensajes=mensajes)
+    return mensajes
+
+
+def actualizar_ultimo_mensaje(mensaje):
+    """
+    Apunta el último mensaje de su conversación a `mensaje` si es posterior al
+    que tiene. Dos lotes concurrentes pueden confirmar en otro orden que el de
+    sus ids: sin la condición, el más lento dejaría como último uno anterior.
+    """
+    return Conversacion.objects.filter(
+        Q(ultimo_mensaje__isnull=True) | Q(ultimo_mensaje_id__lt=mensaje.id), pk=mensaje.conversacion_id
+    ).update(
+        ultimo_mensaje=mensaje,
+        ultimo_mensaje_preview=mensaje.contenido[:LONGITUD_PREVIEW],
+        ultimo_mensaje_fecha=mensaje.fecha_envio,
+        fecha_modificacion=mensaje.fecha_envio,
+    )
+
+
+def historial_despues_de(conversacion_id, fecha, mensaje_id, limite):
+    """
+    Hasta `limite` mensajes de la conversación posteriores a (fecha, mensaje_id)
+    en orden cronológico, con su autor; sin fecha, desde el principio. Es un
+    rango del índice (conversacion, fecha_envio, id), como "despues_de" en
+    MensajeKeysetPagination: el último devuelto sirve de cursor para el siguiente bloque.
+    """
+    mensajes = Mensaje.objects.filter(conversacion_id=conversacion_id)
+    if fecha is not None:
+        mensajes = mensajes.filter(Q(fecha_envio__gt=fecha) | Q(fecha_envio=fecha, id__gt=mensaje_id))
+    return list(mensajes.select_related('autor').order_by('fecha_envio', 'id')[:limite])
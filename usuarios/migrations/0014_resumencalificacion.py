@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0013_conversacion_servicio_relacionado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenCalificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rol', models.CharField(choices=[('oferente', 'Oferente de Servicio'), ('empresa', 'Empresa Reclutadora'), ('trabajador', 'Trabajador')], max_length=20)),
+                ('total_reseñas', models.PositiveIntegerField(default=0)),
+                ('sumas', models.JSONField(default=dict)),
+                ('conteos', models.JSONField(default=dict)),
+                ('suma_total', models.PositiveIntegerField(default=0)),
+                ('conteo_total', models.PositiveIntegerField(default=0)),
+                ('promedio', models.FloatField(blank=True, null=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('evaluado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes_calificacion', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('evaluado', 'rol')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0014_resumencalificacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminoIndexado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(max_length=50)),
+                ('objeto_id', models.PositiveBigIntegerField()),
+                ('termino', models.CharField(max_length=40)),
+                ('peso', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['modelo', 'termino'], name='termino_modelo_termino_idx'), models.Index(fields=['modelo', 'objeto_id'], name='termino_modelo_objeto_idx')],
+            },
+        ),
+    ]
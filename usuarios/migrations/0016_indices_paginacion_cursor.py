@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0015_terminoindexado'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='mensaje',
+            options={'ordering': ['fecha_envio', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['conversacion', 'fecha_envio', 'id'], name='mensaje_conv_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='servicioofrecido',
+            index=models.Index(fields=['activo', '-fecha_publicacion', '-id'], name='servicio_activo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vacanteempresa',
+            index=models.Index(fields=['activa', '-fecha_publicacion', '-id'], name='vacante_activa_fecha_idx'),
+        ),
+    ]
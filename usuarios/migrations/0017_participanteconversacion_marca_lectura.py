@@ -0,0 +1,63 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def rellenar_marcas(apps, schema_editor):
+    """
+    La marca de cada participante es el id del último mensaje marcado como
+    leído que recibió (es decir, escrito por otro) en esa conversación.
+    """
+    ParticipanteConversacion = apps.get_model('usuarios', 'ParticipanteConversacion')
+    Mensaje = apps.get_model('usuarios', 'Mensaje')
+    ultimo_leido = Mensaje.objects.filter(
+        conversacion_id=OuterRef('conversacion_id'), leido=True
+    ).exclude(autor_id=OuterRef('usuario_id')).order_by().values('conversacion_id').annotate(
+        maximo=Max('id')
+    ).values('maximo')
+    ParticipanteConversacion.objects.update(ultimo_leido=Coalesce(Subquery(ultimo_leido), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0016_indices_paginacion_cursor'),
+    ]
+
+    operations = [
+        # La tabla intermedia ya existe: solo cambiamos el estado para que
+        # Django la use como modelo explícito.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ParticipanteConversacion',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('conversacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='membresias', to='usuarios.conversacion')),
+                        ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='membresias_conversacion', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'usuarios_conversacion_participantes',
+                        'unique_together': {('conversacion', 'usuario')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='conversacion',
+                    name='participantes',
+                    field=models.ManyToManyField(related_name='conversaciones', through='usuarios.ParticipanteConversacion', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='participanteconversacion',
+            name='ultimo_leido',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(rellenar_marcas, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='mensaje',
+            name='leido',
+        ),
+    ]
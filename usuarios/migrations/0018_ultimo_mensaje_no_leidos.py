@@ -0,0 +1,59 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Substr
+
+
+def rellenar_bandeja(apps, schema_editor):
+    """ Calcula el último mensaje de cada conversación y los no leídos de cada participante. """
+    Conversacion = apps.get_model('usuarios', 'Conversacion')
+    ParticipanteConversacion = apps.get_model('usuarios', 'ParticipanteConversacion')
+    Mensaje = apps.get_model('usuarios', 'Mensaje')
+
+    ultimo = Mensaje.objects.filter(conversacion_id=OuterRef('pk')).order_by('-fecha_envio', '-id')
+    Conversacion.objects.filter(id__in=Mensaje.objects.values('conversacion_id')).update(
+        ultimo_mensaje_id=Subquery(ultimo.values('id')[:1]),
+        ultimo_mensaje_preview=Subquery(ultimo.annotate(preview=Substr('contenido', 1, 100)).values('preview')[:1]),
+        ultimo_mensaje_fecha=Subquery(ultimo.values('fecha_envio')[:1]),
+        fecha_modificacion=Subquery(ultimo.values('fecha_envio')[:1]),
+    )
+
+    pendientes = Mensaje.objects.filter(
+        conversacion_id=OuterRef('conversacion_id'), id__gt=OuterRef('ultimo_leido')
+    ).exclude(autor_id=OuterRef('usuario_id')).order_by().values('conversacion_id').annotate(
+        total=Count('id')
+    ).values('total')
+    ParticipanteConversacion.objects.update(no_leidos=Coalesce(Subquery(pendientes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0017_participanteconversacion_marca_lectura'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversacion',
+            name='ultimo_mensaje',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='usuarios.mensaje'),
+        ),
+        migrations.AddField(
+            model_name='conversacion',
+            name='ultimo_mensaje_fecha',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversacion',
+            name='ultimo_mensaje_preview',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='participanteconversacion',
+            name='no_leidos',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(rellenar_bandeja, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:51
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Substr
+
+
+def asignar_claves_y_fusionar(apps, schema_editor):
+    """
+    Calcula la clave de cada conversación de dos participantes. Cuando varias
+    comparten clave, conserva la más antigua, le mueve los mensajes de las
+    demás y borra los duplicados.
+    """
+    Conversacion = apps.get_model('usuarios', 'Conversacion')
+    ParticipanteConversacion = apps.get_model('usuarios', 'ParticipanteConversacion')
+    Mensaje = apps.get_model('usuarios', 'Mensaje')
+
+    participantes = defaultdict(list)
+    for conversacion_id, usuario_id in ParticipanteConversacion.objects.values_list('conversacion_id', 'usuario_id'):
+        participantes[conversacion_id].append(usuario_id)
+
+    por_clave = defaultdict(list)
+    for conversacion_id, servicio_id in Conversacion.objects.order_by('id').values_list('id', 'servicio_relacionado_id'):
+        usuarios = participantes.get(conversacion_id, [])
+        if len(usuarios) != 2:
+            continue
+        menor, mayor = sorted(usuarios)
+        por_clave[f"{menor}:{mayor}:{servicio_id or 0}"].append(conversacion_id)
+
+    fusionadas = []
+    for clave, ids in por_clave.items():
+        conservada, duplicadas = ids[0], ids[1:]
+        if duplicadas:
+            Mensaje.objects.filter(conversacion_id__in=duplicadas).update(conversacion_id=conservada)
+            # Cada participante conserva la marca de lectura más avanzada
+            marcas = ParticipanteConversacion.objects.filter(conversacion_id__in=ids).values('usuario_id').annotate(
+                marca=Max('ultimo_leido')
+            )
+            for fila in marcas:
+                ParticipanteConversacion.objects.filter(
+                    conversacion_id=conservada, usuario_id=fila['usuario_id']
+                ).update(ultimo_leido=fila['marca'])
+            Conversacion.objects.filter(id__in=duplicadas).delete()
+            fusionadas.append(conservada)
+        Conversacion.objects.filter(id=conservada).update(clave_par=clave)
+
+    if not fusionadas:
+        return
+    # Recalcula los datos desnormalizados de las conversaciones que recibieron mensajes
+    ultimo = Mensaje.objects.filter(conversacion_id=OuterRef('pk')).order_by('-fecha_envio', '-id')
+    Conversacion.objects.filter(id__in=fusionadas).update(
+        ultimo_mensaje_id=Subquery(ultimo.values('id')[:1]),
+        ultimo_mensaje_preview=Coalesce(Subquery(ultimo.annotate(preview=Substr('contenido', 1, 100)).values('preview')[:1]), models.Value('')),
+        ultimo_mensaje_fecha=Subquery(ultimo.values('fecha_envio')[:1]),
+        # La bandeja ordena por esta fecha; como en 0018, la del último mensaje
+        fecha_modificacion=Coalesce(Subquery(ultimo.values('fecha_envio')[:1]), F('fecha_modificacion')),
+    )
+    pendientes = Mensaje.objects.filter(
+        conversacion_id=OuterRef('conversacion_id'), id__gt=OuterRef('ultimo_leido')
+    ).exclude(autor_id=OuterRef('usuario_id')).order_by().values('conversacion_id').annotate(
+        total=Count('id')
+    ).values('total')
+    ParticipanteConversacion.objects.filter(conversacion_id__in=fusionadas).update(
+        no_leidos=Coalesce(Subquery(pendientes), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0018_ultimo_mensaje_no_leidos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversacion',
+            name='clave_par',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(asignar_claves_y_fusionar, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conversacion',
+            name='clave_par',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0019_clave_par_conversacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagenservicio',
+            name='variantes',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
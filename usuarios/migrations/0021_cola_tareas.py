@@ -0,0 +1,73 @@
+# Generated by Django 5.2.3 on 2026-10-18 07:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def marcar_existentes(apps, schema_editor):
+    """
+    Las imágenes ya publicadas se sirven tal cual (el comando
+    generar_variantes_imagenes crea sus variantes). Los CV existentes se
+    encolan para extraer su texto.
+    """
+    ImagenServicio = apps.get_model('usuarios', 'ImagenServicio')
+    Usuario = apps.get_model('usuarios', 'Usuario')
+    Tarea = apps.get_model('usuarios', 'Tarea')
+    ImagenServicio.objects.update(estado='listo')
+    con_cv = Usuario.objects.exclude(cv='').exclude(cv__isnull=True)
+    Tarea.objects.bulk_create(
+        Tarea(tipo='extraer_texto_cv', argumentos={'usuario_id': usuario_id, 'nombre': nombre})
+        for usuario_id, nombre in con_cv.values_list('id', 'cv')
+    )
+    con_cv.update(cv_estado='pendiente')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0020_imagenservicio_variantes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagenservicio',
+            name='error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='imagenservicio',
+            name='estado',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('listo', 'Listo'), ('error', 'Error')], default='pendiente', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='cv_estado',
+            field=models.CharField(blank=True, choices=[('pendiente', 'Pendiente'), ('listo', 'Listo'), ('error', 'Error')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='cv_texto',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.CreateModel(
+            name='Tarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=60)),
+                ('argumentos', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completada', 'Completada'), ('fallida', 'Fallida')], default='pendiente', max_length=12)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('max_intentos', models.PositiveSmallIntegerField(default=3)),
+                ('disponible_en', models.DateTimeField(default=django.utils.timezone.now)),
+                ('reclamada_por', models.CharField(blank=True, default='', max_length=100)),
+                ('reclamada_en', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'disponible_en', 'id'], name='tarea_estado_disponible_idx')],
+            },
+        ),
+        migrations.RunPython(marcar_existentes, migrations.RunPython.noop),
+    ]
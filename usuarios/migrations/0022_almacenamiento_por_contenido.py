@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:00
+
+import usuarios.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0021_cola_tareas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlobAlmacenado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=150, unique=True)),
+                ('referencias', models.PositiveIntegerField(default=0)),
+                ('tamaño', models.PositiveBigIntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='imagenservicio',
+            name='imagen',
+            field=models.ImageField(storage=usuarios.almacenamiento.obtener_almacenamiento, upload_to='servicios_galeria/'),
+        ),
+        migrations.AlterField(
+            model_name='usuario',
+            name='cv',
+            field=models.FileField(blank=True, null=True, storage=usuarios.almacenamiento.obtener_almacenamiento, upload_to='cvs/'),
+        ),
+    ]
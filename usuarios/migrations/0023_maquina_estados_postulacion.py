@@ -0,0 +1,84 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def historial_inicial(apps, schema_editor):
+    """
+    Las postulaciones existentes entran en el historial con su fecha de
+    postulación. Si ya no están en 'recibida' se registra el paso a su estado
+    actual sin duración (no se sabe cuándo ocurrió), para que cuenten en el
+    embudo sin falsear los tiempos promedio.
+    """
+    Postulacion = apps.get_model('usuarios', 'Postulacion')
+    TransicionPostulacion = apps.get_model('usuarios', 'TransicionPostulacion')
+    Postulacion.objects.update(fecha_estado=F('fecha_postulacion'))
+    transiciones = []
+    for pk, vacante_id, profesional_id, estado, fecha in Postulacion.objects.values_list(
+        'pk', 'vacante_id', 'profesional_id', 'estado', 'fecha_postulacion'
+    ).iterator():
+        transiciones.append(TransicionPostulacion(
+            postulacion_id=pk, vacante_id=vacante_id, actor_id=profesional_id, estado_nuevo='recibida', fecha=fecha,
+        ))
+        if estado != 'recibida':
+            transiciones.append(TransicionPostulacion(
+                postulacion_id=pk, vacante_id=vacante_id, estado_anterior='recibida', estado_nuevo=estado, fecha=fecha,
+            ))
+    TransicionPostulacion.objects.bulk_create(transiciones, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0022_almacenamiento_por_contenido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransicionPostulacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado_anterior', models.CharField(blank=True, default='', max_length=20)),
+                ('estado_nuevo', models.CharField(choices=[('recibida', 'Recibida'), ('en_revision', 'En Revisión'), ('contactado', 'Contactado'), ('rechazado', 'Rechazado')], max_length=20)),
+                ('segundos_en_anterior', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('fecha', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='postulacion',
+            name='fecha_estado',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='postulacion',
+            index=models.Index(fields=['vacante', 'estado'], name='postulacion_vacante_estado_idx'),
+        ),
+        migrations.AddField(
+            model_name='transicionpostulacion',
+            name='actor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='transicionpostulacion',
+            name='postulacion',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transiciones', to='usuarios.postulacion'),
+        ),
+        migrations.AddField(
+            model_name='transicionpostulacion',
+            name='vacante',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transiciones_postulaciones', to='usuarios.vacanteempresa'),
+        ),
+        migrations.AddIndex(
+            model_name='transicionpostulacion',
+            index=models.Index(fields=['vacante', 'estado_nuevo'], name='transicion_vacante_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transicionpostulacion',
+            index=models.Index(fields=['postulacion', 'fecha'], name='transicion_postulacion_idx'),
+        ),
+        migrations.RunPython(historial_inicial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 08:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0023_maquina_estados_postulacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('mensaje', 'Mensajes nuevos en una conversación'), ('postulacion', 'Postulación nueva a una vacante'), ('estado_postulacion', 'Cambio de estado de una postulación')], max_length=20)),
+                ('datos', models.JSONField(default=dict)),
+                ('fecha', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notificaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['usuario', 'id'], name='notificacion_usuario_id_idx')],
+            },
+        ),
+    ]
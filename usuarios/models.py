@@ -1,11 +1,31 @@
+import logging
+from collections import defaultdict
+
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce, Substr
+from django.utils import timezone
+from .almacenamiento import almacenamiento_deduplicado, obtener_almacenamiento
+from .eventos import estados_postulacion_cambiados
+from .imagenes import borrar_variantes_de
+
+logger = logging.getLogger(__name__)
+
+# Estados del procesamiento en segundo plano de archivos subidos (ver usuarios/tareas.py)
+PROCESAMIENTO_CHOICES = [
+    ('pendiente', 'Pendiente'),
+    ('listo', 'Listo'),
+    ('error', 'Error'),
+]
 
 class Usuario(AbstractUser):
     # Campos que ya vienen con AbstractUser:
     # username, first_name, last_name, email, password, groups, user_permissions,
     # is_staff, is_active, is_superuser, last_login, date_joined
-    cv = models.FileField(upload_to='cvs/', null=True, blank=True)
+    cv = models.FileField(upload_to='cvs/', storage=obtener_almacenamiento, null=True, blank=True)
+    # Texto extraído del CV en segundo plano
+    cv_texto = models.TextField(blank=True, default='')
+    cv_estado = models.CharField(max_length=10, choices=PROCESAMIENTO_CHOICES, blank=True, default='')
     TIPO_USUARIO_CHOICES = [
         ('oferente', 'Oferente de Servicio'),
         ('profesionista', 'Profesionista Postulante'),
@@ -43,13 +63,23 @@ class ServicioOfrecido(models.Model):
     fecha_publicacion = models.DateTimeField(auto_now_add=True)
     activo = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Listado y scroll infinito por cursor de /servicios/
+            models.Index(fields=['activo', '-fecha_publicacion', '-id'], name='servicio_activo_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"'{self.titulo_servicio}' ofrecido por {self.usuario_oferente.username}"
     
 class ImagenServicio(models.Model):
     """ Un modelo para almacenar cada imagen asociada a un servicio. """
     servicio = models.ForeignKey(ServicioOfrecido, related_name='imagenes', on_delete=models.CASCADE)
-    imagen = models.ImageField(upload_to='servicios_galeria/')
+    imagen = models.ImageField(upload_to='servicios_galeria/', storage=obtener_almacenamiento)
+    # Miniatura y tamaño mediano en WebP/JPEG (ver usuarios/imagenes.py)
+    variantes = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=10, choices=PROCESAMIENTO_CHOICES, default='pendiente')
+    error = models.CharField(max_length=255, blank=True, default='')
 
     def __str__(self):
         return f"Imagen para {self.servicio.titulo_servicio}"
@@ -66,6 +96,12 @@ class VacanteEmpresa(models.Model):
     fecha_publicacion = models.DateTimeField(auto_now_add=True)
     activa = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Listado y scroll infinito por cursor de /vacantes/
+            models.Index(fields=['activa', '-fecha_publicacion', '-id'], name='vacante_activa_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"{self.titulo_vacante} en {self.empresa.username}"
 
@@ -92,13 +128,181 @@ class Postulacion(models.Model):
         default='recibida'
     )
 
+    # Cuándo entró en el estado actual; se guarda en el historial al salir
+    fecha_estado = models.DateTimeField(default=timezone.now)
+
+    # Máquina de estados: estado actual -> estados a los que la empresa puede
+    # moverla. Todo cambio pasa por cambiar_estado_en_lote().
+    TRANSICIONES = {
+        'recibida': {'en_revision', 'contactado', 'rechazado'},
+        'en_revision': {'contactado', 'rechazado'},
+        'contactado': {'rechazado'},
+        'rechazado': {'en_revision'},
+    }
+    MAXIMO_LOTE = 500
+
     # Para evitar que un usuario se postule varias veces a la misma vacante
     class Meta:
         unique_together = ('profesional', 'vacante')
+        indexes = [
+            # Postulantes y conteos de una vacante filtrados por estado
+            models.Index(fields=['vacante', 'estado'], name='postulacion_vacante_estado_idx'),
+        ]
+
+    @classmethod
+    def origenes_de(cls, estado):
+        """ Estados desde los que se puede pasar a `estado`. """
+        return {origen for origen, destinos in cls.TRANSICIONES.items() if estado in destinos}
+
+    @classmethod
+    def cambiar_estado_en_lote(cls, ids, estado, empresa, desde=None):
+        """
+        Mueve a `estado` las postulaciones de `ids` que pertenecen a vacantes de
+        `empresa` y admiten la transición (`desde` restringe además los estados
+        de origen). Una consulta comprueba dueño y estado de todas; el cambio es
+        un compare-and-set: un UPDATE ... WHERE estado = <el leído> por cada
+        estado de origen, así que nunca pisa lo que otro reclutador cambió entre
+        medias. Cada cambio aplicado queda en TransicionPostulacion.
+
+        Devuelve [{'id', 'resultado', 'estado'}] en el orden de `ids`, con
+        resultado 'actualizada', 'sin_cambio', 'transicion_invalida',
+        'sin_permiso' o 'no_existe'.
+        """
+        ids = list(dict.fromkeys(ids))
+        filas = {
+            fila['pk']: fila for fila in cls.objects.filter(pk__in=ids).values(
+                'pk', 'vacante_id', 'vacante__empresa_id', 'profesional_id', 'estado', 'fecha_estado'
+            )
+        }
+        origenes = cls.origenes_de(estado)
+        if desde is not None:
+            origenes &= set(desde)
+        por_origen = defaultdict(list)
+        for pk, fila in filas.items():
+            if fila['vacante__empresa_id'] == empresa.pk and fila['estado'] in origenes:
+                por_origen[fila['estado']].append(pk)
+
+        ahora = timezone.now()
+        actualizadas, perdidas = set(), []
+        with transaction.atomic():
+            for origen, pks in por_origen.items():
+                cambiadas = cls.objects.filter(pk__in=pks, estado=origen).update(estado=estado, fecha_estado=ahora)
+                if cambiadas == len(pks):
+                    actualizadas.update(pks)
+                else:
+                    perdidas.extend(pks)
+            if perdidas:
+                # Alguna cambió o se borró después de leerla: las que ahora tienen
+                # nuestra marca de tiempo las movimos nosotros, el resto se informa
+                # con su estado vigente
+                vigentes = {fila['pk']: fila for fila in cls.objects.filter(pk__in=perdidas).values('pk', 'estado', 'fecha_estado')}
+                for pk in perdidas:
+                    if pk not in vigentes:
+                        del filas[pk]
+                    elif vigentes[pk]['estado'] == estado and vigentes[pk]['fecha_estado'] == ahora:
+                        actualizadas.add(pk)
+                    else:
+                        filas[pk].update(estado=vigentes[pk]['estado'], fecha_estado=vigentes[pk]['fecha_estado'])
+            TransicionPostulacion.objects.bulk_create([
+                TransicionPostulacion(
+                    postulacion_id=pk, vacante_id=filas[pk]['vacante_id'], actor=empresa,
+                    estado_anterior=filas[pk]['estado'], estado_nuevo=estado, fecha=ahora,
+                    segundos_en_anterior=max(int((ahora - filas[pk]['fecha_estado']).total_seconds()), 0),
+                )
+                for pk in actualizadas
+            ])
+            if actualizadas:
+                estados_postulacion_cambiados.send(sender=cls, cambios=[
+                    {
+                        'id': pk, 'vacante_id': filas[pk]['vacante_id'], 'profesional_id': filas[pk]['profesional_id'],
+                        'estado_anterior': filas[pk]['estado'], 'estado': estado,
+                    }
+                    for pk in sorted(actualizadas)
+                ])
+
+        resultados = []
+        for pk in ids:
+            fila = filas.get(pk)
+            if fila is None:
+                resultados.append({'id': pk, 'resultado': 'no_existe', 'estado': None})
+            elif fila['vacante__empresa_id'] != empresa.pk:
+                resultados.append({'id': pk, 'resultado': 'sin_permiso', 'estado': None})
+            elif pk in actualizadas:
+                resultados.append({'id': pk, 'resultado': 'actualizada', 'estado': estado})
+            elif fila['estado'] == estado:
+                resultados.append({'id': pk, 'resultado': 'sin_cambio', 'estado': estado})
+            else:
+                resultados.append({'id': pk, 'resultado': 'transicion_invalida', 'estado': fila['estado']})
+        return resultados
+
+    @classmethod
+    def conteos_por_estado(cls, vacante_id):
+        """ {'recibida': n, ..., 'total': n} de una vacante con una sola agregación. """
+        agregados = {estado: models.Count('id', filter=models.Q(estado=estado)) for estado, _ in cls.ESTADO_CHOICES}
+        return cls.objects.filter(vacante_id=vacante_id).aggregate(total=models.Count('id'), **agregados)
 
     def __str__(self):
         return f"{self.profesional.username} se postuló a {self.vacante.titulo_vacante}"
     
+class TransicionPostulacion(models.Model):
+    """
+    Historial de solo inserción de los cambios de estado de las postulaciones.
+    Lleva la vacante y el tiempo que la postulación pasó en el estado anterior
+    para que el embudo de una vacante salga de agregaciones sobre esta tabla.
+    """
+    postulacion = models.ForeignKey(Postulacion, on_delete=models.CASCADE, related_name='transiciones')
+    vacante = models.ForeignKey(VacanteEmpresa, on_delete=models.CASCADE, related_name='transiciones_postulaciones')
+    actor = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # '' en la fila que registra la postulación recién creada
+    estado_anterior = models.CharField(max_length=20, blank=True, default='')
+    estado_nuevo = models.CharField(max_length=20, choices=Postulacion.ESTADO_CHOICES)
+    segundos_en_anterior = models.PositiveBigIntegerField(null=True, blank=True)
+    fecha = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vacante', 'estado_nuevo'], name='transicion_vacante_estado_idx'),
+            models.Index(fields=['postulacion', 'fecha'], name='transicion_postulacion_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("El historial de transiciones no se modifica.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("El historial de transiciones no se borra.")
+
+    @classmethod
+    def embudo(cls, vacante_id):
+        """
+        {estado: {'actuales', 'entradas', 'salidas', 'segundos_promedio'}} de una
+        vacante con tres agregaciones: postulaciones en cada estado ahora, cuántas
+        llegaron a él, cuántas salieron y el tiempo medio que pasaron en él
+        antes de salir (las que siguen ahí no cuentan en el promedio).
+        """
+        actuales = Postulacion.conteos_por_estado(vacante_id)
+        transiciones = cls.objects.filter(vacante_id=vacante_id)
+        entradas = dict(transiciones.values_list('estado_nuevo').annotate(
+            total=models.Count('postulacion', distinct=True)
+        ).order_by())
+        salidas = {
+            fila['estado_anterior']: fila for fila in transiciones.exclude(estado_anterior='').values(
+                'estado_anterior'
+            ).annotate(total=models.Count('id'), promedio=models.Avg('segundos_en_anterior')).order_by()
+        }
+        embudo = {}
+        for estado, _ in Postulacion.ESTADO_CHOICES:
+            salida = salidas.get(estado, {})
+            promedio = salida.get('promedio')
+            embudo[estado] = {
+                'actuales': actuales[estado],
+                'entradas': entradas.get(estado, 0),
+                'salidas': salida.get('total', 0),
+                'segundos_promedio': round(promedio) if promedio is not None else None,
+            }
+        return embudo
+
 class Reseña(models.Model):
     # --- Relaciones Clave ---
     evaluador = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='reseñas_hechas')
@@ -140,10 +344,193 @@ class Reseña(models.Model):
 
     def __str__(self):
         return f"Reseña de {self.evaluador.username} para {self.evaluado.username}"
-    
+
+class ResumenCalificacion(models.Model):
+    """
+    Agregados precalculados de las reseñas que recibe un usuario para un rol.
+    Se mantiene al día con las señales de Reseña (ver usuarios/signals.py) y
+    se puede reconstruir con `manage.py recalcular_calificaciones`.
+    """
+    ROL_CHOICES = [
+        ('oferente', 'Oferente de Servicio'),
+        ('empresa', 'Empresa Reclutadora'),
+        ('trabajador', 'Trabajador'),
+    ]
+    # Criterios que se promedian para cada rol
+    CAMPOS_POR_ROL = {
+        'oferente': [
+            'eficiencia_tareas', 'atencion', 'manejo_instrucciones',
+            'puntualidad_trabajador', 'responsabilidad', 'comunicacion_proactiva'
+        ],
+        'empresa': [
+            'claridad_requerimientos', 'recursos_proporcionados', 'Soporte_tecnicoMaterial',
+            'puntualidad_pago', 'inclusividad', 'transparencia_contractual', 'respeto_horarios',
+            'ambiente_laboral', 'comunicacion', 'balance_vida_trabajo'
+        ],
+        'trabajador': [
+            'calidad_tecnica', 'solucion_problemas', 'cumplimiento_estandares',
+            'eficiencia_tareas', 'atencion', 'manejo_instrucciones',
+            'puntualidad_trabajador', 'responsabilidad', 'comunicacion_proactiva'
+        ],
+    }
+
+    evaluado = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='resumenes_calificacion')
+    rol = models.CharField(max_length=20, choices=ROL_CHOICES)
+    total_reseñas = models.PositiveIntegerField(default=0)
+    # Suma y número de calificaciones no nulas por criterio: {"atencion": 42, ...}
+    sumas = models.JSONField(default=dict)
+    conteos = models.JSONField(default=dict)
+    suma_total = models.PositiveIntegerField(default=0)
+    conteo_total = models.PositiveIntegerField(default=0)
+    promedio = models.FloatField(null=True, blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('evaluado', 'rol')
+
+    def __str__(self):
+        return f"Resumen {self.rol} de {self.evaluado_id}: {self.promedio}"
+
+    @property
+    def promedios_por_criterio(self):
+        return {
+            campo: round(self.sumas[campo] / self.conteos[campo], 1)
+            for campo in self.CAMPOS_POR_ROL[self.rol]
+            if self.conteos.get(campo)
+        }
+
+    @classmethod
+    def promedio_de(cls, usuario_id, rol):
+        """ Devuelve el promedio redondeado de un usuario para un rol, o None. """
+        promedio = cls.objects.filter(evaluado_id=usuario_id, rol=rol).values_list('promedio', flat=True).first()
+        return round(promedio, 1) if promedio is not None else None
+
+    @classmethod
+    def promedios_de(cls, usuario_ids, rol):
+        """ Igual que promedio_de, pero para varios usuarios en una sola consulta. """
+        filas = cls.objects.filter(evaluado_id__in=usuario_ids, rol=rol).values_list('evaluado_id', 'promedio')
+        return {
+            usuario_id: round(promedio, 1) if promedio is not None else None
+            for usuario_id, promedio in filas
+        }
+
+    @classmethod
+    def recalcular(cls, usuario_id):
+        """
+        Reconstruye los resúmenes de un usuario con una sola consulta de
+        agregación sobre sus reseñas, sin cargar ninguna instancia.
+
+        La fila del usuario se bloquea (SELECT ... FOR UPDATE) antes de agregar:
+        dos recálculos concurrentes se ejecutan uno tras otro y el segundo ya ve
+        la reseña del primero, en lugar de pisarlo con datos viejos o chocar al
+        crear los primeros resúmenes.
+        """
+        campos = sorted({campo for campos_rol in cls.CAMPOS_POR_ROL.values() for campo in campos_rol})
+        agregados = {'total': models.Count('id')}
+        for campo in campos:
+            agregados[f'suma_{campo}'] = models.Sum(campo)
+            agregados[f'conteo_{campo}'] = models.Count(campo)
+
+        with transaction.atomic():
+            list(Usuario.objects.select_for_update().filter(pk=usuario_id).values_list('pk', flat=True))
+            datos = Reseña.objects.filter(evaluado_id=usuario_id).aggregate(**agregados)
+
+            resumenes = []
+            if datos['total']:
+                for rol, campos_rol in cls.CAMPOS_POR_ROL.items():
+                    sumas = {campo: datos[f'suma_{campo}'] or 0 for campo in campos_rol}
+                    conteos = {campo: datos[f'conteo_{campo}'] for campo in campos_rol}
+                    suma_total, conteo_total = sum(sumas.values()), sum(conteos.values())
+                    resumenes.append(cls(
+                        evaluado_id=usuario_id, rol=rol, total_reseñas=datos['total'],
+                        sumas=sumas, conteos=conteos,
+                        suma_total=suma_total, conteo_total=conteo_total,
+                        promedio=suma_total / conteo_total if conteo_total else None,
+                    ))
+
+            cls.objects.filter(evaluado_id=usuario_id).delete()
+            cls.objects.bulk_create(resumenes)
+        return resumenes
+
+class ConversacionManager(models.Manager):
+
+    @staticmethod
+    def clave_para(usuario_a_id, usuario_b_id, servicio_id=None):
+        """ Clave canónica de un par de usuarios: "menor:mayor:servicio" (0 = sin servicio). """
+        menor, mayor = sorted((int(usuario_a_id), int(usuario_b_id)))
+        return f"{menor}:{mayor}:{servicio_id or 0}"
+
+    def entre(self, usuario_a_id, usuario_b_id):
+        """ Todas las conversaciones del par, con o sin servicio (rango sobre el índice único). """
+        prefijo = self.clave_para(usuario_a_id, usuario_b_id).rsplit(':', 1)[0] + ':'
+        return self.filter(clave_par__startswith=prefijo)
+
+    def obtener_o_crear_entre(self, usuario_a, usuario_b, servicio=None):
+        """
+        Devuelve (conversacion, creada). La restricción única sobre clave_par
+        evita duplicados aunque dos peticiones lleguen a la vez: la que pierde
+        la carrera recibe un IntegrityError y lee la que ganó.
+        """
+        clave = self.clave_para(usuario_a.id, usuario_b.id, servicio.id if servicio else None)
+        conversacion = self.filter(clave_par=clave).first()
+        if conversacion:
+            return conversacion, False
+        try:
+            with transaction.atomic():
+                conversacion = self.create(clave_par=clave, servicio_relacionado=servicio)
+                conversacion.participantes.add(usuario_a, usuario_b)
+            return conversacion, True
+        except IntegrityError:
+            return self.get(clave_par=clave), False
+
+    def desligar_servicio(self, servicio_id):
+        """
+        Antes de borrar un servicio: sus conversaciones pasan a la clave sin
+        servicio ("menor:mayor:0"), que es donde las buscará obtener_o_crear_entre
+        cuando servicio_relacionado quede en NULL. Si el par ya tiene una sin
+        servicio, la huérfana se fusiona con ella.
+        """
+        for conversacion in self.filter(servicio_relacionado_id=servicio_id).exclude(clave_par=None):
+            clave = conversacion.clave_par.rsplit(':', 1)[0] + ':0'
+            with transaction.atomic():
+                existente = self.select_for_update().filter(clave_par=clave).first()
+                if existente is None:
+                    self.filter(pk=conversacion.pk).update(clave_par=clave)
+                else:
+                    self.fusionar(conversacion, existente)
+
+    def fusionar(self, duplicada, conservada):
+        """ Mueve los mensajes y marcas de lectura de `duplicada` a `conservada` y la borra. """
+        Mensaje.objects.filter(conversacion=duplicada).update(conversacion=conservada)
+        for membresia in ParticipanteConversacion.objects.filter(conversacion=duplicada):
+            ParticipanteConversacion.objects.filter(
+                conversacion=conservada, usuario_id=membresia.usuario_id, ultimo_leido__lt=membresia.ultimo_leido
+            ).update(ultimo_leido=membresia.ultimo_leido)
+        duplicada.delete()
+
+        ultimo = Mensaje.objects.filter(conversacion_id=models.OuterRef('pk')).order_by('-fecha_envio', '-id')
+        self.filter(pk=conservada.pk).update(
+            ultimo_mensaje_id=models.Subquery(ultimo.values('id')[:1]),
+            ultimo_mensaje_preview=Coalesce(models.Subquery(ultimo.annotate(
+                preview=Substr('contenido', 1, self.model._meta.get_field('ultimo_mensaje_preview').max_length)
+            ).values('preview')[:1]), models.Value('')),
+            ultimo_mensaje_fecha=models.Subquery(ultimo.values('fecha_envio')[:1]),
+            fecha_modificacion=Coalesce(models.Subquery(ultimo.values('fecha_envio')[:1]), models.F('fecha_modificacion')),
+        )
+        pendientes = Mensaje.objects.filter(
+            conversacion_id=models.OuterRef('conversacion_id'), id__gt=models.OuterRef('ultimo_leido')
+        ).exclude(autor_id=models.OuterRef('usuario_id')).order_by().values('conversacion_id').annotate(
+            total=models.Count('id')
+        ).values('total')
+        ParticipanteConversacion.objects.filter(conversacion=conservada).update(
+            no_leidos=Coalesce(models.Subquery(pendientes), 0)
+        )
+
 class Conversacion(models.Model):
     """ Representa una conversación entre dos usuarios. """
-    participantes = models.ManyToManyField(Usuario, related_name='conversaciones')
+    participantes = models.ManyToManyField(
+        Usuario, related_name='conversaciones', through='ParticipanteConversacion'
+    )
     servicio_relacionado = models.ForeignKey(
         ServicioOfrecido, 
         on_delete=models.SET_NULL, 
@@ -154,22 +541,240 @@ class Conversacion(models.Model):
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_modificacion = models.DateTimeField(auto_now=True)
 
+    # Datos del último mensaje, desnormalizados para la bandeja de entrada.
+    # Los mantiene usuarios.mensajeria.registrar_mensaje.
+    ultimo_mensaje = models.ForeignKey(
+        'Mensaje', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    ultimo_mensaje_preview = models.CharField(max_length=100, blank=True, default='')
+    ultimo_mensaje_fecha = models.DateTimeField(null=True, blank=True)
+
+    # Par normalizado de participantes y servicio, ver ConversacionManager.clave_para
+    clave_par = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    objects = ConversacionManager()
+
     def __str__(self):
         # Devuelve los nombres de los participantes, por ejemplo: "sergio - tech"
         return " - ".join([user.username for user in self.participantes.all()])
 
+class ParticipanteConversacion(models.Model):
+    """
+    Membresía de un usuario en una conversación. Usa la misma tabla que la
+    relación ManyToMany original y guarda la marca de lectura del participante.
+    """
+    conversacion = models.ForeignKey(Conversacion, on_delete=models.CASCADE, related_name='membresias')
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='membresias_conversacion')
+    # Id del último mensaje leído (0 = ninguno). Solo avanza, ver `avanzar_lectura`.
+    ultimo_leido = models.PositiveBigIntegerField(default=0)
+    # Mensajes de otros posteriores a la marca; se incrementa al llegar cada mensaje
+    no_leidos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'usuarios_conversacion_participantes'
+        unique_together = ('conversacion', 'usuario')
+
+    def __str__(self):
+        return f"{self.usuario_id} en conversacion {self.conversacion_id} (leído hasta {self.ultimo_leido})"
+
+    @classmethod
+    def avanzar_lectura(cls, conversacion_id, usuario_id, mensaje_id):
+        """
+        Mueve la marca de lectura hasta `mensaje_id` solo si es mayor que la actual
+        y recalcula el contador de no leídos en la misma sentencia.
+        Devuelve True si hubo que escribir.
+        """
+        pendientes = Mensaje.objects.filter(
+            conversacion_id=conversacion_id, id__gt=mensaje_id
+        ).exclude(autor_id=usuario_id).order_by().values('conversacion_id').annotate(
+            total=models.Count('id')
+        ).values('total')
+        return cls.objects.filter(
+            conversacion_id=conversacion_id, usuario_id=usuario_id, ultimo_leido__lt=mensaje_id
+        ).update(
+            ultimo_leido=mensaje_id,
+            no_leidos=Coalesce(models.Subquery(pendientes), 0),
+        ) > 0
+
 class Mensaje(models.Model):
     """ Representa un mensaje individual dentro de una conversación. """
     conversacion = models.ForeignKey(Conversacion, on_delete=models.CASCADE, related_name='mensajes')
     autor = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='mensajes_enviados')
     contenido = models.TextField()
     fecha_envio = models.DateTimeField(auto_now_add=True)
-    leido = models.BooleanField(default=False)
+    # El estado de lectura vive en ParticipanteConversacion.ultimo_leido
 
     class Meta:
         # Ordena los mensajes del más antiguo al más reciente por defecto
-        ordering = ['fecha_envio']
+        ordering = ['fecha_envio', 'id']
+        indexes = [
+            # Clave de la paginación por cursor del historial (ver usuarios/paginacion.py)
+            models.Index(fields=['conversacion', 'fecha_envio', 'id'], name='mensaje_conv_fecha_id_idx'),
+        ]
 
     def __str__(self):
         return f"De {self.autor.username} en conversacion {self.conversacion.id}"
 
+
+class TerminoIndexado(models.Model):
+    """
+    Entrada del índice invertido de búsqueda (ver usuarios/busqueda.py): un
+    término normalizado presente en un documento, con su peso acumulado.
+    """
+    modelo = models.CharField(max_length=50)  # p. ej. 'usuarios.servicioofrecido'
+    objeto_id = models.PositiveBigIntegerField()
+    termino = models.CharField(max_length=40)
+    peso = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # Búsqueda exacta y por prefijo (rango sobre el índice)
+            models.Index(fields=['modelo', 'termino'], name='termino_modelo_termino_idx'),
+            # Reindexado y borrado de un documento
+            models.Index(fields=['modelo', 'objeto_id'], name='termino_modelo_objeto_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.termino} en {self.modelo}#{self.objeto_id}"
+
+
+class Tarea(models.Model):
+    """
+    Trabajo pendiente de la cola en base de datos (ver usuarios/tareas.py). El
+    comando procesar_tareas las reclama por lotes y las ejecuta fuera de las
+    peticiones HTTP.
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completada', 'Completada'),
+        ('fallida', 'Fallida'),
+    ]
+    tipo = models.CharField(max_length=60)
+    argumentos = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=12, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.PositiveSmallIntegerField(default=0)
+    max_intentos = models.PositiveSmallIntegerField(default=3)
+    disponible_en = models.DateTimeField(default=timezone.now)
+    reclamada_por = models.CharField(max_length=100, blank=True, default='')
+    reclamada_en = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Siguiente lote disponible para los trabajadores
+            models.Index(fields=['estado', 'disponible_en', 'id'], name='tarea_estado_disponible_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo}#{self.id} ({self.estado})"
+
+
+class BlobAlmacenado(models.Model):
+    """
+    Un archivo único del almacenamiento por contenido (ver
+    usuarios/almacenamiento.py) y cuántas filas lo referencian desde
+    Usuario.cv o ImagenServicio.imagen.
+    """
+    nombre = models.CharField(max_length=150, unique=True)
+    referencias = models.PositiveIntegerField(default=0)
+    tamaño = models.PositiveBigIntegerField(default=0)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.nombre} ({self.referencias} referencias)"
+
+    @classmethod
+    def bloquear(cls, nombre):
+        """
+        La fila del blob con SELECT ... FOR UPDATE (creada con 0 referencias si
+        no existe) hasta el final de la transacción en curso. Sumar referencias
+        y recolectar pasan por aquí, así que no se cruzan para un mismo blob.
+        """
+        fila = cls.objects.select_for_update().filter(nombre=nombre).first()
+        if fila is None:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(nombre=nombre, referencias=0, tamaño=cls.tamaño_de(nombre))
+            except IntegrityError:
+                # Otra petición creó la fila al mismo tiempo
+                pass
+            fila = cls.objects.select_for_update().get(nombre=nombre)
+        return fila
+
+    @classmethod
+    def sumar_referencia(cls, nombre, contenido=None):
+        """
+        Suma una referencia al blob. Si un borrado concurrente lo recolectó
+        después de que la subida lo diera por existente, lo vuelve a escribir
+        con `contenido` (el archivo subido).
+        """
+        if not nombre:
+            return
+        with transaction.atomic():
+            fila = cls.bloquear(nombre)
+            cambios = {'referencias': models.F('referencias') + 1}
+            if not almacenamiento_deduplicado.exists(nombre):
+                if contenido is None:
+                    logger.error("El blob %s ya no existe y no hay contenido para reescribirlo.", nombre)
+                else:
+                    almacenamiento_deduplicado.escribir(nombre, contenido)
+                    cambios['tamaño'] = cls.tamaño_de(nombre)
+            cls.objects.filter(pk=fila.pk).update(**cambios)
+
+    @classmethod
+    def restar_referencia(cls, nombre):
+        if not nombre:
+            return
+        cls.objects.filter(nombre=nombre, referencias__gt=0).update(referencias=models.F('referencias') - 1)
+        transaction.on_commit(lambda: cls.recolectar(nombre))
+
+    @classmethod
+    def recolectar(cls, nombre):
+        """ Borra el blob y sus variantes si ya nadie lo referencia. Devuelve True si lo borró. """
+        with transaction.atomic():
+            fila = cls.objects.select_for_update().filter(nombre=nombre).first()
+            if fila is None or fila.referencias > 0:
+                return False
+            cls.objects.filter(pk=fila.pk).delete()
+            # Con la fila aún bloqueada: una subida que espera en sumar_referencia()
+            # verá después que el archivo ya no está y lo reescribirá
+            if almacenamiento_deduplicado.exists(nombre):
+                almacenamiento_deduplicado.delete(nombre)
+            borrar_variantes_de(nombre, almacenamiento_deduplicado.derivados)
+        return True
+
+    @staticmethod
+    def tamaño_de(nombre):
+        try:
+            return almacenamiento_deduplicado.size(nombre)
+        except OSError:
+            return 0
+
+
+class Notificacion(models.Model):
+    """
+    Evento para el flujo de notificaciones de un usuario (ver
+    usuarios/notificaciones.py). El id es el cursor con el que un cliente
+    que se reconecta pide lo que se perdió; se guardan RETENCION_DIAS.
+    """
+    TIPO_CHOICES = [
+        ('mensaje', 'Mensajes nuevos en una conversación'),
+        ('postulacion', 'Postulación nueva a una vacante'),
+        ('estado_postulacion', 'Cambio de estado de una postulación'),
+    ]
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='notificaciones')
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    datos = models.JSONField(default=dict)
+    fecha = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Repetición desde un cursor: WHERE usuario_id = ? AND id > ? ORDER BY id
+            models.Index(fields=['usuario', 'id'], name='notificacion_usuario_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo}#{self.id} para {self.usuario_id}"
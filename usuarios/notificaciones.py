@@ -0,0 +1,234 @@
+# usuarios/notificaciones.py
+"""
+Flujo de notificaciones por usuario: un solo canal en vivo con los eventos
+que antes el cliente descubría consultando la API cada pocos segundos.
+
+- 'mensaje': mensajes nuevos en cualquiera de sus conversaciones (uno por
+  conversación y lote del escritor, con cuántos llegaron y el último).
+- 'postulacion': una postulación nueva a una vacante de la empresa.
+- 'estado_postulacion': la empresa cambió el estado de una postulación suya.
+
+Los eventos salen de señales (usuarios/signals.py), se guardan en
+Notificacion dentro de la misma transacción que el cambio y, cuando esta
+confirma, se envían por la capa de canales al grupo notificaciones_<id>: un
+group_send por usuario y transacción, con todos sus eventos juntos.
+
+Los clientes los reciben por websocket (chat.consumers.NotificacionesConsumer,
+ws/notificaciones/) o, si no pueden, por Server-Sent Events
+(FlujoNotificacionesView). Ambos aceptan un cursor ("desde", o la cabecera
+Last-Event-ID de EventSource): primero repiten lo guardado después de él en
+bloques de LOTE_REPETICION y luego pasan a lo que llega en vivo, agrupado en
+ventanas de VENTANA_MS. Ver settings.NOTIFICACIONES.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+
+from .autenticacion import TokenAuthenticationCacheada, obtener_resolutor
+from .models import Notificacion
+
+logger = logging.getLogger(__name__)
+
+# Un evento que se guardó antes de suscribirse pero confirmó después llega
+# por los dos caminos; se recuerdan los repetidos de este margen para no
+# enviarlo dos veces.
+MARGEN_DUPLICADOS = timedelta(seconds=60)
+
+
+def ajuste(nombre, por_defecto):
+    return getattr(settings, 'NOTIFICACIONES', {}).get(nombre, por_defecto)
+
+
+def grupo_notificaciones(usuario_id):
+    return f'notificaciones_{usuario_id}'
+
+
+def datos_notificacion(notificacion):
+    """ Delta compacto que reciben los clientes. """
+    return {
+        'id': notificacion.id,
+        'tipo': notificacion.tipo,
+        'fecha': notificacion.fecha.isoformat(),
+        'datos': notificacion.datos,
+    }
+
+
+def publicar(eventos):
+    """
+    Guarda [(usuario_id, tipo, datos)] y, al confirmar la transacción en
+    curso, los envía a los grupos de sus usuarios. Devuelve las Notificacion.
+    """
+    if not eventos:
+        return []
+    notificaciones = [Notificacion(usuario_id=usuario_id, tipo=tipo, datos=datos) for usuario_id, tipo, datos in eventos]
+    # Como en registrar_mensajes: sin ids devueltos por bulk_create (MySQL), de una en una
+    if connection.features.can_return_rows_from_bulk_insert:
+        Notificacion.objects.bulk_create(notificaciones)
+    else:
+        with transaction.atomic():
+            for notificacion in notificaciones:
+                notificacion.save(force_insert=True)
+    transaction.on_commit(lambda: repartir(notificaciones), robust=True)
+    return notificaciones
+
+
+def repartir(notificaciones):
+    capa = get_channel_layer()
+    if capa is None:
+        return
+    por_usuario = defaultdict(list)
+    for notificacion in notificaciones:
+        por_usuario[notificacion.usuario_id].append(datos_notificacion(notificacion))
+    for usuario_id, eventos in por_usuario.items():
+        try:
+            async_to_sync(capa.group_send)(grupo_notificaciones(usuario_id), {
+                'type': 'notificaciones_evento', 'eventos': eventos,
+            })
+        except Exception:
+            # Quedan guardadas: el cliente las recupera al reconectar con su cursor
+            logger.exception("No se pudieron enviar %s notificaciones al usuario %s", len(eventos), usuario_id)
+
+
+def purgar(dias=None):
+    """ Borra las notificaciones con más de `dias` (RETENCION_DIAS). Devuelve cuántas. """
+    limite = timezone.now() - timedelta(days=dias if dias is not None else ajuste('RETENCION_DIAS', 14))
+    borradas, _ = Notificacion.objects.filter(fecha__lt=limite).delete()
+    return borradas
+
+
+def cursor_de(valor):
+    """ El cursor de un cliente ("desde" o Last-Event-ID); None si no es válido. """
+    try:
+        cursor = int(valor or 0)
+    except (TypeError, ValueError):
+        return None
+    return cursor if cursor >= 0 else None
+
+
+class Suscripcion:
+    """
+    Un cliente del flujo. Se crea antes de unirse al grupo: repetir() lee lo
+    guardado después del cursor y en_vivo() descarta de lo que llega por el
+    grupo lo que ya se repitió o el cliente ya tenía, así que entre la
+    repetición y el vivo no hay huecos ni duplicados.
+    """
+
+    def __init__(self, usuario_id, desde=0):
+        self.usuario_id = usuario_id
+        self.desde = desde
+        self.cursor = desde
+        self.inicio = timezone.now()
+        self._repetidos = set()
+
+    def _leer(self):
+        return list(Notificacion.objects.filter(
+            usuario_id=self.usuario_id, id__gt=self.cursor
+        ).order_by('id')[:ajuste('LOTE_REPETICION', 200)])
+
+    async def repetir(self):
+        """ Genera bloques de eventos guardados después del cursor, del más antiguo al más nuevo. """
+        tamaño = ajuste('LOTE_REPETICION', 200)
+        reciente = self.inicio - MARGEN_DUPLICADOS
+        while True:
+            notificaciones = await sync_to_async(self._leer)()
+            if not notificaciones:
+                return
+            self.cursor = notificaciones[-1].id
+            self._repetidos.update(n.id for n in notificaciones if n.fecha >= reciente)
+            yield [datos_notificacion(n) for n in notificaciones]
+            if len(notificaciones) < tamaño:
+                return
+
+    def en_vivo(self, eventos):
+        nuevos = []
+        for evento in eventos:
+            if evento['id'] <= self.desde or evento['id'] in self._repetidos:
+                self._repetidos.discard(evento['id'])
+                continue
+            nuevos.append(evento)
+        return nuevos
+
+
+def formato_sse(eventos):
+    """ Varios eventos SSE en un solo envío; el id alimenta Last-Event-ID al reconectar. """
+    return ''.join(
+        f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {json.dumps(evento, separators=(',', ':'))}\n\n"
+        for evento in eventos
+    )
+
+
+class FlujoNotificacionesView(View):
+    """
+    Alternativa por Server-Sent Events al websocket de notificaciones, para
+    clientes o redes que no lo permiten. Necesita el servidor ASGI (daphne).
+    EventSource no manda cabeceras propias: el token puede ir en ?token=.
+    """
+
+    async def get(self, request):
+        usuario = await sync_to_async(self.autenticar)(request)
+        if usuario is None:
+            return JsonResponse({'error': 'Token inválido o ausente.'}, status=401)
+        desde = cursor_de(request.headers.get('Last-Event-ID') or request.GET.get('desde'))
+        if desde is None:
+            return JsonResponse({'error': "El cursor debe ser un id de evento."}, status=400)
+
+        respuesta = StreamingHttpResponse(self.flujo(usuario.id, desde), content_type='text/event-stream')
+        respuesta['Cache-Control'] = 'no-cache'
+        # nginx no debe acumular la respuesta
+        respuesta['X-Accel-Buffering'] = 'no'
+        return respuesta
+
+    @staticmethod
+    def autenticar(request):
+        try:
+            autenticado = TokenAuthenticationCacheada().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if autenticado is not None:
+            return autenticado[0]
+        usuario = obtener_resolutor().resolver(request.GET.get('token', ''))
+        return usuario if usuario is not None and usuario.is_active else None
+
+    @staticmethod
+    async def flujo(usuario_id, desde):
+        capa = get_channel_layer()
+        canal = await capa.new_channel()
+        grupo = grupo_notificaciones(usuario_id)
+        suscripcion = Suscripcion(usuario_id, desde)
+        await capa.group_add(grupo, canal)
+        try:
+            yield f"retry: {ajuste('SSE_REINTENTO_MS', 3000)}\n\n"
+            async for eventos in suscripcion.repetir():
+                yield formato_sse(eventos)
+            ventana = ajuste('VENTANA_MS', 200) / 1000
+            while True:
+                try:
+                    mensaje = await asyncio.wait_for(capa.receive(canal), ajuste('SSE_LATIDO_SEGUNDOS', 25))
+                except asyncio.TimeoutError:
+                    # Comentario SSE: mantiene viva la conexión a través de proxies
+                    yield ": latido\n\n"
+                    continue
+                eventos = list(mensaje.get('eventos', ()))
+                limite = asyncio.get_running_loop().time() + ventana
+                while (restante := limite - asyncio.get_running_loop().time()) > 0:
+                    try:
+                        mensaje = await asyncio.wait_for(capa.receive(canal), restante)
+                    except asyncio.TimeoutError:
+                        break
+                    eventos.extend(mensaje.get('eventos', ()))
+                eventos = suscripcion.en_vivo(eventos)
+                if eventos:
+                    yield formato_sse(eventos)
+        finally:
+            await capa.group_discard(grupo, canal)
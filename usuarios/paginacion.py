@@ -0,0 +1,119 @@
+# usuarios/paginacion.py
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MensajeKeysetPagination(BasePagination):
+    """
+    Paginación por clave (conversacion_id, fecha_envio, id) para el historial de
+    un chat. No hace COUNT(*) ni OFFSET: cada página es un rango del índice
+    compuesto de Mensaje, así que cuesta lo mismo al principio que al final
+    de una conversación larga.
+
+      (sin parámetros)  -> los mensajes más recientes
+      ?antes_de=<id>    -> "cargar anteriores": mensajes previos a <id>
+      ?despues_de=<id>  -> "nuevos desde <id>": mensajes posteriores a <id>
+      ?limite=<n>       -> tamaño de página (máximo max_page_size)
+
+    Los resultados siempre se devuelven en orden cronológico.
+    """
+    page_size = 30
+    max_page_size = 100
+    page_size_query_param = 'limite'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limite = self.obtener_limite(request)
+        antes_de = self.obtener_id(request, 'antes_de')
+        despues_de = self.obtener_id(request, 'despues_de')
+        if antes_de and despues_de:
+            raise ValidationError({'error': 'Usa solo uno de "antes_de" o "despues_de".'})
+
+        pivote = antes_de or despues_de
+        self.modo = 'despues' if despues_de else 'antes'
+        self.con_pivote = pivote is not None
+
+        if pivote is not None:
+            fecha = queryset.filter(pk=pivote).values_list('fecha_envio', flat=True).first()
+            if fecha is None:
+                raise ValidationError({'error': 'El mensaje de referencia no existe en esta conversación.'})
+            if self.modo == 'antes':
+                queryset = queryset.filter(Q(fecha_envio__lt=fecha) | Q(fecha_envio=fecha, id__lt=pivote))
+            else:
+                queryset = queryset.filter(Q(fecha_envio__gt=fecha) | Q(fecha_envio=fecha, id__gt=pivote))
+
+        if self.modo == 'antes':
+            filas = list(queryset.order_by('-fecha_envio', '-id')[:self.limite + 1])
+            self.hay_mas = len(filas) > self.limite
+            self.pagina = list(reversed(filas[:self.limite]))
+        else:
+            filas = list(queryset.order_by('fecha_envio', 'id')[:self.limite + 1])
+            self.hay_mas = len(filas) > self.limite
+            self.pagina = filas[:self.limite]
+        return self.pagina
+
+    def get_paginated_response(self, data):
+        anteriores = siguientes = None
+        if self.pagina:
+            primero, ultimo = self.pagina[0].id, self.pagina[-1].id
+            if self.modo == 'antes':
+                anteriores = self.enlace('antes_de', primero) if self.hay_mas else None
+                siguientes = self.enlace('despues_de', ultimo) if self.con_pivote else None
+            else:
+                anteriores = self.enlace('antes_de', primero)
+                siguientes = self.enlace('despues_de', ultimo) if self.hay_mas else None
+        return Response({
+            'next': siguientes,
+            'previous': anteriores,
+            'results': data,
+        })
+
+    def enlace(self, parametro, valor):
+        url = self.request.build_absolute_uri()
+        otro = 'despues_de' if parametro == 'antes_de' else 'antes_de'
+        return replace_query_param(remove_query_param(url, otro), parametro, valor)
+
+    def obtener_limite(self, request):
+        try:
+            limite = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(limite, self.max_page_size))
+
+    @staticmethod
+    def obtener_id(request, parametro):
+        valor = request.query_params.get(parametro)
+        if valor in (None, ''):
+            return None
+        try:
+            return int(valor)
+        except ValueError:
+            raise ValidationError({'error': f'"{parametro}" debe ser un id de mensaje.'})
+
+
+class PublicacionesCursorPagination(CursorPagination):
+    """ Scroll infinito para servicios y vacantes, ordenado del más reciente al más antiguo. """
+    ordering = ('-fecha_publicacion', '-id')
+
+
+class PublicacionesPagination(PageNumberPagination):
+    """
+    Paginación por número de página (la de siempre) o, con ?modo=cursor, por
+    cursor para scroll infinito sin COUNT(*) ni OFFSET. Las búsquedas (?search=)
+    siempre usan números de página para conservar el orden por relevancia.
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = None
+        quiere_cursor = request.query_params.get('modo') == 'cursor' or 'cursor' in request.query_params
+        if quiere_cursor and not request.query_params.get('search'):
+            self.cursor = PublicacionesCursorPagination()
+            return self.cursor.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor is not None:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
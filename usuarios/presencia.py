@@ -0,0 +1,110 @@
+# usuarios/presencia.py
+"""
+Presencia (en línea / última vez) e indicadores de "escribiendo" del chat.
+
+Los eventos viajan por la capa de canales (CHANNEL_LAYERS) a los grupos de
+cada sala; el estado, que la capa de canales no guarda, vive en una caché
+compartida por todos los procesos (settings.PRESENCIA['CACHE'], Redis):
+
+    presencia:c:<id>:<hueco>  una por conexión abierta, caduca si no late
+    presencia:u:<id>          fecha ISO de la última desconexión
+
+Cada conexión ocupa uno de los MAXIMO_CONEXIONES huecos del usuario (con
+cache.add, que decide entre procesos) y renueva solo el suyo cada
+LATIDO_SEGUNDOS. Si un proceso muere sin desconectar a sus clientes, sus
+huecos dejan de renovarse y caducan tras EXPIRA_SEGUNDOS aunque otras
+conexiones del usuario sigan latiendo: el usuario está en línea mientras
+quede algún hueco vivo.
+
+Los avisos de escritura se agrupan en el servidor: por usuario y sala, solo
+el primero de cada ventana de ESCRIBIENDO_SEGUNDOS llega a la sala (cache.add
+decide entre todos los procesos).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+
+def ajuste(nombre, por_defecto):
+    return getattr(settings, 'PRESENCIA', {}).get(nombre, por_defecto)
+
+
+def _cache():
+    return caches[ajuste('CACHE', 'default')]
+
+
+def claves_conexiones(usuario_id):
+    return [f'presencia:c:{usuario_id}:{hueco}' for hueco in range(ajuste('MAXIMO_CONEXIONES', 10))]
+
+
+def clave_ultima_vez(usuario_id):
+    return f'presencia:u:{usuario_id}'
+
+
+async def _ocupar_hueco(cache, usuario_id, conexion):
+    """ (clave del hueco ocupado o None si están todos, conexiones vivas que había antes). """
+    claves = claves_conexiones(usuario_id)
+    vivas = await cache.aget_many(claves)
+    for clave in claves:
+        if clave not in vivas and await cache.aadd(clave, conexion, ajuste('EXPIRA_SEGUNDOS', 75)):
+            return clave, vivas
+    return None, vivas
+
+
+async def conectar(usuario_id, conexion):
+    """
+    Registra la conexión `conexion` (p. ej. el channel_name del consumer).
+    Devuelve el hueco que ocupa, que hay que pasar a latido() y desconectar().
+    Con todos los huecos ocupados devuelve None y latido() lo vuelve a intentar:
+    el usuario ya está en línea por sus otras conexiones.
+    """
+    hueco, _ = await _ocupar_hueco(_cache(), usuario_id, conexion)
+    return hueco
+
+
+async def latido(usuario_id, conexion, hueco):
+    """ Renueva la caducidad del hueco de la conexión; si lo perdió, ocupa otro. Devuelve el hueco. """
+    cache = _cache()
+    if hueco is not None and await cache.aget(hueco) == conexion:
+        if await cache.atouch(hueco, ajuste('EXPIRA_SEGUNDOS', 75)):
+            return hueco
+    hueco, _ = await _ocupar_hueco(cache, usuario_id, conexion)
+    return hueco
+
+
+async def desconectar(usuario_id, conexion, hueco):
+    """ Libera el hueco de la conexión. Devuelve True si el usuario queda desconectado. """
+    cache = _cache()
+    # Si caducó, el hueco puede ser ya de otra conexión: solo se borra el propio
+    if hueco is not None and await cache.aget(hueco) == conexion:
+        await cache.adelete(hueco)
+    if await cache.aget_many(claves_conexiones(usuario_id)):
+        return False
+    await cache.aset(clave_ultima_vez(usuario_id), timezone.now().isoformat(), None)
+    return True
+
+
+def estado(usuario_ids):
+    """ {id: {'en_linea', 'ultima_vez'}} de varios usuarios con un solo get_many. """
+    conexiones = {usuario_id: claves_conexiones(usuario_id) for usuario_id in usuario_ids}
+    claves = [clave for claves in conexiones.values() for clave in claves]
+    claves += [clave_ultima_vez(usuario_id) for usuario_id in usuario_ids]
+    valores = _cache().get_many(claves)
+    return {
+        usuario_id: {
+            'en_linea': any(clave in valores for clave in conexiones[usuario_id]),
+            'ultima_vez': valores.get(clave_ultima_vez(usuario_id)),
+        }
+        for usuario_id in usuario_ids
+    }
+
+
+async def en_linea(usuario_id):
+    return bool(await _cache().aget_many(claves_conexiones(usuario_id)))
+
+
+async def avisar_escritura(conversacion_id, usuario_id):
+    """ True si este aviso de "escribiendo" debe llegar a la sala (uno por ventana). """
+    return await _cache().aadd(
+        f'presencia:e:{conversacion_id}:{usuario_id}', 1, ajuste('ESCRIBIENDO_SEGUNDOS', 3)
+    )
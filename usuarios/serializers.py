@@ -1,19 +1,34 @@
 # usuarios/serializers.py (VERSIÓN FINAL CON RESEÑAS DE OFERENTE Y VALIDACIÓN DE CONTACTO)
 
+from collections import defaultdict
 from rest_framework import serializers
 from django.contrib.auth import password_validation
+from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.urls import reverse
+from . import fragmentos, imagenes, medios
+from .fragmentos import FragmentoCacheadoMixin
 from .models import (
     Usuario, ServicioOfrecido, VacanteEmpresa, Postulacion, Reseña,
-    Conversacion, Mensaje, ImagenServicio
+    Conversacion, Mensaje, ImagenServicio, ResumenCalificacion
 )
 
 # --- SERIALIZERS PARA USUARIO Y AUTENTICACIÓN ---
 # ... (Sin cambios aquí) ...
 class UsuarioSerializer(serializers.ModelSerializer):
     """ Muestra la información pública de un usuario. """
+    cv = serializers.SerializerMethodField()
     class Meta:
         model = Usuario
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'region', 'tipo_usuario', 'cv']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'region', 'tipo_usuario', 'cv', 'cv_estado']
+
+    def get_cv(self, obj):
+        # Los CV no son públicos: la URL lleva una firma temporal (ver usuarios/medios.py)
+        request = self.context.get('request')
+        if request and obj.cv:
+            return medios.url_firmada(request, obj.cv)
+        return None
 
 class RegistroSerializer(serializers.ModelSerializer):
     """ Maneja el registro de nuevos usuarios. """
@@ -77,13 +92,34 @@ class ReseñaSerializer(serializers.ModelSerializer):
             'ambiente_laboral', 'comunicacion', 'balance_vida_trabajo'
         ]
 
+def reseñas_recientes_por_usuario(usuario_ids, limite=5):
+    """
+    Devuelve {usuario_id: [reseñas]} con las últimas `limite` reseñas recibidas
+    por cada usuario, usando una sola consulta con función de ventana.
+    """
+    if not usuario_ids:
+        return {}
+    reseñas = Reseña.objects.filter(evaluado_id__in=usuario_ids).select_related('evaluador').annotate(
+        posicion=Window(
+            RowNumber(),
+            partition_by=[F('evaluado_id')],
+            order_by=[F('fecha_creacion').desc(), F('id').desc()],
+        )
+    ).filter(posicion__lte=limite).order_by('evaluado_id', 'posicion')
+    por_usuario = defaultdict(list)
+    for reseña in reseñas:
+        por_usuario[reseña.evaluado_id].append(reseña)
+    return por_usuario
+
 # --- SERIALIZER PARA IMÁGENES DE SERVICIO ---
 # ... (Sin cambios aquí) ...
 class ImagenServicioSerializer(serializers.ModelSerializer):
     imagen_url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
     class Meta:
         model = ImagenServicio
-        fields = ['id', 'imagen', 'imagen_url']
+        fields = ['id', 'imagen', 'imagen_url', 'srcset', 'estado', 'error']
+        read_only_fields = ['estado', 'error']
         extra_kwargs = {'imagen': {'write_only': True}}
 
     def get_imagen_url(self, obj):
@@ -92,8 +128,59 @@ class ImagenServicioSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.imagen.url)
         return None
 
+    def get_srcset(self, obj):
+        # {'webp': '<url> 320w, <url> 1024w', 'jpg': ...}; vacío mientras no haya variantes
+        request = self.context.get('request')
+        if not request:
+            return {}
+        storage = obj.imagen.storage
+        return imagenes.srcset(obj.variantes, lambda nombre: request.build_absolute_uri(storage.url(nombre)))
+
 # --- SERIALIZER PARA SERVICIOS (CORRECCIÓN APLICADA) ---
-class ServicioOfrecidoSerializer(serializers.ModelSerializer):
+class ServicioOfrecidoListSerializer(serializers.ListSerializer):
+    """
+    Serializa una lista de servicios con un número fijo de consultas, sin
+    importar cuántos servicios tenga la página: oferentes e imágenes, las
+    últimas reseñas de todos los oferentes, sus promedios y el conjunto de
+    servicios que el usuario actual ya contactó se cargan de una sola vez.
+    Los servicios cuyo fragmento ya está en caché (ver usuarios/fragmentos.py)
+    no se precargan: solo se calcula para ellos usuario_ha_contactado.
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        servicios = list(iterable)
+        self.fragmentos, self.claves_fragmento = fragmentos.obtener(self.child, servicios)
+        faltantes = [servicio for servicio in servicios if servicio.pk not in self.fragmentos]
+        self.precargado = self.precargar(faltantes, servicios)
+        return [self.child.to_representation(servicio) for servicio in servicios]
+
+    def precargar(self, servicios, todos):
+        # No repite el trabajo si la vista ya hizo select_related/prefetch_related
+        models.prefetch_related_objects(servicios, 'usuario_oferente', 'imagenes')
+        oferente_ids = {servicio.usuario_oferente_id for servicio in servicios}
+
+        reseñas = reseñas_recientes_por_usuario(oferente_ids)
+        # Cada oferente se serializa una sola vez aunque tenga varios servicios en la página
+        reseñas_serializadas = {
+            oferente_id: ReseñaSerializer(reseñas.get(oferente_id, []), many=True, context=self.context).data
+            for oferente_id in oferente_ids
+        }
+
+        contactados = set()
+        request = self.context.get('request')
+        if todos and request and request.user.is_authenticated:
+            contactados = set(Conversacion.objects.filter(
+                participantes=request.user,
+                servicio_relacionado_id__in=[servicio.id for servicio in todos]
+            ).values_list('servicio_relacionado_id', flat=True))
+
+        return {
+            'reseñas': reseñas_serializadas,
+            'promedios': ResumenCalificacion.promedios_de(oferente_ids, 'oferente') if oferente_ids else {},
+            'contactados': contactados,
+        }
+
+class ServicioOfrecidoSerializer(FragmentoCacheadoMixin, serializers.ModelSerializer):
     usuario_oferente = serializers.ReadOnlyField(source='usuario_oferente.username')
     usuario_oferente_id = serializers.ReadOnlyField(source='usuario_oferente.id')
     usuario_ha_contactado = serializers.SerializerMethodField()
@@ -113,28 +200,31 @@ class ServicioOfrecidoSerializer(serializers.ModelSerializer):
             'promedio_calificacion_oferente',
             'usuario_ha_contactado' # <-- 2. AÑADIMOS EL CAMPO A LA LISTA
         ]
+        list_serializer_class = ServicioOfrecidoListSerializer
+
+    # Depende de quién pregunta: nunca entra en el fragmento compartido
+    campos_fuera_del_fragmento = ('usuario_ha_contactado',)
+
+    def dependencias_fragmento(self, obj):
+        return [('servicio', obj.pk), ('usuario', obj.usuario_oferente_id)]
+
+    def _precargado(self):
+        # Datos cargados por ServicioOfrecidoListSerializer cuando se serializa con many=True
+        return getattr(self.parent, 'precargado', None)
 
     def get_reseñas_oferente(self, obj):
-        # ... (Esta función no cambia)
+        precargado = self._precargado()
+        if precargado is not None:
+            return precargado['reseñas'][obj.usuario_oferente_id]
         reseñas = Reseña.objects.filter(evaluado=obj.usuario_oferente).order_by('-fecha_creacion')
         return ReseñaSerializer(reseñas[:5], many=True, context=self.context).data
 
     def get_promedio_calificacion_oferente(self, obj):
-        # ... (Esta función no cambia)
-        reseñas = Reseña.objects.filter(evaluado=obj.usuario_oferente)
-        if not reseñas.exists(): return None
-        total_sum, count = 0, 0
-        campos_oferente = [
-            'eficiencia_tareas', 'atencion', 'manejo_instrucciones',
-            'puntualidad_trabajador', 'responsabilidad', 'comunicacion_proactiva'
-        ]
-        for reseña in reseñas:
-            for campo in campos_oferente:
-                valor = getattr(reseña, campo)
-                if valor is not None:
-                    total_sum += valor
-                    count += 1
-        return round(total_sum / count, 1) if count > 0 else None
+        precargado = self._precargado()
+        if precargado is not None:
+            return precargado['promedios'].get(obj.usuario_oferente_id)
+        # Leemos el resumen precalculado en lugar de recorrer todas las reseñas
+        return ResumenCalificacion.promedio_de(obj.usuario_oferente_id, 'oferente')
 
     # --- 3. AÑADIMOS LA FUNCIÓN FALTANTE ---
     def get_usuario_ha_contactado(self, obj):
@@ -146,7 +236,11 @@ class ServicioOfrecidoSerializer(serializers.ModelSerializer):
         # Si no hay un usuario logueado, no puede haber contactado.
         if not request or not request.user.is_authenticated:
             return False
-        
+
+        precargado = self._precargado()
+        if precargado is not None:
+            return obj.id in precargado['contactados']
+
         # Verificamos si existe una conversación entre el usuario actual y el oferente.
         return Conversacion.objects.filter(
             participantes=request.user,
@@ -172,7 +266,7 @@ class PostulacionDetalleSerializer(serializers.ModelSerializer):
     def get_profesional_cv(self, obj):
         request = self.context.get('request')
         if request and obj.profesional.cv and hasattr(obj.profesional.cv, 'url'):
-            return request.build_absolute_uri(obj.profesional.cv.url)
+            return medios.url_firmada(request, obj.profesional.cv)
         return None
 
 class MisPostulacionesSerializer(serializers.ModelSerializer):
@@ -190,7 +284,33 @@ class MisPostulacionesSerializer(serializers.ModelSerializer):
             "empresa_id": obj.vacante.empresa.id,
         }
 
-class VacanteEmpresaSerializer(serializers.ModelSerializer):
+class VacanteEmpresaListSerializer(serializers.ListSerializer):
+    """
+    Serializa una lista de vacantes cargando las reseñas y el promedio de cada
+    empresa distinta una sola vez por página; las vacantes de una misma
+    empresa comparten el resultado. Las vacantes con fragmento en caché no
+    se precargan.
+    """
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        vacantes = list(iterable)
+        self.fragmentos, self.claves_fragmento = fragmentos.obtener(self.child, vacantes)
+        self.precargado = self.precargar([vacante for vacante in vacantes if vacante.pk not in self.fragmentos])
+        return [self.child.to_representation(vacante) for vacante in vacantes]
+
+    def precargar(self, vacantes):
+        models.prefetch_related_objects(vacantes, 'empresa')
+        empresa_ids = {vacante.empresa_id for vacante in vacantes}
+        reseñas = reseñas_recientes_por_usuario(empresa_ids)
+        return {
+            'reseñas': {
+                empresa_id: ReseñaSerializer(reseñas.get(empresa_id, []), many=True, context=self.context).data
+                for empresa_id in empresa_ids
+            },
+            'promedios': ResumenCalificacion.promedios_de(empresa_ids, 'empresa') if empresa_ids else {},
+        }
+
+class VacanteEmpresaSerializer(FragmentoCacheadoMixin, serializers.ModelSerializer):
     empresa_username = serializers.ReadOnlyField(source='empresa.username')
     empresa_id = serializers.ReadOnlyField(source='empresa.id')
     reseñas_empresa = serializers.SerializerMethodField()
@@ -204,96 +324,124 @@ class VacanteEmpresaSerializer(serializers.ModelSerializer):
             'fecha_publicacion', 'activa',
             'reseñas_empresa', 'promedio_calificacion_empresa'
         ]
+        list_serializer_class = VacanteEmpresaListSerializer
+
+    def dependencias_fragmento(self, obj):
+        return [('vacante', obj.pk), ('usuario', obj.empresa_id)]
+
+    def _precargado(self):
+        # Datos cargados por VacanteEmpresaListSerializer cuando se serializa con many=True
+        return getattr(self.parent, 'precargado', None)
 
     def get_reseñas_empresa(self, obj):
+        precargado = self._precargado()
+        if precargado is not None:
+            return precargado['reseñas'][obj.empresa_id]
         reseñas = Reseña.objects.filter(evaluado=obj.empresa).order_by('-fecha_creacion')
         return ReseñaSerializer(reseñas[:5], many=True, context=self.context).data
 
     def get_promedio_calificacion_empresa(self, obj):
-        reseñas = Reseña.objects.filter(evaluado=obj.empresa)
-        if not reseñas.exists(): return None
-        total_sum, count = 0, 0
-        campos_empresa = [
-            'claridad_requerimientos', 'recursos_proporcionados', 'Soporte_tecnicoMaterial',
-            'puntualidad_pago', 'inclusividad', 'transparencia_contractual', 'respeto_horarios',
-            'ambiente_laboral', 'comunicacion', 'balance_vida_trabajo'
-        ]
-        for reseña in reseñas:
-            for campo in campos_empresa:
-                valor = getattr(reseña, campo)
-                if valor is not None:
-                    total_sum += valor
-                    count += 1
-        return round(total_sum / count, 1) if count > 0 else None
-
-class VacanteConPostulantesSerializer(VacanteEmpresaSerializer):
-    postulantes = PostulacionDetalleSerializer(many=True, read_only=True)
-    class Meta(VacanteEmpresaSerializer.Meta):
-        fields = VacanteEmpresaSerializer.Meta.fields + ['postulantes']
-
-class PerfilPublicoSerializer(serializers.ModelSerializer):
-    servicios_ofrecidos = serializers.SerializerMethodField()
-    vacantes_publicadas = serializers.SerializerMethodField()
-    reseñas_recibidas = ReseñaSerializer(many=True, read_only=True)
+        precargado = self._precargado()
+        if precargado is not None:
+            return precargado['promedios'].get(obj.empresa_id)
+        return ResumenCalificacion.promedio_de(obj.empresa_id, 'empresa')
+
+def conteos_publicos(usuario_id):
+    """
+    Servicios y vacantes activos y reseñas recibidas de un usuario, con una
+    sola consulta de subconsultas COUNT (sin cargar ninguna fila).
+    """
+    def contar(queryset, campo):
+        total = queryset.filter(**{campo: OuterRef('pk')}).order_by().values(campo).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(total, output_field=models.IntegerField()), 0)
+
+    return Usuario.objects.filter(pk=usuario_id).annotate(
+        total_servicios=contar(ServicioOfrecido.objects.filter(activo=True), 'usuario_oferente'),
+        total_vacantes=contar(VacanteEmpresa.objects.filter(activa=True), 'empresa'),
+        total_reseñas=contar(Reseña.objects.all(), 'evaluado'),
+    ).values('total_servicios', 'total_vacantes', 'total_reseñas').first() or {}
+
+class PerfilPublicoSerializer(FragmentoCacheadoMixin, serializers.ModelSerializer):
+    """
+    Resumen compacto del perfil: datos públicos, totales y promedio
+    precalculado. Servicios, vacantes y reseñas se piden paginados a los
+    subrecursos de `enlaces` o se incrustan con ?expand= (ver PerfilPublicoAPIView).
+    """
+    total_servicios = serializers.SerializerMethodField()
+    total_vacantes = serializers.SerializerMethodField()
+    total_reseñas = serializers.SerializerMethodField()
     promedio_calificacion = serializers.SerializerMethodField()
+    enlaces = serializers.SerializerMethodField()
     class Meta:
         model = Usuario
         fields = [
-            'id', 'username', 'first_name', 'last_name', 'region', 
-            'tipo_usuario', 'servicios_ofrecidos', 'vacantes_publicadas',
-            'reseñas_recibidas', 'promedio_calificacion'
+            'id', 'username', 'first_name', 'last_name', 'region', 'tipo_usuario',
+            'total_servicios', 'total_vacantes', 'total_reseñas', 'promedio_calificacion', 'enlaces'
         ]
 
-    def get_servicios_ofrecidos(self, obj):
-        servicios_activos = ServicioOfrecido.objects.filter(usuario_oferente=obj, activo=True)
-        return ServicioOfrecidoSerializer(servicios_activos, many=True, context=self.context).data
+    def dependencias_fragmento(self, obj):
+        # 'perfil' cambia cuando el usuario publica, edita o borra un servicio o
+        # una vacante; las reseñas ya cambian la versión de 'usuario'
+        return [('usuario', obj.pk), ('perfil', obj.pk)]
+
+    def _conteos(self, obj):
+        if getattr(self, '_conteos_de', None) != obj.pk:
+            self._conteos_de, self._conteos_cargados = obj.pk, conteos_publicos(obj.pk)
+        return self._conteos_cargados
+
+    def get_total_servicios(self, obj):
+        return self._conteos(obj).get('total_servicios', 0)
+
+    def get_total_vacantes(self, obj):
+        return self._conteos(obj).get('total_vacantes', 0)
+
+    def get_total_reseñas(self, obj):
+        return self._conteos(obj).get('total_reseñas', 0)
 
-    def get_vacantes_publicadas(self, obj):
-        vacantes_activas = VacanteEmpresa.objects.filter(empresa=obj, activa=True)
-        return VacanteEmpresaSerializer(vacantes_activas, many=True, context=self.context).data
-    
     def get_promedio_calificacion(self, obj):
-        reseñas = obj.reseñas_recibidas.all()
-        if not reseñas.exists(): return None
-        total_sum, count = 0, 0
-        if obj.tipo_usuario == 'empresa':
-            campos = [
-                'claridad_requerimientos', 'recursos_proporcionados', 'Soporte_tecnicoMaterial',
-                'puntualidad_pago', 'inclusividad', 'transparencia_contractual', 'respeto_horarios',
-                'ambiente_laboral', 'comunicacion', 'balance_vida_trabajo'
-            ]
-        else:
-            campos = [
-                'calidad_tecnica', 'solucion_problemas', 'cumplimiento_estandares',
-                'eficiencia_tareas', 'atencion', 'manejo_instrucciones',
-                'puntualidad_trabajador', 'responsabilidad', 'comunicacion_proactiva'
-            ]
-        for reseña in reseñas:
-            for campo in campos:
-                valor = getattr(reseña, campo)
-                if valor is not None:
-                    total_sum += valor
-                    count += 1
-        return round(total_sum / count, 1) if count > 0 else None
+        rol = 'empresa' if obj.tipo_usuario == 'empresa' else 'trabajador'
+        return ResumenCalificacion.promedio_de(obj.id, rol)
+
+    def get_enlaces(self, obj):
+        request = self.context.get('request')
+        enlaces = {}
+        for nombre, ruta in (('servicios', 'api_perfil_servicios'), ('vacantes', 'api_perfil_vacantes'),
+                             ('reseñas', 'api_perfil_reseñas')):
+            url = reverse(ruta, kwargs={'username': obj.username})
+            enlaces[nombre] = request.build_absolute_uri(url) if request else url
+        return enlaces
 
 # --- SERIALIZERS PARA MENSAJERÍA ---
 class MensajeSerializer(serializers.ModelSerializer):
     autor_username = serializers.ReadOnlyField(source='autor.username')
+    leido = serializers.SerializerMethodField()
     class Meta:
         model = Mensaje
         fields = ['id', 'autor', 'autor_username', 'contenido', 'fecha_envio', 'leido']
         read_only_fields = ['autor']
 
+    def get_leido(self, obj):
+        """
+        Un mensaje está leído si algún otro participante tiene su marca de
+        lectura en ese mensaje o después. La vista pasa las marcas en el
+        contexto como {usuario_id: ultimo_leido}.
+        """
+        marcas = self.context.get('marcas_lectura', {})
+        return any(marca >= obj.id for usuario_id, marca in marcas.items() if usuario_id != obj.autor_id)
+
 class ConversacionSerializer(serializers.ModelSerializer):
     otro_participante = serializers.SerializerMethodField()
     ultimo_mensaje = serializers.SerializerMethodField()
     nombre_servicio_relacionado = serializers.SerializerMethodField()
     servicio_id_relacionado = serializers.SerializerMethodField()
 
+    # Anotado por ConversacionListAPIView desde el contador del participante
+    no_leidos = serializers.IntegerField(read_only=True, default=0)
+
     class Meta:
         model = Conversacion
         fields = ['id', 'otro_participante', 'ultimo_mensaje', 'fecha_modificacion',
-        'nombre_servicio_relacionado', 'servicio_id_relacionado']
+        'nombre_servicio_relacionado', 'servicio_id_relacionado', 'no_leidos']
     
     def get_servicio_id_relacionado(self, obj):
         """Devuelve el ID del servicio si la conversación está ligada a uno."""
@@ -308,13 +456,14 @@ class ConversacionSerializer(serializers.ModelSerializer):
         return None
     def get_otro_participante(self, obj):
         usuario_actual = self.context['request'].user
-        otro = obj.participantes.exclude(id=usuario_actual.id).first()
+        # participantes viene precargado por ConversacionListAPIView
+        otro = next((usuario for usuario in obj.participantes.all() if usuario.id != usuario_actual.id), None)
         if otro:
             return {'id': otro.id, 'username': otro.username}
         return None
 
     def get_ultimo_mensaje(self, obj):
-        ultimo = obj.mensajes.last()
-        if ultimo:
-            return {'contenido': ultimo.contenido[:50], 'fecha_envio': ultimo.fecha_envio}
+        # Datos desnormalizados en la conversación: no hace falta consultar los mensajes
+        if obj.ultimo_mensaje_id:
+            return {'contenido': obj.ultimo_mensaje_preview[:50], 'fecha_envio': obj.ultimo_mensaje_fecha}
         return None
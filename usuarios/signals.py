@@ -0,0 +1,245 @@
+# usuarios/signals.py
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .autenticacion import obtener_resolutor
+from .membresias import obtener_cache_membresias
+from . import fragmentos, notificaciones
+from .busqueda import obtener_backend
+from .eventos import estados_postulacion_cambiados, mensajes_registrados
+from .mensajeria import LONGITUD_PREVIEW
+from .models import (
+    BlobAlmacenado, Conversacion, ImagenServicio, ParticipanteConversacion, Postulacion, Reseña,
+    ResumenCalificacion, ServicioOfrecido, TransicionPostulacion, Usuario, VacanteEmpresa,
+)
+from .tareas import encolar
+
+# --- Resúmenes de calificación ---
+
+@receiver(post_init, sender=Reseña)
+def recordar_evaluado_original(sender, instance, **kwargs):
+    # Guardamos el evaluado con el que se cargó la reseña para detectar si una
+    # edición la mueve a otro usuario. Leemos __dict__ para no disparar una
+    # consulta si el campo viene diferido.
+    instance._evaluado_id_original = instance.__dict__.get('evaluado_id')
+
+@receiver(post_save, sender=Reseña)
+def actualizar_resumen_al_guardar(sender, instance, **kwargs):
+    ResumenCalificacion.recalcular(instance.evaluado_id)
+    original = getattr(instance, '_evaluado_id_original', None)
+    if original and original != instance.evaluado_id:
+        ResumenCalificacion.recalcular(original)
+        fragmentos.invalidar('usuario', original)
+    instance._evaluado_id_original = instance.evaluado_id
+
+@receiver(post_delete, sender=Reseña)
+def actualizar_resumen_al_borrar(sender, instance, **kwargs):
+    ResumenCalificacion.recalcular(instance.evaluado_id)
+
+# --- Historial de postulaciones ---
+
+@receiver(post_save, sender=Postulacion)
+def registrar_postulacion_recibida(sender, instance, created, **kwargs):
+    # Los cambios posteriores los registra Postulacion.cambiar_estado_en_lote
+    if created:
+        TransicionPostulacion.objects.create(
+            postulacion=instance, vacante_id=instance.vacante_id, actor_id=instance.profesional_id,
+            estado_nuevo=instance.estado, fecha=instance.fecha_estado,
+        )
+
+# --- Flujo de notificaciones por usuario (ver usuarios/notificaciones.py) ---
+
+@receiver(mensajes_registrados)
+def notificar_mensajes(sender, mensajes, **kwargs):
+    # Un evento por conversación y destinatario con el último mensaje del lote
+    # y cuántos llegaron; los participantes salen de la caché de membresías
+    membresias = obtener_cache_membresias()
+    pendientes = {}
+    for mensaje in mensajes:
+        for usuario_id in membresias.participantes(mensaje.conversacion_id):
+            if usuario_id != mensaje.autor_id:
+                nuevos = pendientes.get((usuario_id, mensaje.conversacion_id), (None, 0))[1]
+                pendientes[(usuario_id, mensaje.conversacion_id)] = (mensaje, nuevos + 1)
+    notificaciones.publicar([
+        (usuario_id, 'mensaje', {
+            'conversacion_id': conversacion_id, 'mensaje_id': mensaje.id, 'autor_id': mensaje.autor_id,
+            'preview': mensaje.contenido[:LONGITUD_PREVIEW], 'nuevos': nuevos,
+        })
+        for (usuario_id, conversacion_id), (mensaje, nuevos) in pendientes.items()
+    ])
+
+@receiver(post_save, sender=Postulacion)
+def notificar_postulacion_recibida(sender, instance, created, **kwargs):
+    if created:
+        notificaciones.publicar([(instance.vacante.empresa_id, 'postulacion', {
+            'postulacion_id': instance.pk, 'vacante_id': instance.vacante_id,
+            'profesional_id': instance.profesional_id, 'estado': instance.estado,
+        })])
+
+@receiver(estados_postulacion_cambiados)
+def notificar_estados_postulacion(sender, cambios, **kwargs):
+    notificaciones.publicar([
+        (cambio['profesional_id'], 'estado_postulacion', {
+            'postulacion_id': cambio['id'], 'vacante_id': cambio['vacante_id'],
+            'estado_anterior': cambio['estado_anterior'], 'estado': cambio['estado'],
+        })
+        for cambio in cambios
+    ])
+
+# --- Caché de membresías de conversaciones ---
+
+@receiver(m2m_changed, sender=Conversacion.participantes.through)
+def invalidar_membresias(sender, instance, action, reverse, pk_set, **kwargs):
+    cache = obtener_cache_membresias()
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            cache.invalidar(instance.pk)
+        return
+    # usuario.conversaciones.add/remove/clear(): hay que invalidar cada conversación
+    if action == 'pre_clear':
+        instance._conversaciones_a_invalidar = list(
+            ParticipanteConversacion.objects.filter(usuario=instance).values_list('conversacion_id', flat=True)
+        )
+    elif action == 'post_clear':
+        for conversacion_id in getattr(instance, '_conversaciones_a_invalidar', ()):
+            cache.invalidar(conversacion_id)
+    elif action in ('post_add', 'post_remove'):
+        for conversacion_id in pk_set:
+            cache.invalidar(conversacion_id)
+
+@receiver(post_save, sender=ParticipanteConversacion)
+def invalidar_membresia_creada(sender, instance, created, **kwargs):
+    # Guardar una membresía existente (p. ej. su marca de lectura) no la cambia
+    if created:
+        obtener_cache_membresias().invalidar(instance.conversacion_id)
+
+@receiver(post_delete, sender=ParticipanteConversacion)
+def invalidar_membresia_borrada(sender, instance, **kwargs):
+    obtener_cache_membresias().invalidar(instance.conversacion_id)
+
+@receiver(post_delete, sender=Conversacion)
+def invalidar_membresias_conversacion(sender, instance, **kwargs):
+    obtener_cache_membresias().invalidar(instance.pk)
+
+@receiver(pre_delete, sender=ServicioOfrecido)
+def desligar_conversaciones_servicio(sender, instance, **kwargs):
+    # servicio_relacionado queda en NULL (SET_NULL), pero clave_par conservaría su id
+    Conversacion.objects.desligar_servicio(instance.pk)
+
+# --- Índice de búsqueda ---
+
+@receiver(post_save, sender=ServicioOfrecido)
+@receiver(post_save, sender=VacanteEmpresa)
+def indexar_documento(sender, instance, **kwargs):
+    obtener_backend().indexar(instance)
+
+@receiver(post_delete, sender=ServicioOfrecido)
+@receiver(post_delete, sender=VacanteEmpresa)
+def desindexar_documento(sender, instance, **kwargs):
+    obtener_backend().eliminar(sender, instance.pk)
+
+# --- Caché de tokens ---
+
+@receiver(post_delete, sender=Token)
+def invalidar_token(sender, instance, **kwargs):
+    obtener_resolutor().invalidar(instance.key)
+
+@receiver(post_save, sender=Usuario)
+def invalidar_tokens_del_usuario(sender, instance, created, **kwargs):
+    # Cualquier cambio (desactivación, tipo de usuario, datos del perfil) deja
+    # obsoleta la copia cacheada del usuario
+    if not created:
+        obtener_resolutor().invalidar_usuario(instance.pk)
+
+# --- Variantes de imágenes de la galería ---
+
+@receiver(post_save, sender=ImagenServicio)
+def procesar_imagen_en_segundo_plano(sender, instance, created, **kwargs):
+    # Validación, limpieza de EXIF y variantes las hace el trabajador de tareas
+    if created and instance.imagen:
+        encolar('procesar_imagen_servicio', imagen_id=instance.pk)
+
+# --- Referencias a blobs del almacenamiento por contenido ---
+
+CAMPOS_CON_BLOB = {Usuario: 'cv', ImagenServicio: 'imagen'}
+_SIN_CARGAR = object()
+
+def _nombre_archivo(valor):
+    return getattr(valor, 'name', valor) or ''
+
+@receiver(post_init, sender=Usuario)
+@receiver(post_init, sender=ImagenServicio)
+def recordar_blob_original(sender, instance, **kwargs):
+    # Como con las reseñas, leemos __dict__ para no cargar un campo diferido;
+    # si lo está, no sabemos qué blob tenía y no tocamos sus referencias.
+    valor = instance.__dict__.get(CAMPOS_CON_BLOB[sender], _SIN_CARGAR)
+    instance._blob_original = valor if valor is _SIN_CARGAR else _nombre_archivo(valor)
+
+@receiver(pre_save, sender=Usuario)
+@receiver(pre_save, sender=ImagenServicio)
+def recordar_contenido_subido(sender, instance, **kwargs):
+    # Antes de que el campo lo guarde: después solo queda el nombre. Si un
+    # borrado concurrente recolecta el blob, sumar_referencia lo reescribe con esto.
+    campo = CAMPOS_CON_BLOB[sender]
+    # Un campo diferido no se ha subido: no hay que cargarlo
+    valor = getattr(instance, campo) if campo in instance.__dict__ else None
+    instance._contenido_subido = valor.file if valor and not valor._committed else None
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_save, sender=ImagenServicio)
+def actualizar_referencias_blob(sender, instance, created, update_fields=None, **kwargs):
+    campo = CAMPOS_CON_BLOB[sender]
+    if update_fields is not None and campo not in update_fields:
+        return
+    original = getattr(instance, '_blob_original', _SIN_CARGAR)
+    actual = _nombre_archivo(getattr(instance, campo))
+    if original is _SIN_CARGAR and not created:
+        return
+    original = '' if original is _SIN_CARGAR else original
+    if actual != original:
+        BlobAlmacenado.sumar_referencia(actual, getattr(instance, '_contenido_subido', None))
+        BlobAlmacenado.restar_referencia(original)
+    instance._blob_original = actual
+    instance._contenido_subido = None
+
+@receiver(post_delete, sender=Usuario)
+@receiver(post_delete, sender=ImagenServicio)
+def liberar_blob(sender, instance, **kwargs):
+    # El nombre guardado en la base de datos; nunca se consulta un campo diferido
+    # porque la fila ya no existe.
+    original = getattr(instance, '_blob_original', _SIN_CARGAR)
+    if original is _SIN_CARGAR:
+        original = instance.__dict__.get(CAMPOS_CON_BLOB[sender], _SIN_CARGAR)
+    if original is not _SIN_CARGAR:
+        BlobAlmacenado.restar_referencia(_nombre_archivo(original))
+
+# --- Caché de fragmentos serializados ---
+
+@receiver(post_save, sender=ServicioOfrecido)
+@receiver(post_delete, sender=ServicioOfrecido)
+def invalidar_fragmento_servicio(sender, instance, **kwargs):
+    fragmentos.invalidar('servicio', instance.pk)
+    # El total de servicios activos del perfil público del oferente
+    fragmentos.invalidar('perfil', instance.usuario_oferente_id)
+
+@receiver(post_save, sender=ImagenServicio)
+@receiver(post_delete, sender=ImagenServicio)
+def invalidar_fragmento_por_imagen(sender, instance, **kwargs):
+    fragmentos.invalidar('servicio', instance.servicio_id)
+
+@receiver(post_save, sender=VacanteEmpresa)
+@receiver(post_delete, sender=VacanteEmpresa)
+def invalidar_fragmento_vacante(sender, instance, **kwargs):
+    fragmentos.invalidar('vacante', instance.pk)
+    fragmentos.invalidar('perfil', instance.empresa_id)
+
+@receiver(post_save, sender=Reseña)
+@receiver(post_delete, sender=Reseña)
+def invalidar_fragmento_por_reseña(sender, instance, **kwargs):
+    # Reseñas y promedio del evaluado aparecen en sus servicios, vacantes y perfil
+    fragmentos.invalidar('usuario', instance.evaluado_id)
+
+@receiver(post_save, sender=Usuario)
+def invalidar_fragmento_usuario(sender, instance, created, **kwargs):
+    if not created:
+        fragmentos.invalidar('usuario', instance.pk)
@@ -0,0 +1,263 @@
+# usuarios/tareas.py
+"""
+Cola de trabajos en la base de datos, sin broker externo.
+
+    encolar('procesar_imagen_servicio', imagen_id=5)   # desde una vista o señal
+    python manage.py procesar_tareas                    # uno o varios trabajadores
+
+Cada tipo de tarea es una función registrada con @tarea('<tipo>') que recibe
+los argumentos guardados en Tarea.argumentos. Los trabajadores reclaman lotes
+con SELECT ... FOR UPDATE SKIP LOCKED (en motores que lo soportan), así que
+varios pueden correr a la vez sin ejecutar dos veces la misma tarea. Los
+errores se reintentan con espera exponencial hasta Tarea.max_intentos.
+
+Con settings.TAREAS['SINCRONO'] = True las tareas se ejecutan al confirmarse
+la transacción que las encola (útil en desarrollo sin trabajador).
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import fragmentos
+from .autenticacion import obtener_resolutor
+from .imagenes import generar_variantes
+from .models import ImagenServicio, Tarea, Usuario
+
+logger = logging.getLogger(__name__)
+
+_registro = {}
+
+
+def tarea(tipo):
+    """ Registra la función que ejecuta las tareas de un tipo. """
+    def decorador(funcion):
+        _registro[tipo] = funcion
+        return funcion
+    return decorador
+
+
+def ajuste(nombre, por_defecto):
+    return getattr(settings, 'TAREAS', {}).get(nombre, por_defecto)
+
+
+def encolar(tipo, **argumentos):
+    if tipo not in _registro:
+        raise ValueError(f"Tipo de tarea desconocido: {tipo}")
+    nueva = Tarea.objects.create(tipo=tipo, argumentos=argumentos)
+    if ajuste('SINCRONO', False):
+        transaction.on_commit(lambda: ejecutar_ahora(nueva.pk))
+    return nueva
+
+
+def ejecutar_ahora(tarea_id):
+    """ Reclama y ejecuta una tarea concreta, si ningún trabajador la tomó antes. """
+    reclamada = Tarea.objects.filter(pk=tarea_id, estado='pendiente').update(
+        estado='en_proceso', reclamada_por=nombre_trabajador(), reclamada_en=timezone.now(),
+        intentos=F('intentos') + 1,
+    )
+    if reclamada:
+        return ejecutar(Tarea.objects.get(pk=tarea_id))
+    return None
+
+
+def nombre_trabajador():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def espera_reintento(intentos):
+    """ Espera exponencial antes de volver a intentar una tarea. """
+    return timedelta(seconds=10 * 2 ** intentos)
+
+
+def liberar_abandonadas():
+    """
+    Libera las tareas de trabajadores que murieron a medias: vuelven a la cola
+    con la misma espera que un reintento o, si ya agotaron sus intentos (una
+    tarea que tumba a su trabajador lo haría siempre), quedan fallidas.
+    Devuelve cuántas se liberaron.
+    """
+    ahora = timezone.now()
+    limite = ahora - timedelta(seconds=ajuste('TIEMPO_MAXIMO_SEGUNDOS', 600))
+    liberadas = 0
+    for tarea_obj in Tarea.objects.filter(estado='en_proceso', reclamada_en__lt=limite).order_by('id'):
+        error = f"Abandonada por el trabajador {tarea_obj.reclamada_por} en el intento {tarea_obj.intentos}"
+        cambios = {'reclamada_por': '', 'reclamada_en': None, 'error': error, 'fecha_actualizacion': ahora}
+        if tarea_obj.intentos < tarea_obj.max_intentos:
+            cambios.update(estado='pendiente', disponible_en=ahora + espera_reintento(tarea_obj.intentos))
+        else:
+            cambios['estado'] = 'fallida'
+        # Condicionado al reclamo leído: otro trabajador puede estar liberándola a la vez
+        if not Tarea.objects.filter(
+            pk=tarea_obj.pk, estado='en_proceso', reclamada_en=tarea_obj.reclamada_en
+        ).update(**cambios):
+            continue
+        liberadas += 1
+        if cambios['estado'] == 'fallida':
+            logger.error("La tarea %s agotó sus intentos abandonada por su trabajador", tarea_obj)
+            fallo = getattr(_registro.get(tarea_obj.tipo), 'al_fallar', None)
+            if fallo is not None:
+                fallo(error, **tarea_obj.argumentos)
+    return liberadas
+
+
+def reclamar(lote=10, trabajador=None):
+    """ Marca como en proceso hasta `lote` tareas disponibles y las devuelve. """
+    ahora = timezone.now()
+    with transaction.atomic():
+        disponibles = Tarea.objects.filter(estado='pendiente', disponible_en__lte=ahora).order_by('disponible_en', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            disponibles = disponibles.select_for_update(skip_locked=True)
+        ids = list(disponibles.values_list('id', flat=True)[:lote])
+        if not ids:
+            return []
+        Tarea.objects.filter(id__in=ids, estado='pendiente').update(
+            estado='en_proceso', reclamada_por=trabajador or nombre_trabajador(), reclamada_en=ahora,
+            intentos=F('intentos') + 1,
+        )
+    return list(Tarea.objects.filter(id__in=ids, estado='en_proceso').order_by('disponible_en', 'id'))
+
+
+def ejecutar(tarea_obj):
+    """ Ejecuta una tarea reclamada y registra el resultado o el reintento. """
+    funcion = _registro.get(tarea_obj.tipo)
+    try:
+        if funcion is None:
+            raise LookupError(f"Tipo de tarea desconocido: {tarea_obj.tipo}")
+        funcion(**tarea_obj.argumentos)
+    except Exception as error:
+        logger.exception("Falló la tarea %s", tarea_obj)
+        tarea_obj.error = f"{type(error).__name__}: {error}"
+        if funcion is not None and tarea_obj.intentos < tarea_obj.max_intentos:
+            tarea_obj.estado = 'pendiente'
+            tarea_obj.disponible_en = timezone.now() + espera_reintento(tarea_obj.intentos)
+        else:
+            tarea_obj.estado = 'fallida'
+            fallo = getattr(funcion, 'al_fallar', None)
+            if fallo is not None:
+                fallo(tarea_obj.error, **tarea_obj.argumentos)
+    else:
+        tarea_obj.estado = 'completada'
+        tarea_obj.error = ''
+    tarea_obj.reclamada_por = ''
+    tarea_obj.reclamada_en = None
+    tarea_obj.save(update_fields=['estado', 'error', 'disponible_en', 'reclamada_por', 'reclamada_en', 'fecha_actualizacion'])
+    return tarea_obj.estado
+
+
+def procesar_pendientes(lote=10, trabajador=None):
+    """ Ejecuta tareas hasta vaciar la cola disponible. Devuelve cuántas se ejecutaron. """
+    total = 0
+    while True:
+        tareas = reclamar(lote, trabajador)
+        if not tareas:
+            return total
+        for tarea_obj in tareas:
+            ejecutar(tarea_obj)
+        total += len(tareas)
+
+
+# --- Tareas de archivos subidos ---
+
+ORIENTACION_EXIF = 0x0112
+
+def _sin_exif(imagen):
+    """
+    Sustituye el original por una copia sin metadatos EXIF (ubicación GPS,
+    cámara...), aplicando antes la orientación que indicaban. El contenido
+    cambia, así que la copia es otro blob: se guarda con save() para que las
+    señales muevan la referencia y el blob anterior se recolecte si queda huérfano.
+    """
+    with imagen.imagen.open('rb') as archivo:
+        original = Image.open(archivo)
+        original.load()
+    exif = original.getexif()
+    if not exif:
+        return
+    formato = original.format
+    # El perfil de color (p. ej. Display-P3 de los móviles) no es EXIF: se conserva
+    opciones = {'icc_profile': original.info['icc_profile']} if original.info.get('icc_profile') else {}
+    salida = BytesIO()
+    if formato == 'JPEG' and exif.get(ORIENTACION_EXIF, 1) == 1:
+        # Sin rotación se conservan las tablas de cuantización: no hay pérdida adicional
+        original.save(salida, 'JPEG', quality='keep', **opciones)
+    else:
+        if formato == 'JPEG':
+            opciones['quality'] = 90
+        ImageOps.exif_transpose(original).save(salida, formato, **opciones)
+    imagen.imagen.save(os.path.basename(imagen.imagen.name), ContentFile(salida.getvalue()), save=False)
+    imagen.save(update_fields=['imagen'])
+
+
+def _variantes_existentes(imagen):
+    """ Variantes ya generadas para el mismo blob por otra fila, si las hay. """
+    return ImagenServicio.objects.filter(imagen=imagen.imagen.name, estado='listo').exclude(
+        pk=imagen.pk
+    ).exclude(variantes={}).values_list('variantes', flat=True).first()
+
+
+@tarea('procesar_imagen_servicio')
+def procesar_imagen_servicio(imagen_id):
+    imagen = ImagenServicio.objects.filter(pk=imagen_id).first()
+    if imagen is None or not imagen.imagen:
+        return
+    try:
+        with imagen.imagen.open('rb') as archivo:
+            Image.open(archivo).verify()
+        _sin_exif(imagen)
+        # Con almacenamiento por contenido, la misma foto subida dos veces es el mismo blob
+        variantes = _variantes_existentes(imagen) or generar_variantes(imagen.imagen.name, imagen.imagen.storage)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        # El archivo no es una imagen válida: no tiene sentido reintentar
+        ImagenServicio.objects.filter(pk=imagen_id).update(estado='error', error=str(error)[:255])
+    else:
+        ImagenServicio.objects.filter(pk=imagen_id).update(variantes=variantes, estado='listo', error='')
+    # update() no dispara señales: el fragmento del servicio lleva el srcset
+    fragmentos.invalidar('servicio', imagen.servicio_id)
+
+
+def _imagen_fallida(error, imagen_id):
+    ImagenServicio.objects.filter(pk=imagen_id).update(estado='error', error=error[:255])
+    fragmentos.invalidar('servicio', ImagenServicio.objects.filter(pk=imagen_id).values_list('servicio_id', flat=True).first())
+
+
+procesar_imagen_servicio.al_fallar = _imagen_fallida
+
+
+def extraer_texto_pdf(archivo):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        # Dependencia opcional: sin pypdf el CV se guarda igual, solo sin texto
+        logger.warning("pypdf no está instalado; no se extrae el texto de los CV.")
+        return ''
+    return '\n'.join(pagina.extract_text() or '' for pagina in PdfReader(archivo).pages)
+
+
+@tarea('extraer_texto_cv')
+def extraer_texto_cv(usuario_id, nombre):
+    usuario = Usuario.objects.filter(pk=usuario_id).only('cv').first()
+    # Si el usuario ya subió otro CV, esta tarea quedó obsoleta
+    if usuario is None or usuario.cv.name != nombre:
+        return
+    with usuario.cv.open('rb') as archivo:
+        texto = extraer_texto_pdf(archivo)
+    Usuario.objects.filter(pk=usuario_id, cv=nombre).update(cv_texto=texto, cv_estado='listo')
+    # update() no dispara post_save: el usuario cacheado por su token debe recargarse
+    obtener_resolutor().invalidar_usuario(usuario_id)
+
+
+def _cv_fallido(error, usuario_id, nombre):
+    Usuario.objects.filter(pk=usuario_id, cv=nombre).update(cv_estado='error')
+    obtener_resolutor().invalidar_usuario(usuario_id)
+
+
+extraer_texto_cv.al_fallar = _cv_fallido
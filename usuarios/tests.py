@@ -1,3 +1,829 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageCms
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from . import autenticacion, busqueda, medios, membresias, tareas
+from .almacenamiento import almacenamiento_deduplicado
+from .mensajeria import registrar_mensaje
+from .models import Usuario, ServicioOfrecido, ImagenServicio, Reseña, Conversacion, VacanteEmpresa, Mensaje, Tarea, BlobAlmacenado, Postulacion
+
+
+def limpiar_caches():
+    """ Vacía todas las cachés: los fragmentos viven en la compartida, no en 'default'. """
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+class ServicioListaConsultasTests(APITestCase):
+    """ La lista de /servicios/ debe hacer las mismas consultas sin importar el tamaño de la página. """
+
+    def setUp(self):
+        limpiar_caches()
+        self.cliente_usuario = Usuario.objects.create_user(username='cliente', password='x')
+        self.client.force_authenticate(self.cliente_usuario)
+
+    def crear_servicios(self, cantidad):
+        for i in range(cantidad):
+            oferente = Usuario.objects.create_user(username=f'oferente{i}', tipo_usuario='oferente')
+            servicio = ServicioOfrecido.objects.create(
+                usuario_oferente=oferente, titulo_servicio=f'Servicio {i}', descripcion_servicio='...'
+            )
+            ImagenServicio.objects.create(servicio=servicio, imagen=f'servicios_galeria/{i}.jpg')
+            for j in range(7):
+                Reseña.objects.create(evaluador=self.cliente_usuario, evaluado=oferente, atencion=j % 5 + 1)
+            conversacion = Conversacion.objects.create(servicio_relacionado=servicio)
+            conversacion.participantes.add(self.cliente_usuario, oferente)
+
+    def contar_consultas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('api_servicios_lista'))
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas), respuesta.data['results']
+
+    def test_consultas_constantes_por_pagina(self):
+        self.crear_servicios(1)
+        consultas_una, resultados = self.contar_consultas()
+        self.assertEqual(len(resultados), 1)
+
+        ServicioOfrecido.objects.all().delete()
+        Usuario.objects.exclude(pk=self.cliente_usuario.pk).delete()
+        self.crear_servicios(9)
+        consultas_nueve, resultados = self.contar_consultas()
+        self.assertEqual(len(resultados), 9)
+
+        self.assertEqual(consultas_una, consultas_nueve)
+
+    def test_datos_precargados(self):
+        self.crear_servicios(2)
+        _, resultados = self.contar_consultas()
+        for servicio in resultados:
+            self.assertEqual(len(servicio['reseñas_oferente']), 5)
+            self.assertEqual(len(servicio['imagenes']), 1)
+            self.assertTrue(servicio['usuario_ha_contactado'])
+            self.assertEqual(servicio['promedio_calificacion_oferente'], 2.6)
+
+
+class VacanteListaConsultasTests(APITestCase):
+    """ Las vacantes de una página comparten las reseñas y promedios de su empresa. """
+
+    def setUp(self):
+        limpiar_caches()
+
+    def crear_vacantes(self, empresa, cantidad):
+        for i in range(cantidad):
+            VacanteEmpresa.objects.create(
+                empresa=empresa, titulo_vacante=f'Vacante {i}', descripcion_puesto='...',
+                requisitos='...', tipo_contrato='freelance', ubicacion='CDMX'
+            )
+
+    def contar_consultas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('api_vacantes_lista'))
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas), respuesta.data['results']
+
+    def test_consultas_constantes_por_pagina(self):
+        profesional = Usuario.objects.create_user(username='profesional')
+        empresas = [Usuario.objects.create_user(username=f'empresa{i}', tipo_usuario='empresa') for i in range(3)]
+        for empresa in empresas:
+            Reseña.objects.create(evaluador=profesional, evaluado=empresa, comunicacion=4)
+
+        self.crear_vacantes(empresas[0], 1)
+        consultas_una, _ = self.contar_consultas()
+
+        for empresa in empresas:
+            self.crear_vacantes(empresa, 3)
+        consultas_nueve, resultados = self.contar_consultas()
+
+        self.assertEqual(len(resultados), 9)
+        self.assertEqual(consultas_una, consultas_nueve)
+        self.assertTrue(all(vacante['promedio_calificacion_empresa'] == 4.0 for vacante in resultados))
+
+
+class BusquedaTestsMixin:
+    """ Las mismas pruebas se ejecutan contra cada backend del índice de búsqueda. """
+    backend = None
+
+    def setUp(self):
+        self.ajustes = override_settings(BUSQUEDA={'BACKEND': self.backend})
+        self.ajustes.enable()
+        busqueda.reiniciar_backend()
+        self.addCleanup(busqueda.reiniciar_backend)
+        self.addCleanup(self.ajustes.disable)
+
+        oferente = Usuario.objects.create_user(username='lucia', tipo_usuario='oferente')
+        self.web = ServicioOfrecido.objects.create(
+            usuario_oferente=oferente, titulo_servicio='Desarrollo de páginas web',
+            descripcion_servicio='Diseño y programación de tiendas en línea.'
+        )
+        self.logo = ServicioOfrecido.objects.create(
+            usuario_oferente=oferente, titulo_servicio='Diseño de logotipos',
+            descripcion_servicio='Identidad gráfica para empresas y desarrolladores.'
+        )
+
+    def buscar(self, consulta, prefijo=True):
+        return [pk for pk, _ in busqueda.obtener_backend().buscar(ServicioOfrecido, consulta, prefijo=prefijo)]
+
+    def test_sin_acentos_y_con_raices(self):
+        self.assertEqual(self.buscar('PAGINA', prefijo=False), [self.web.pk])
+        self.assertEqual(self.buscar('diseñadores', prefijo=False), [self.logo.pk, self.web.pk])
+
+    def test_ranking_por_campo(self):
+        # "desarrollo" está en el título de uno y solo en la descripción del otro
+        self.assertEqual(self.buscar('desarrollo', prefijo=False), [self.web.pk, self.logo.pk])
+
+    def test_prefijo_y_todos_los_terminos(self):
+        self.assertEqual(self.buscar('tiendas prog'), [self.web.pk])
+        self.assertEqual(self.buscar('logotipos prog'), [])
+
+    def test_prefijo_letra_a_letra(self):
+        # La palabra a medias no se lematiza: "programaci" sigue encontrando "program"
+        for palabra, servicio in (('programación', self.web), ('diseñador', self.logo), ('gráfica', self.logo)):
+            for fin in range(1, len(palabra) + 1):
+                with self.subTest(prefijo=palabra[:fin]):
+                    self.assertIn(servicio.pk, self.buscar(palabra[:fin]))
+        self.assertEqual(self.buscar('tiendas programaci'), [self.web.pk])
+
+    def test_limite_despues_de_los_filtros_de_la_vista(self):
+        for numero in range(3):
+            ServicioOfrecido.objects.create(
+                usuario_oferente=self.web.usuario_oferente, titulo_servicio=f'Desarrollo retirado {numero}',
+                descripcion_servicio='Desarrollo desarrollo desarrollo', activo=False,
+            )
+        with override_settings(BUSQUEDA={'BACKEND': self.backend, 'LIMITE_RESULTADOS': 1}):
+            respuesta = self.client.get(reverse('api_servicios_lista'), {'search': 'desarrollo'})
+        self.assertEqual([servicio['id'] for servicio in respuesta.data['results']], [self.web.pk])
+
+    def test_actualiza_al_guardar_y_borrar(self):
+        self.logo.titulo_servicio = 'Fotografía de producto'
+        self.logo.save()
+        self.assertEqual(self.buscar('fotografia'), [self.logo.pk])
+        self.logo.delete()
+        self.assertEqual(self.buscar('fotografia'), [])
+
+    def test_vista_ordena_por_relevancia(self):
+        respuesta = self.client.get(reverse('api_servicios_lista'), {'search': 'desarrollo'})
+        self.assertEqual([servicio['id'] for servicio in respuesta.data['results']], [self.web.pk, self.logo.pk])
+
+
+class BusquedaBaseDatosTests(BusquedaTestsMixin, TestCase):
+    backend = 'usuarios.busqueda.BackendBaseDatos'
+
+
+class BusquedaMemoriaTests(BusquedaTestsMixin, TestCase):
+    backend = 'usuarios.busqueda.BackendMemoria'
+
+
+class MensajeKeysetPaginationTests(APITestCase):
+    """ El historial de un chat se recorre por cursor, sin huecos ni repetidos. """
+
+    def setUp(self):
+        self.ana = Usuario.objects.create_user(username='ana')
+        self.beto = Usuario.objects.create_user(username='beto')
+        self.conversacion = Conversacion.objects.create()
+        self.conversacion.participantes.add(self.ana, self.beto)
+        self.mensajes = [
+            Mensaje.objects.create(conversacion=self.conversacion, autor=self.ana, contenido=str(i)).id
+            for i in range(25)
+        ]
+        self.client.force_authenticate(self.ana)
+        self.url = reverse('api_mensajes_lista_crea', args=[self.conversacion.id])
+
+    def test_cargar_anteriores_hasta_el_inicio(self):
+        vistos, url = [], f'{self.url}?limite=10'
+        while url:
+            respuesta = self.client.get(url)
+            vistos = [mensaje['id'] for mensaje in respuesta.data['results']] + vistos
+            url = respuesta.data['previous']
+        self.assertEqual(vistos, self.mensajes)
+
+    def test_nuevos_desde_un_id(self):
+        respuesta = self.client.get(self.url, {'despues_de': self.mensajes[19], 'limite': 3})
+        self.assertEqual([mensaje['id'] for mensaje in respuesta.data['results']], self.mensajes[20:23])
+        respuesta = self.client.get(respuesta.data['next'])
+        self.assertEqual([mensaje['id'] for mensaje in respuesta.data['results']], self.mensajes[23:])
+        self.assertIsNone(respuesta.data['next'])
+
+
+class FragmentosCacheadosTests(APITestCase):
+
+    def setUp(self):
+        limpiar_caches()
+        self.cliente = Usuario.objects.create_user(username='cliente')
+        self.oferente = Usuario.objects.create_user(username='oferente', tipo_usuario='oferente')
+        self.servicio = ServicioOfrecido.objects.create(
+            usuario_oferente=self.oferente, titulo_servicio='Plomería', descripcion_servicio='...'
+        )
+
+    def listar(self, usuario=None):
+        self.client.force_authenticate(usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(reverse('api_servicios_lista'))
+        return len(consultas), respuesta.data['results'][0]
+
+    def test_segunda_lectura_usa_el_fragmento(self):
+        consultas_fria, primero = self.listar(self.cliente)
+        consultas_caliente, segundo = self.listar(self.cliente)
+        self.assertEqual(primero, segundo)
+        # Solo COUNT, la página y el conjunto de servicios contactados
+        self.assertEqual(consultas_caliente, 3)
+        self.assertLess(consultas_caliente, consultas_fria)
+
+    def test_campos_por_usuario_fuera_del_fragmento(self):
+        conversacion = Conversacion.objects.create(servicio_relacionado=self.servicio)
+        conversacion.participantes.add(self.cliente, self.oferente)
+        self.assertTrue(self.listar(self.cliente)[1]['usuario_ha_contactado'])
+        otro = Usuario.objects.create_user(username='otro')
+        self.assertFalse(self.listar(otro)[1]['usuario_ha_contactado'])
+        self.assertFalse(self.listar()[1]['usuario_ha_contactado'])
+
+    def test_invalida_con_reseñas_imagenes_y_cambios(self):
+        self.listar()
+        Reseña.objects.create(evaluador=self.cliente, evaluado=self.oferente, atencion=4)
+        self.assertEqual(self.listar()[1]['promedio_calificacion_oferente'], 4.0)
+
+        ImagenServicio.objects.create(servicio=self.servicio, imagen='servicios_galeria/x.jpg')
+        self.assertEqual(len(self.listar()[1]['imagenes']), 1)
+
+        self.servicio.titulo_servicio = 'Electricidad'
+        self.servicio.save()
+        self.assertEqual(self.client.get(reverse('api_servicio_detalle', args=[self.servicio.pk])).data['titulo_servicio'], 'Electricidad')
+        self.assertEqual(self.listar()[1]['titulo_servicio'], 'Electricidad')
+
+        url = reverse('api_perfil_publico', args=['oferente'])
+        perfil = self.client.get(url, {'expand': 'servicios,reseñas'}).data
+        self.assertEqual(perfil['servicios_ofrecidos']['results'][0]['titulo_servicio'], 'Electricidad')
+        Reseña.objects.create(evaluador=self.cliente, evaluado=self.oferente, atencion=2)
+        perfil = self.client.get(url, {'expand': 'reseñas'}).data
+        self.assertEqual(perfil['total_reseñas'], 2)
+        self.assertEqual(len(perfil['reseñas_recibidas']['results']), 2)
+
+
+class PerfilPublicoTests(APITestCase):
+    """ Resumen compacto del perfil y sus subrecursos paginados. """
+
+    def setUp(self):
+        limpiar_caches()
+        self.empresa = Usuario.objects.create_user(username='acme', tipo_usuario='empresa')
+        self.cliente = Usuario.objects.create_user(username='cliente')
+        for numero in range(12):
+            VacanteEmpresa.objects.create(
+                empresa=self.empresa, titulo_vacante=f'Vacante {numero}', descripcion_puesto='...', requisitos='...'
+            )
+        Reseña.objects.create(evaluador=self.cliente, evaluado=self.empresa, puntualidad_pago=5)
+        self.url = reverse('api_perfil_publico', args=['acme'])
+
+    def test_resumen_sin_listas_incrustadas(self):
+        datos = self.client.get(self.url).data
+        self.assertEqual((datos['total_vacantes'], datos['total_servicios'], datos['total_reseñas']), (12, 0, 1))
+        self.assertEqual(datos['promedio_calificacion'], 5.0)
+        self.assertNotIn('vacantes_publicadas', datos)
+        self.assertTrue(datos['enlaces']['vacantes'].endswith(reverse('api_perfil_vacantes', args=['acme'])))
+        # El resumen se sirve desde la caché de fragmentos: solo se busca al usuario
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(self.url)
+        self.assertEqual(len(consultas), 1)
+
+    def test_subrecursos_paginados_y_expand(self):
+        pagina = self.client.get(reverse('api_perfil_vacantes', args=['acme'])).data
+        self.assertEqual((pagina['count'], len(pagina['results'])), (12, 9))
+        self.assertEqual(pagina['results'][0]['titulo_vacante'], 'Vacante 11')
+
+        datos = self.client.get(self.url, {'expand': 'vacantes'}).data
+        self.assertEqual([v['id'] for v in datos['vacantes_publicadas']['results']], [v['id'] for v in pagina['results']])
+        self.assertIn('page=2', datos['vacantes_publicadas']['next'])
+        self.assertNotIn('servicios_ofrecidos', datos)
+
+        reseñas = self.client.get(reverse('api_perfil_reseñas', args=['acme'])).data
+        self.assertEqual(reseñas['results'][0]['evaluador_username'], 'cliente')
+        self.assertEqual(self.client.get(self.url, {'expand': 'todo'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_perfil_servicios', args=['nadie'])).status_code, 404)
+
+    def test_totales_se_invalidan_al_publicar_o_desactivar(self):
+        self.client.get(self.url)
+        vacante = VacanteEmpresa.objects.filter(empresa=self.empresa).first()
+        vacante.activa = False
+        vacante.save()
+        self.assertEqual(self.client.get(self.url).data['total_vacantes'], 11)
+        ServicioOfrecido.objects.create(usuario_oferente=self.empresa, titulo_servicio='Asesoría', descripcion_servicio='...')
+        self.assertEqual(self.client.get(self.url).data['total_servicios'], 1)
+
+
+
+class PostulantesVacanteTests(APITestCase):
+    """ Postulantes paginados de una vacante, solo para su empresa. """
+
+    def setUp(self):
+        self.empresa = Usuario.objects.create_user(username='acme', tipo_usuario='empresa')
+        self.vacante = VacanteEmpresa.objects.create(
+            empresa=self.empresa, titulo_vacante='Backend', descripcion_puesto='...', requisitos='...'
+        )
+        self.postulaciones = [
+            Postulacion.objects.create(
+                vacante=self.vacante, profesional=Usuario.objects.create_user(username=f'pro{numero}', tipo_usuario='profesionista'),
+                estado='en_revision' if numero % 3 == 0 else 'recibida',
+            )
+            for numero in range(12)
+        ]
+        self.url = reverse('api_vacante_postulantes', args=[self.vacante.pk])
+        self.client.force_authenticate(self.empresa)
+
+    def test_pagina_filtrada_con_conteos(self):
+        with CaptureQueriesContext(connection) as consultas:
+            datos = self.client.get(self.url).data
+        # Vacante, COUNT, la página con el profesional unido y la agregación por estado
+        self.assertEqual(len(consultas), 4)
+        self.assertEqual((datos['count'], len(datos['results'])), (12, 9))
+        self.assertEqual(datos['results'][0]['id'], self.postulaciones[-1].id)
+        self.assertEqual(datos['conteos'], {'total': 12, 'recibida': 8, 'en_revision': 4, 'contactado': 0, 'rechazado': 0})
+
+        datos = self.client.get(self.url, {'estado': 'en_revision', 'orden': 'fecha_postulacion'}).data
+        self.assertEqual([p['id'] for p in datos['results']], [p.id for p in self.postulaciones[::3]])
+        self.assertEqual(self.client.get(self.url, {'estado': 'otro'}).status_code, 400)
+
+    def test_solo_la_empresa_y_sin_postulantes_en_el_detalle(self):
+        self.client.force_authenticate(self.postulaciones[0].profesional)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(None)
+        detalle = self.client.get(reverse('api_vacante_detalle', args=[self.vacante.pk])).data
+        self.assertNotIn('postulantes', detalle)
+
+    def test_cambio_de_estado_en_lote(self):
+        ajena = Postulacion.objects.create(
+            vacante=VacanteEmpresa.objects.create(
+                empresa=Usuario.objects.create_user(username='otra', tipo_usuario='empresa'),
+                titulo_vacante='Otra', descripcion_puesto='...', requisitos='...',
+            ),
+            profesional=self.postulaciones[1].profesional,
+        )
+        self.postulaciones[2].estado = 'contactado'
+        self.postulaciones[2].save()
+        ids = [self.postulaciones[0].id, self.postulaciones[1].id, self.postulaciones[2].id, ajena.id, 999999]
+        with CaptureQueriesContext(connection) as consultas:
+            datos = self.client.post(reverse('api_postulaciones_estado_lote'), {'ids': ids, 'estado': 'en_revision'}, format='json').data
+        # Lectura de dueños y estados, un UPDATE condicional por estado de origen
+        # y las inserciones del historial y de las notificaciones, dentro de un savepoint
+        self.assertEqual(len(consultas), 6)
+        self.assertEqual([r['resultado'] for r in datos['resultados']], [
+            'sin_cambio', 'actualizada', 'transicion_invalida', 'sin_permiso', 'no_existe',
+        ])
+        self.assertEqual(datos['actualizadas'], 1)
+        self.postulaciones[1].refresh_from_db()
+        ajena.refresh_from_db()
+        self.assertEqual((self.postulaciones[1].estado, ajena.estado), ('en_revision', 'recibida'))
+
+        respuesta = self.client.post(reverse('api_postulaciones_estado_lote'), {'ids': ids, 'estado': 'x'}, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_maquina_de_estados_e_historial(self):
+        postulacion = self.postulaciones[1]
+        url = reverse('api_postulacion_update_status', args=[postulacion.pk])
+        self.assertEqual(self.client.patch(url, {'estado': 'contactado'}).data['estado'], 'contactado')
+        self.assertEqual(self.client.patch(url, {'estado': 'rechazado'}).status_code, 200)
+        respuesta = self.client.patch(url, {'estado': 'contactado'})
+        self.assertEqual((respuesta.status_code, respuesta.data['estado']), (409, 'rechazado'))
+        self.assertEqual(self.client.patch(url, {'estado': 'cualquiera'}).status_code, 400)
+
+        # marcar-revision solo mueve las que siguen en 'recibida'
+        revision = reverse('api_postulacion_marcar_revision', args=[postulacion.pk])
+        self.assertEqual(self.client.post(revision).data['estado'], 'rechazado')
+
+        self.assertEqual(
+            list(postulacion.transiciones.order_by('id').values_list('estado_anterior', 'estado_nuevo')),
+            [('', 'recibida'), ('recibida', 'contactado'), ('contactado', 'rechazado')],
+        )
+        with self.assertRaises(ValueError):
+            postulacion.transiciones.first().save()
+
+        embudo = self.client.get(reverse('api_vacante_embudo', args=[self.vacante.pk])).data
+        # setUp crea 4 postulaciones directamente en 'en_revision'
+        self.assertEqual(embudo['recibida'], {'actuales': 7, 'entradas': 8, 'salidas': 1, 'segundos_promedio': 0})
+        self.assertEqual(embudo['en_revision']['entradas'], 4)
+        self.assertEqual(embudo['contactado']['entradas'], 1)
+        self.assertEqual(embudo['rechazado']['actuales'], 1)
+        self.client.force_authenticate(postulacion.profesional)
+        self.assertEqual(self.client.get(reverse('api_vacante_embudo', args=[self.vacante.pk])).status_code, 403)
+
+class IniciarConversacionTests(APITestCase):
+    """ La clave canónica del par evita conversaciones duplicadas. """
+
+    def setUp(self):
+        membresias.reiniciar_cache_membresias()
+
+    def test_mensajes_solo_para_participantes(self):
+        ana = Usuario.objects.create_user(username='ana')
+        beto = Usuario.objects.create_user(username='beto')
+        intruso = Usuario.objects.create_user(username='intruso')
+        self.client.force_authenticate(ana)
+        conversacion_id = self.client.post(reverse('api_iniciar_conversacion'), {'usuario_id': beto.id}).data['conversacion_id']
+        url = reverse('api_mensajes_lista_crea', args=[conversacion_id])
+        self.assertEqual(self.client.post(url, {'contenido': 'hola'}).status_code, 201)
+
+        self.client.force_authenticate(intruso)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.post(url, {'contenido': 'spam'}).status_code, 404)
+        self.client.force_authenticate(beto)
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+
+    def test_misma_conversacion_en_ambos_sentidos(self):
+        ana = Usuario.objects.create_user(username='ana')
+        beto = Usuario.objects.create_user(username='beto')
+        servicio = ServicioOfrecido.objects.create(usuario_oferente=beto, titulo_servicio='Clases', descripcion_servicio='...')
+        url = reverse('api_iniciar_conversacion')
+
+        self.client.force_authenticate(ana)
+        general = self.client.post(url, {'usuario_id': beto.id}).data['conversacion_id']
+        del_servicio = self.client.post(url, {'usuario_id': beto.id, 'servicio_id': servicio.id}).data['conversacion_id']
+        self.client.force_authenticate(beto)
+        self.assertEqual(self.client.post(url, {'usuario_id': ana.id}).data['conversacion_id'], general)
+
+        self.assertNotEqual(general, del_servicio)
+        self.assertEqual(Conversacion.objects.entre(ana.id, beto.id).count(), 2)
+
+    def test_borrar_el_servicio_reutiliza_su_conversacion(self):
+        ana = Usuario.objects.create_user(username='ana')
+        beto = Usuario.objects.create_user(username='beto')
+        servicio = ServicioOfrecido.objects.create(usuario_oferente=beto, titulo_servicio='Clases', descripcion_servicio='...')
+        url = reverse('api_iniciar_conversacion')
+        self.client.force_authenticate(ana)
+        del_servicio = self.client.post(url, {'usuario_id': beto.id, 'servicio_id': servicio.id}).data['conversacion_id']
+
+        servicio.delete()
+        self.assertEqual(self.client.post(url, {'usuario_id': beto.id}).data['conversacion_id'], del_servicio)
+        self.assertEqual(Conversacion.objects.entre(ana.id, beto.id).count(), 1)
+
+    def test_borrar_el_servicio_fusiona_con_la_conversacion_general(self):
+        ana = Usuario.objects.create_user(username='ana')
+        beto = Usuario.objects.create_user(username='beto')
+        servicio = ServicioOfrecido.objects.create(usuario_oferente=beto, titulo_servicio='Clases', descripcion_servicio='...')
+        url = reverse('api_iniciar_conversacion')
+        self.client.force_authenticate(ana)
+        general = self.client.post(url, {'usuario_id': beto.id}).data['conversacion_id']
+        del_servicio = self.client.post(url, {'usuario_id': beto.id, 'servicio_id': servicio.id}).data['conversacion_id']
+        registrar_mensaje(general, ana, 'hola')
+        registrar_mensaje(del_servicio, beto, 'sobre las clases')
+        registrar_mensaje(del_servicio, beto, '¿mañana?')
+
+        servicio.delete()
+        conversacion = Conversacion.objects.get()
+        self.assertEqual(conversacion.pk, general)
+        self.assertEqual(conversacion.mensajes.count(), 3)
+        self.assertEqual(conversacion.ultimo_mensaje_preview, '¿mañana?')
+        self.assertEqual(conversacion.fecha_modificacion, conversacion.ultimo_mensaje_fecha)
+        no_leidos = dict(conversacion.membresias.values_list('usuario_id', 'no_leidos'))
+        self.assertEqual(no_leidos, {ana.id: 2, beto.id: 1})
+        self.assertEqual(self.client.post(url, {'usuario_id': beto.id}).data['conversacion_id'], general)
+
+
+class AutenticacionCacheadaTests(APITestCase):
+
+    def setUp(self):
+        autenticacion.reiniciar_resolutor()
+        self.usuario = Usuario.objects.create_user(username='ana', password='x')
+        self.token = Token.objects.create(user=self.usuario)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def tearDown(self):
+        autenticacion.reiniciar_resolutor()
+
+    def test_segunda_peticion_no_consulta_el_token(self):
+        self.assertEqual(self.client.get(reverse('api_perfil_usuario')).status_code, 200)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self.client.get(reverse('api_perfil_usuario')).status_code, 200)
+        self.assertFalse(any('authtoken_token' in c['sql'] for c in consultas.captured_queries))
+        metricas = autenticacion.obtener_resolutor().metricas()
+        self.assertEqual((metricas['aciertos'], metricas['fallos']), (1, 1))
+
+    def test_invalida_al_borrar_token_y_desactivar_usuario(self):
+        self.client.get(reverse('api_perfil_usuario'))
+        self.usuario.is_active = False
+        self.usuario.save()
+        self.assertEqual(self.client.get(reverse('api_perfil_usuario')).status_code, 401)
+
+        self.usuario.is_active = True
+        self.usuario.save()
+        self.assertEqual(self.client.get(reverse('api_perfil_usuario')).status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get(reverse('api_perfil_usuario')).status_code, 401)
+
+    def test_lru_acotada(self):
+        resolutor = autenticacion.ResolutorTokens(maximo_entradas=2)
+        for i in range(3):
+            usuario = Usuario.objects.create_user(username=f'lru{i}')
+            resolutor.resolver(Token.objects.create(user=usuario).key)
+        self.assertEqual(resolutor.metricas()['entradas'], 2)
+
+
+class MediaTemporalMixin:
+    """ MEDIA_ROOT en un directorio temporal y un oferente autenticado. """
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.ajustes = override_settings(MEDIA_ROOT=self.media)
+        self.ajustes.enable()
+        self.oferente = Usuario.objects.create_user(username='oferente', tipo_usuario='oferente')
+        self.client.force_authenticate(self.oferente)
+
+    def tearDown(self):
+        self.ajustes.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def imagen_subida(self, ancho, alto):
+        contenido = BytesIO()
+        Image.new('RGB', (ancho, alto), (200, 30, 30)).save(contenido, 'JPEG')
+        return SimpleUploadedFile('foto.jpg', contenido.getvalue(), content_type='image/jpeg')
+
+    def archivos(self):
+        return sorted(
+            os.path.relpath(os.path.join(carpeta, archivo), self.media)
+            for carpeta, _, archivos in os.walk(self.media) for archivo in archivos
+        )
+
+
+class VariantesImagenTests(MediaTemporalMixin, APITestCase):
+
+    def test_subida_genera_variantes_y_srcset(self):
+        respuesta = self.client.post(reverse('api_servicios_lista'), {
+            'titulo_servicio': 'Fotos', 'descripcion_servicio': '...', 'imagenes': [self.imagen_subida(2000, 1000)],
+        }, format='multipart')
+        self.assertEqual(respuesta.status_code, 201)
+        # La petición solo guarda el archivo; el trabajador genera las variantes
+        estado = self.client.get(reverse('api_imagenes_estado', args=[respuesta.data['id']]))
+        self.assertEqual(estado.data[0]['estado'], 'pendiente')
+        self.assertEqual(tareas.procesar_pendientes(), 1)
+        estado = self.client.get(reverse('api_imagenes_estado', args=[respuesta.data['id']]))
+        self.assertEqual(estado.data[0]['estado'], 'listo')
+
+        imagen = ImagenServicio.objects.get(servicio_id=respuesta.data['id'])
+        self.assertEqual((imagen.variantes['miniatura']['ancho'], imagen.variantes['miniatura']['alto']), (320, 160))
+        self.assertEqual(imagen.variantes['mediana']['ancho'], 1024)
+
+        detalle = self.client.get(reverse('api_servicio_detalle', args=[respuesta.data['id']]))
+        srcset = detalle.data['imagenes'][0]['srcset']
+        self.assertRegex(srcset['webp'], r'__miniatura\.webp 320w, .*__mediana\.webp 1024w$')
+        self.assertIn('__miniatura.jpg 320w', srcset['jpg'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            imagen.delete()
+        self.assertFalse(ImagenServicio.objects.exists())
+        self.assertEqual(self.archivos(), [])
+
+    def imagen_con_exif(self, orientacion, perfil):
+        # Mitad izquierda roja y derecha azul, para ver hacia dónde gira
+        foto = Image.new('RGB', (40, 20), (255, 0, 0))
+        foto.paste((0, 0, 255), (20, 0, 40, 20))
+        exif = Image.Exif()
+        exif[0x0112] = orientacion
+        exif[0x010F] = 'Camara'
+        contenido = BytesIO()
+        foto.save(contenido, 'JPEG', quality=75, exif=exif, icc_profile=perfil)
+        return contenido.getvalue()
+
+    def procesar_con_exif(self, orientacion):
+        perfil = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        datos = self.imagen_con_exif(orientacion, perfil)
+        servicio = ServicioOfrecido.objects.create(usuario_oferente=self.oferente, titulo_servicio='x', descripcion_servicio='y')
+        imagen = ImagenServicio.objects.create(servicio=servicio, imagen=SimpleUploadedFile('foto.jpg', datos))
+        tareas.procesar_pendientes()
+        imagen.refresh_from_db()
+        self.assertEqual(imagen.estado, 'listo')
+        with imagen.imagen.open('rb') as archivo:
+            resultado = Image.open(archivo)
+            resultado.load()
+        self.assertFalse(resultado.getexif())
+        self.assertEqual(resultado.info.get('icc_profile'), perfil)
+        return Image.open(BytesIO(datos)), resultado
+
+    def test_exif_sin_rotacion_no_recomprime(self):
+        original, resultado = self.procesar_con_exif(1)
+        self.assertEqual(resultado.quantization, original.quantization)
+        self.assertEqual(resultado.size, (40, 20))
+
+    def test_exif_con_rotacion_gira_los_pixeles(self):
+        _, resultado = self.procesar_con_exif(6)
+        # 6 = girar 90° a la derecha: la mitad roja (izquierda) pasa arriba
+        self.assertEqual(resultado.size, (20, 40))
+        rojo, _, azul = resultado.convert('RGB').getpixel((10, 5))
+        self.assertGreater(rojo, 200)
+        self.assertLess(azul, 50)
+
+    def test_archivo_invalido_queda_en_error(self):
+        servicio = ServicioOfrecido.objects.create(usuario_oferente=self.oferente, titulo_servicio='x', descripcion_servicio='y')
+        imagen = ImagenServicio.objects.create(
+            servicio=servicio, imagen=SimpleUploadedFile('falsa.jpg', b'no es una imagen')
+        )
+        tareas.procesar_pendientes()
+        imagen.refresh_from_db()
+        self.assertEqual((imagen.estado, imagen.variantes), ('error', {}))
+
+
+class AlmacenamientoDeduplicadoTests(MediaTemporalMixin, APITestCase):
+
+    def test_misma_imagen_se_guarda_una_vez(self):
+        servicios = [
+            ServicioOfrecido.objects.create(usuario_oferente=self.oferente, titulo_servicio=f's{i}', descripcion_servicio='...')
+            for i in range(2)
+        ]
+        imagenes = [ImagenServicio.objects.create(servicio=s, imagen=self.imagen_subida(50, 50)) for s in servicios]
+        tareas.procesar_pendientes()
+        self.assertEqual(imagenes[0].imagen.name, imagenes[1].imagen.name)
+        self.assertEqual(BlobAlmacenado.objects.get().referencias, 2)
+        # Un original y sus cuatro variantes, compartidos por las dos filas
+        self.assertEqual(len(self.archivos()), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.delete(reverse('api_imagen_servicio_delete', args=[imagenes[0].pk]))
+        self.assertEqual(respuesta.status_code, 204)
+        self.assertEqual(BlobAlmacenado.objects.get().referencias, 1)
+        self.assertEqual(len(self.archivos()), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            imagenes[1].delete()
+        self.assertFalse(BlobAlmacenado.objects.exists())
+        self.assertEqual(self.archivos(), [])
+
+    def test_reemplazar_cv_recolecta_el_anterior(self):
+        for contenido in (b'%PDF-1.4 uno', b'%PDF-1.4 uno', b'%PDF-1.4 dos'):
+            with self.captureOnCommitCallbacks(execute=True):
+                respuesta = self.client.put(reverse('api_subir_cv'), {
+                    'cv': SimpleUploadedFile('cv.pdf', contenido, content_type='application/pdf'),
+                }, format='multipart')
+            self.assertEqual(respuesta.status_code, 200)
+        self.oferente.refresh_from_db()
+        self.assertEqual(BlobAlmacenado.objects.get().nombre, self.oferente.cv.name)
+        self.assertEqual(self.archivos(), [self.oferente.cv.name])
+
+
+    def test_subida_reescribe_el_blob_recolectado_entre_medias(self):
+        primero = Usuario.objects.create_user(username='primero')
+        with self.captureOnCommitCallbacks(execute=True):
+            primero.cv = SimpleUploadedFile('cv.pdf', b'%PDF-1.4 mismo')
+            primero.save()
+        nombre = primero.cv.name
+        guardar = almacenamiento_deduplicado._save
+
+        def guardar_y_recolectar(*args):
+            # La subida de otro usuario encuentra el blob y lo da por existente,
+            # pero antes de sumar su referencia el borrado del primero lo recolecta
+            resultado = guardar(*args)
+            with self.captureOnCommitCallbacks(execute=True):
+                primero.delete()
+            self.assertEqual(self.archivos(), [])
+            return resultado
+
+        self.oferente.cv = SimpleUploadedFile('cv.pdf', b'%PDF-1.4 mismo')
+        with mock.patch.object(almacenamiento_deduplicado, '_save', guardar_y_recolectar):
+            self.oferente.save()
+        fila = BlobAlmacenado.objects.get()
+        self.assertEqual((fila.nombre, fila.referencias), (nombre, 1))
+        self.assertEqual(self.archivos(), [nombre])
+        with almacenamiento_deduplicado.open(nombre) as archivo:
+            self.assertEqual(archivo.read(), b'%PDF-1.4 mismo')
+
+    def test_recolectar_respeta_referencias_vivas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.oferente.cv = SimpleUploadedFile('cv.pdf', b'%PDF-1.4 vivo')
+            self.oferente.save()
+        self.assertFalse(BlobAlmacenado.recolectar(self.oferente.cv.name))
+        self.assertEqual(self.archivos(), [self.oferente.cv.name])
+
+
+class ServirMediosTests(MediaTemporalMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.put(reverse('api_subir_cv'), {
+            'cv': SimpleUploadedFile('cv.pdf', b'%PDF-1.4 ' + b'x' * 1000, content_type='application/pdf'),
+        }, format='multipart')
+        self.oferente.refresh_from_db()
+        self.url = self.oferente.cv.url
+        self.client.force_authenticate(None)
+
+    def contenido(self, respuesta):
+        return b''.join(respuesta.streaming_content)
+
+    def test_cv_requiere_firma_o_permiso(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        firmada = self.client.get(f"{self.url}?firma={medios.firmar(self.oferente.cv.name)}")
+        self.assertEqual(firmada.status_code, 200)
+        self.assertEqual(firmada['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get(f"{self.url}?firma=0:falsa").status_code, 403)
+
+        # Una empresa ve el CV de quien se postuló a su vacante; otra no
+        empresa = Usuario.objects.create_user(username='empresa', tipo_usuario='empresa')
+        otra = Usuario.objects.create_user(username='otra', tipo_usuario='empresa')
+        vacante = VacanteEmpresa.objects.create(
+            empresa=empresa, titulo_vacante='v', descripcion_puesto='d', requisitos='r',
+            tipo_contrato='freelance', ubicacion='CDMX',
+        )
+        Postulacion.objects.create(profesional=self.oferente, vacante=vacante)
+        for usuario, esperado in ((empresa, 200), (otra, 403)):
+            token = Token.objects.create(user=usuario)
+            respuesta = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {token.key}')
+            self.assertEqual(respuesta.status_code, esperado)
+
+    def test_etag_condicional_y_rangos(self):
+        url = f"{self.url}?firma={medios.firmar(self.oferente.cv.name)}"
+        completa = self.client.get(url)
+        etag = completa['ETag']
+        self.assertIn(etag.strip('"'), self.oferente.cv.name)
+        self.assertEqual(len(self.contenido(completa)), 1009)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=completa['Last-Modified']).status_code, 304)
+
+        parcial = self.client.get(url, HTTP_RANGE='bytes=0-7')
+        self.assertEqual(parcial.status_code, 206)
+        self.assertEqual(parcial['Content-Range'], 'bytes 0-7/1009')
+        self.assertEqual(self.contenido(parcial), b'%PDF-1.4')
+        self.assertEqual(self.contenido(self.client.get(url, HTTP_RANGE='bytes=-3')), b'xxx')
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=5000-').status_code, 416)
+        # If-Range con un ETag viejo: se envía el archivo completo
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-7', HTTP_IF_RANGE='"otro"').status_code, 200)
+
+    @override_settings(MEDIA_SERVIR={'MODO': 'x-accel', 'PREFIJO_INTERNO': '/interno/'})
+    def test_delegar_al_proxy(self):
+        respuesta = self.client.get(f"{self.url}?firma={medios.firmar(self.oferente.cv.name)}")
+        self.assertEqual(respuesta['X-Accel-Redirect'], f"/interno/{self.oferente.cv.name}")
+        self.assertEqual(respuesta.content, b'')
+
+
+class ColaTareasTests(TestCase):
+
+    def setUp(self):
+        self.llamadas = []
+
+        @tareas.tarea('prueba_fallo')
+        def fallar(veces):
+            self.llamadas.append(veces)
+            if len(self.llamadas) <= veces:
+                raise RuntimeError('fallo temporal')
+
+    def tearDown(self):
+        tareas._registro.pop('prueba_fallo', None)
+
+    def test_reintenta_con_espera_y_luego_completa(self):
+        tarea = tareas.encolar('prueba_fallo', veces=1)
+        with self.assertLogs('usuarios.tareas', 'ERROR'):
+            self.assertEqual(tareas.procesar_pendientes(), 1)
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), ('pendiente', 1))
+        # Todavía no está disponible: la espera exponencial la aparta de la cola
+        self.assertEqual(tareas.procesar_pendientes(), 0)
+
+        Tarea.objects.filter(pk=tarea.pk).update(disponible_en=tarea.fecha_creacion)
+        self.assertEqual(tareas.procesar_pendientes(), 1)
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos, tarea.error), ('completada', 2, ''))
+
+    def test_agota_intentos(self):
+        tarea = tareas.encolar('prueba_fallo', veces=10)
+        for _ in range(tarea.max_intentos):
+            Tarea.objects.filter(pk=tarea.pk).update(disponible_en=tarea.fecha_creacion)
+            with self.assertLogs('usuarios.tareas', 'ERROR'):
+                tareas.procesar_pendientes()
+        tarea.refresh_from_db()
+        self.assertEqual(tarea.estado, 'fallida')
+        self.assertIn('fallo temporal', tarea.error)
+
+    def test_abandonadas_se_reintentan_con_espera_hasta_agotar_intentos(self):
+        fallos = []
+        tareas._registro['prueba_fallo'].al_fallar = lambda error, veces: fallos.append(error)
+        tarea = tareas.encolar('prueba_fallo', veces=0)
+        # Una tarea que tumba a su trabajador: se reclama y nunca termina
+        for intento in range(1, tarea.max_intentos + 1):
+            Tarea.objects.filter(pk=tarea.pk).update(disponible_en=tarea.fecha_creacion)
+            self.assertEqual(len(tareas.reclamar(trabajador='muerto:1')), 1)
+            Tarea.objects.filter(pk=tarea.pk).update(reclamada_en=timezone.now() - timedelta(hours=1))
+            if intento == tarea.max_intentos:
+                with self.assertLogs('usuarios.tareas', 'ERROR'):
+                    self.assertEqual(tareas.liberar_abandonadas(), 1)
+            else:
+                self.assertEqual(tareas.liberar_abandonadas(), 1)
+                tarea.refresh_from_db()
+                self.assertEqual((tarea.estado, tarea.reclamada_por), ('pendiente', ''))
+                self.assertGreater(tarea.disponible_en, timezone.now())
+                # Con la espera del reintento, todavía no vuelve a la cola
+                self.assertEqual(tareas.reclamar(), [])
+
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.intentos), ('fallida', tarea.max_intentos))
+        self.assertIn('muerto:1', tarea.error)
+        self.assertEqual(len(fallos), 1)
+        self.assertEqual(self.llamadas, [])
+        self.assertEqual(tareas.liberar_abandonadas(), 0)
@@ -2,6 +2,7 @@
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path
+from .notificaciones import FlujoNotificacionesView
 from .views import (
     RegistroAPIView,LoginAPIView,
     PerfilUsuarioAPIView,ServicioListCreateAPIView,
@@ -14,6 +15,11 @@ from .views import (
     ReseñaCreateAPIView,PostulacionMarcarRevisionAPIView,
     ConversacionListAPIView,MensajeListCreateAPIView,
     IniciarConversacionAPIView,ImagenServicioDeleteAPIView,
+    MarcarLeidoAPIView,MetricasAutenticacionAPIView,
+    ImagenesEstadoAPIView,PerfilServiciosAPIView,
+    PerfilVacantesAPIView,PerfilReseñasAPIView,
+    VacantePostulantesAPIView,PostulacionesEstadoLoteAPIView,
+    VacanteEmbudoAPIView,PresenciaAPIView,
 )
 
 urlpatterns = [
@@ -23,6 +29,9 @@ urlpatterns = [
     path('perfil/', PerfilUsuarioAPIView.as_view(), name='api_perfil_usuario'),
     path('perfil/subir-cv/', CVUploadAPIView.as_view(), name='api_subir_cv'),
     path('perfil-publico/<str:username>/', PerfilPublicoAPIView.as_view(), name='api_perfil_publico'),
+    path('perfil-publico/<str:username>/servicios/', PerfilServiciosAPIView.as_view(), name='api_perfil_servicios'),
+    path('perfil-publico/<str:username>/vacantes/', PerfilVacantesAPIView.as_view(), name='api_perfil_vacantes'),
+    path('perfil-publico/<str:username>/reseñas/', PerfilReseñasAPIView.as_view(), name='api_perfil_reseñas'),
     path('reseñas/crear/', ReseñaCreateAPIView.as_view(), name='api_reseña_crear'),
     
     # Rutas para Servicios Ofrecidos
@@ -31,14 +40,18 @@ urlpatterns = [
     path('mis-servicios/', MisServiciosAPIView.as_view(), name='api_mis_servicios'),
     path('servicios/<int:pk>/toggle-active/', ServicioToggleActiveAPIView.as_view(), name='api_servicio_toggle_active'),
     path('servicios/imagenes/<int:pk>/', ImagenServicioDeleteAPIView.as_view(), name='api_imagen_servicio_delete'),
+    path('servicios/<int:pk>/imagenes/estado/', ImagenesEstadoAPIView.as_view(), name='api_imagenes_estado'),
     
     # Rutas para Vacantes y Postulaciones
     path('vacantes/', VacanteListCreateAPIView.as_view(), name='api_vacantes_lista'),
     path('vacantes/<int:pk>/', VacanteDetailAPIView.as_view(), name='api_vacante_detalle'), # <-- Nombre corregido
     path('vacantes/<int:pk>/postularse/', PostulacionCreateAPIView.as_view(), name='api_vacante_postularse'),
+    path('vacantes/<int:pk>/postulantes/', VacantePostulantesAPIView.as_view(), name='api_vacante_postulantes'),
+    path('vacantes/<int:pk>/embudo/', VacanteEmbudoAPIView.as_view(), name='api_vacante_embudo'),
     path('mis-vacantes/', MisVacantesAPIView.as_view(), name='api_mis_vacantes'),
     path('mis-postulaciones/', MisPostulacionesAPIView.as_view(), name='api_mis_postulaciones'),
     path('vacantes/<int:pk>/toggle-active/', VacanteToggleActiveAPIView.as_view(), name='api_vacante_toggle_active'),
+    path('postulaciones/actualizar-estado/', PostulacionesEstadoLoteAPIView.as_view(), name='api_postulaciones_estado_lote'),
     path('postulaciones/<int:pk>/actualizar-estado/', PostulacionUpdateStatusAPIView.as_view(), name='api_postulacion_update_status'),
     path('postulaciones/<int:pk>/marcar-revision/', PostulacionMarcarRevisionAPIView.as_view(), name='api_postulacion_marcar_revision'),
 
@@ -46,6 +59,13 @@ urlpatterns = [
     path('conversaciones/', ConversacionListAPIView.as_view(), name='api_conversaciones_lista'),
     path('conversaciones/<int:conversacion_id>/mensajes/', MensajeListCreateAPIView.as_view(), name='api_mensajes_lista_crea'),
     path('conversaciones/iniciar/', IniciarConversacionAPIView.as_view(), name='api_iniciar_conversacion'),
+    path('conversaciones/<int:conversacion_id>/marcar-leido/', MarcarLeidoAPIView.as_view(), name='api_marcar_leido'),
+    path('presencia/', PresenciaAPIView.as_view(), name='api_presencia'),
+    # Notificaciones por Server-Sent Events (el websocket es ws/notificaciones/)
+    path('notificaciones/flujo/', FlujoNotificacionesView.as_view(), name='api_notificaciones_flujo'),
+
+    # --- Rutas de Operación ---
+    path('metricas/autenticacion/', MetricasAutenticacionAPIView.as_view(), name='api_metricas_autenticacion'),
 
 ]
 
@@ -2,22 +2,32 @@
 
 # --- Imports ---
 from django.contrib.auth import authenticate
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import generics, permissions, status
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from rest_framework.authentication import TokenAuthentication
-from rest_framework import filters
-from django.db.models import Q
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.utils.urls import replace_query_param
+from django.db.models import OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 from .permissions import IsOwnerOrReadOnly
-from .models import Usuario, ServicioOfrecido, VacanteEmpresa, Postulacion,Reseña
+from .autenticacion import TokenAuthenticationCacheada, obtener_resolutor
+from .busqueda import BusquedaIndexadaFilter
+from .paginacion import MensajeKeysetPagination, PublicacionesPagination
+from . import presencia
+from .membresias import obtener_cache_membresias
+from .mensajeria import registrar_mensaje
+from .tareas import encolar
+from .models import Usuario, ServicioOfrecido, VacanteEmpresa, Postulacion,Reseña, ParticipanteConversacion, TransicionPostulacion
 from .serializers import (
     UsuarioSerializer, RegistroSerializer, ServicioOfrecidoSerializer,
-    VacanteEmpresaSerializer, PostulacionSerializer, VacanteConPostulantesSerializer,
+    VacanteEmpresaSerializer, PostulacionSerializer,
     CVUploadSerializer, PerfilUpdateSerializer, MisPostulacionesSerializer,PostulacionDetalleSerializer,
     PerfilPublicoSerializer,ReseñaSerializer,Postulacion,ConversacionSerializer,MensajeSerializer,
-    Conversacion,ImagenServicio,Mensaje,
+    Conversacion,ImagenServicio,Mensaje,ImagenServicioSerializer,
 )
 
 # --- Vistas de Autenticación y Perfil ---
@@ -44,7 +54,7 @@ class LoginAPIView(APIView):
 
 class PerfilUsuarioAPIView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [TokenAuthenticationCacheada]
 
     def get_object(self):
         return self.request.user
@@ -66,7 +76,7 @@ class PerfilUsuarioAPIView(generics.RetrieveUpdateAPIView):
 class CVUploadAPIView(generics.UpdateAPIView):
     serializer_class = CVUploadSerializer
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [TokenAuthenticationCacheada]
 
     def get_object(self):
         return self.request.user
@@ -80,16 +90,32 @@ class CVUploadAPIView(generics.UpdateAPIView):
         self.perform_update(serializer)
         
         # Después de subir el CV, devolvemos el perfil completo del usuario
+        # (cv_estado queda 'pendiente' hasta que el trabajador extrae el texto)
         read_serializer = UsuarioSerializer(instance, context={'request': request})
         return Response(read_serializer.data)
 
+    def perform_update(self, serializer):
+        if 'cv' not in serializer.validated_data:
+            serializer.save()
+            return
+        if not serializer.validated_data['cv']:
+            serializer.save(cv_texto='', cv_estado='')
+            return
+        usuario = serializer.save(cv_texto='', cv_estado='pendiente')
+        encolar('extraer_texto_cv', usuario_id=usuario.pk, nombre=usuario.cv.name)
+
 # --- Vistas para Servicios Ofrecidos ---
 class ServicioListCreateAPIView(generics.ListCreateAPIView):
-    queryset = ServicioOfrecido.objects.filter(activo=True).order_by('-fecha_publicacion')
+    # Imágenes y el resto de datos los precarga ServicioOfrecidoListSerializer,
+    # solo para los servicios que no están en la caché de fragmentos
+    queryset = ServicioOfrecido.objects.filter(activo=True).select_related(
+        'usuario_oferente'
+    ).order_by('-fecha_publicacion')
     serializer_class = ServicioOfrecidoSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['titulo_servicio', 'descripcion_servicio', 'usuario_oferente__username']
+    # Índice invertido: título, descripción y username del oferente (ver usuarios/busqueda.py)
+    filter_backends = [BusquedaIndexadaFilter]
+    pagination_class = PublicacionesPagination
     parser_classes = (MultiPartParser, FormParser)
 
     def perform_create(self, serializer):
@@ -98,7 +124,9 @@ class ServicioListCreateAPIView(generics.ListCreateAPIView):
         # Luego, obtenemos la lista de archivos de imagen de la petición
         imagenes = self.request.FILES.getlist('imagenes')
         
-        # Iteramos sobre cada archivo y creamos un objeto ImagenServicio asociado
+        # Iteramos sobre cada archivo y creamos un objeto ImagenServicio asociado.
+        # Solo se guarda el archivo: la validación y las variantes se procesan en
+        # segundo plano (ver usuarios/tareas.py) y el cliente consulta su estado.
         for imagen in imagenes:
             ImagenServicio.objects.create(servicio=servicio, imagen=imagen)
 
@@ -116,6 +144,21 @@ class ImagenServicioDeleteAPIView(generics.DestroyAPIView):
             raise permissions.PermissionDenied("No tienes permiso para borrar esta imagen.")
         return obj
     
+class ImagenesEstadoAPIView(generics.ListAPIView):
+    """
+    Estado del procesamiento de las imágenes de un servicio, para que el
+    oferente consulte cuándo están listas las variantes tras subirlas.
+    """
+    serializer_class = ImagenServicioSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [TokenAuthenticationCacheada]
+    pagination_class = None
+
+    def get_queryset(self):
+        return ImagenServicio.objects.filter(
+            servicio_id=self.kwargs['pk'], servicio__usuario_oferente=self.request.user
+        ).order_by('id')
+
 class ServicioDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = ServicioOfrecido.objects.all()
     serializer_class = ServicioOfrecidoSerializer
@@ -138,7 +181,7 @@ class ServicioDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
 
 class ServicioToggleActiveAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [TokenAuthenticationCacheada]
     def post(self, request, pk=None):
         try:
             servicio = ServicioOfrecido.objects.get(pk=pk)
@@ -155,16 +198,20 @@ class MisServiciosAPIView(generics.ListAPIView):
     serializer_class = ServicioOfrecidoSerializer
     permission_classes = [permissions.IsAuthenticated]
     def get_queryset(self):
-        return ServicioOfrecido.objects.filter(usuario_oferente=self.request.user).order_by('-fecha_publicacion')
+        return ServicioOfrecido.objects.filter(usuario_oferente=self.request.user).select_related(
+            'usuario_oferente'
+        ).order_by('-fecha_publicacion')
 
 # --- Vistas para Vacantes ---
 
 class VacanteListCreateAPIView(generics.ListCreateAPIView):
-    queryset = VacanteEmpresa.objects.filter(activa=True).order_by('-fecha_publicacion')
+    # Reseñas y promedios por empresa los precarga VacanteEmpresaListSerializer
+    queryset = VacanteEmpresa.objects.filter(activa=True).select_related('empresa').order_by('-fecha_publicacion')
     serializer_class = VacanteEmpresaSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['titulo_vacante', 'descripcion_puesto', 'ubicacion', 'empresa__username']
+    # Índice invertido: título, descripción, requisitos, ubicación y username de la empresa
+    filter_backends = [BusquedaIndexadaFilter]
+    pagination_class = PublicacionesPagination
 
     def perform_create(self, serializer):
         if self.request.user.tipo_usuario != 'empresa':
@@ -173,7 +220,7 @@ class VacanteListCreateAPIView(generics.ListCreateAPIView):
 
 class VacanteToggleActiveAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [TokenAuthenticationCacheada]
     def post(self, request, pk=None):
         try:
             vacante = VacanteEmpresa.objects.get(pk=pk)
@@ -187,15 +234,67 @@ class VacanteToggleActiveAPIView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 class VacanteDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = VacanteEmpresa.objects.all()
-    serializer_class = VacanteConPostulantesSerializer
+    # Detalle público; la empresa consulta sus postulantes en VacantePostulantesAPIView
+    queryset = VacanteEmpresa.objects.select_related('empresa')
+    serializer_class = VacanteEmpresaSerializer
     permission_classes = [IsOwnerOrReadOnly]
 
+class VacanteEmbudoAPIView(APIView):
+    """ Embudo de postulaciones de una vacante (ver TransicionPostulacion.embudo), solo para su empresa. """
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [TokenAuthenticationCacheada]
+
+    def get(self, request, pk=None):
+        empresa_id = VacanteEmpresa.objects.filter(pk=pk).values_list('empresa_id', flat=True).first()
+        if empresa_id is None:
+            return Response({'error': 'La vacante no existe.'}, status=status.HTTP_404_NOT_FOUND)
+        if empresa_id != request.user.id:
+            return Response({'error': 'No tienes permiso para ver esta vacante.'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(TransicionPostulacion.embudo(pk), status=status.HTTP_200_OK)
+
+class VacantePostulantesAPIView(generics.ListAPIView):
+    """
+    Postulantes de una vacante, solo para la empresa que la publicó. Paginado,
+    con ?estado= para filtrar y ?orden=fecha_postulacion|-fecha_postulacion
+    (por defecto los más recientes primero). Cada página es una sola consulta
+    con el profesional unido, y `conteos` trae el total por estado de toda la
+    vacante en una sola agregación.
+    """
+    serializer_class = PostulacionDetalleSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    ORDENES = ('fecha_postulacion', '-fecha_postulacion')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.vacante = get_object_or_404(VacanteEmpresa.objects.only('empresa'), pk=self.kwargs['pk'])
+        if self.vacante.empresa_id != request.user.id:
+            raise PermissionDenied("No tienes permiso para ver los postulantes de esta vacante.")
+
+    def get_queryset(self):
+        postulaciones = Postulacion.objects.filter(vacante=self.vacante)
+        estado = self.request.query_params.get('estado')
+        if estado:
+            if estado not in dict(Postulacion.ESTADO_CHOICES):
+                raise ValidationError({'error': f'Estado no válido: "{estado}".'})
+            postulaciones = postulaciones.filter(estado=estado)
+        orden = self.request.query_params.get('orden', '-fecha_postulacion')
+        if orden not in self.ORDENES:
+            raise ValidationError({'error': f'Orden no válido: "{orden}". Opciones: {", ".join(self.ORDENES)}.'})
+        # cv_texto puede ser muy largo y aquí no se usa
+        return postulaciones.select_related('profesional').defer('profesional__cv_texto').order_by(
+            orden, orden.replace('fecha_postulacion', 'id')
+        )
+
+    def list(self, request, *args, **kwargs):
+        respuesta = super().list(request, *args, **kwargs)
+        respuesta.data['conteos'] = Postulacion.conteos_por_estado(self.vacante.pk)
+        return respuesta
+
 # --- Vistas para Postulaciones ---
 
 class PostulacionCreateAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [TokenAuthenticationCacheada]
     def post(self, request, pk=None):
         try:
             vacante = VacanteEmpresa.objects.get(pk=pk, activa=True)
@@ -209,21 +308,37 @@ class PostulacionCreateAPIView(APIView):
         Postulacion.objects.create(vacante=vacante, profesional=profesional)
         return Response({'status': '¡Postulación exitosa!'}, status=status.HTTP_201_CREATED)
 
+def respuesta_cambio_estado(request, pk, estado, desde=None):
+    """
+    Aplica un cambio de estado a una sola postulación con la misma máquina de
+    estados que el cambio en lote y devuelve (resultado, Response de error o None).
+    """
+    resultado = Postulacion.cambiar_estado_en_lote([pk], estado, request.user, desde=desde)[0]
+    if resultado['resultado'] == 'no_existe':
+        return resultado, Response({'error': 'La postulación no existe.'}, status=status.HTTP_404_NOT_FOUND)
+    if resultado['resultado'] == 'sin_permiso':
+        return resultado, Response({'error': 'No tienes permiso para modificar esta postulación.'}, status=status.HTTP_403_FORBIDDEN)
+    return resultado, None
+
 class PostulacionUpdateStatusAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [TokenAuthenticationCacheada]
     def patch(self, request, pk=None):
-        try:
-            postulacion = Postulacion.objects.get(pk=pk)
-        except Postulacion.DoesNotExist:
-            return Response({'error': 'La postulación no existe.'}, status=status.HTTP_404_NOT_FOUND)
-        if postulacion.vacante.empresa != request.user:
-            return Response({'error': 'No tienes permiso para modificar esta postulación.'}, status=status.HTTP_403_FORBIDDEN)
         nuevo_estado = request.data.get('estado')
         if not nuevo_estado:
             return Response({'error': 'El campo "estado" es requerido.'}, status=status.HTTP_400_BAD_REQUEST)
-        postulacion.estado = nuevo_estado
-        postulacion.save()
+        if nuevo_estado not in dict(Postulacion.ESTADO_CHOICES):
+            return Response({'error': f'Estado no válido: "{nuevo_estado}".'}, status=status.HTTP_400_BAD_REQUEST)
+        resultado, error = respuesta_cambio_estado(request, pk, nuevo_estado)
+        if error is not None:
+            return error
+        if resultado['resultado'] == 'transicion_invalida':
+            # También si otro reclutador la cambió antes: se informa el estado vigente
+            return Response({
+                'error': f'No se puede pasar de "{resultado["estado"]}" a "{nuevo_estado}".',
+                'estado': resultado['estado'],
+            }, status=status.HTTP_409_CONFLICT)
+        postulacion = Postulacion.objects.select_related('profesional').get(pk=pk)
         serializer = PostulacionDetalleSerializer(postulacion, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -233,7 +348,7 @@ class MisVacantesAPIView(generics.ListAPIView):
     serializer_class = VacanteEmpresaSerializer
     permission_classes = [permissions.IsAuthenticated]
     def get_queryset(self):
-        return VacanteEmpresa.objects.filter(empresa=self.request.user).order_by('-fecha_publicacion')
+        return VacanteEmpresa.objects.filter(empresa=self.request.user).select_related('empresa').order_by('-fecha_publicacion')
 
 class MisPostulacionesAPIView(generics.ListAPIView):
     """
@@ -249,14 +364,93 @@ class MisPostulacionesAPIView(generics.ListAPIView):
         return Postulacion.objects.filter(profesional=self.request.user).order_by('-fecha_postulacion')
         # --------------------------------
 
+class PerfilPublicoSubrecursoMixin:
+    """
+    Listas paginadas de un perfil público (servicios, vacantes y reseñas).
+    PerfilPublicoAPIView reutiliza primera_pagina() para ?expand=.
+    """
+    permission_classes = [permissions.AllowAny]
+    # Lo asigna PerfilPublicoAPIView al expandir, para no volver a buscarlo
+    usuario = None
+
+    def get_usuario(self):
+        if self.usuario is None:
+            self.usuario = get_object_or_404(Usuario, username=self.kwargs['username'])
+        return self.usuario
+
+    def get_queryset(self):
+        return self.queryset_de(self.get_usuario())
+
+    def primera_pagina(self):
+        """ {'next', 'results'} sin COUNT(*): los totales ya vienen en el resumen del perfil. """
+        tamaño = self.paginator.get_page_size(self.request)
+        objetos = list(self.get_queryset()[:tamaño + 1])
+        siguiente = None
+        if len(objetos) > tamaño:
+            url = self.request.build_absolute_uri(reverse(self.nombre_ruta, kwargs={'username': self.kwargs['username']}))
+            siguiente = replace_query_param(url, self.paginator.page_query_param, 2)
+        return {'next': siguiente, 'results': self.get_serializer(objetos[:tamaño], many=True).data}
+
+class PerfilServiciosAPIView(PerfilPublicoSubrecursoMixin, generics.ListAPIView):
+    serializer_class = ServicioOfrecidoSerializer
+    pagination_class = PublicacionesPagination
+    nombre_ruta = 'api_perfil_servicios'
+
+    def queryset_de(self, usuario):
+        return ServicioOfrecido.objects.filter(usuario_oferente=usuario, activo=True).select_related(
+            'usuario_oferente'
+        ).order_by('-fecha_publicacion', '-id')
+
+class PerfilVacantesAPIView(PerfilPublicoSubrecursoMixin, generics.ListAPIView):
+    serializer_class = VacanteEmpresaSerializer
+    pagination_class = PublicacionesPagination
+    nombre_ruta = 'api_perfil_vacantes'
+
+    def queryset_de(self, usuario):
+        return VacanteEmpresa.objects.filter(empresa=usuario, activa=True).select_related(
+            'empresa'
+        ).order_by('-fecha_publicacion', '-id')
+
+class PerfilReseñasAPIView(PerfilPublicoSubrecursoMixin, generics.ListAPIView):
+    serializer_class = ReseñaSerializer
+    nombre_ruta = 'api_perfil_reseñas'
+
+    def queryset_de(self, usuario):
+        return Reseña.objects.filter(evaluado=usuario).select_related('evaluador').order_by('-fecha_creacion', '-id')
+
 class PerfilPublicoAPIView(generics.RetrieveAPIView):
     """
     Vista para obtener el perfil público de cualquier usuario por su username.
+    Devuelve un resumen con totales; ?expand=servicios,vacantes,reseñas
+    incrusta además la primera página de cada subrecurso.
     """
     queryset = Usuario.objects.all()
     serializer_class = PerfilPublicoSerializer
     permission_classes = [permissions.AllowAny] # Cualquiera puede ver un perfil público
     lookup_field = 'username' # Le decimos a Django que busque por username en lugar de ID
+    # nombre en ?expand= -> (campo de la respuesta, vista del subrecurso)
+    EXPANSIONES = {
+        'servicios': ('servicios_ofrecidos', PerfilServiciosAPIView),
+        'vacantes': ('vacantes_publicadas', PerfilVacantesAPIView),
+        'reseñas': ('reseñas_recibidas', PerfilReseñasAPIView),
+    }
+
+    def retrieve(self, request, *args, **kwargs):
+        pedidas = [nombre.strip() for nombre in request.query_params.get('expand', '').split(',') if nombre.strip()]
+        desconocidas = [nombre for nombre in pedidas if nombre not in self.EXPANSIONES]
+        if desconocidas:
+            return Response(
+                {'error': f'No se puede expandir: {", ".join(desconocidas)}. Opciones: {", ".join(self.EXPANSIONES)}.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        usuario = self.get_object()
+        datos = self.get_serializer(usuario).data
+        for nombre in dict.fromkeys(pedidas):
+            campo, vista = self.EXPANSIONES[nombre]
+            subrecurso = vista(request=request, args=self.args, kwargs=self.kwargs,
+                               format_kwarg=self.format_kwarg, usuario=usuario)
+            datos[campo] = subrecurso.primera_pagina()
+        return Response(datos)
 
 class ReseñaCreateAPIView(generics.CreateAPIView):
     """
@@ -272,11 +466,7 @@ class ReseñaCreateAPIView(generics.CreateAPIView):
 
         # --- ¡VALIDACIÓN CLAVE! ---
         # Verificamos si existe una conversación entre el evaluador y el evaluado.
-        ha_contactado = Conversacion.objects.filter(
-            participantes=evaluador
-        ).filter(
-            participantes=evaluado
-        ).exists()
+        ha_contactado = Conversacion.objects.entre(evaluador.id, evaluado.id).exists()
 
         if not ha_contactado:
             # Si no existe una conversación, denegamos el permiso.
@@ -287,60 +477,141 @@ class ReseñaCreateAPIView(generics.CreateAPIView):
 
 class PostulacionMarcarRevisionAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [TokenAuthenticationCacheada]
 
     def post(self, request, pk=None):
-        try:
-            postulacion = Postulacion.objects.get(pk=pk)
-        except Postulacion.DoesNotExist:
-            return Response({'error': 'La postulación no existe.'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Verificamos que quien hace la petición es el dueño de la vacante
-        if postulacion.vacante.empresa != request.user:
-            return Response({'error': 'No tienes permiso para modificar esta postulación.'}, status=status.HTTP_403_FORBIDDEN)
-
         # IMPORTANTE: Solo cambiamos el estado si actualmente es 'recibida'
         # para no sobrescribir estados más avanzados como 'contactado' o 'rechazado'.
-        if postulacion.estado == 'recibida':
-            postulacion.estado = 'en_revision'
-            postulacion.save()
-
+        _, error = respuesta_cambio_estado(request, pk, 'en_revision', desde={'recibida'})
+        if error is not None:
+            return error
+        postulacion = Postulacion.objects.select_related('profesional').get(pk=pk)
         serializer = PostulacionDetalleSerializer(postulacion, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
-    
+
+class PostulacionesEstadoLoteAPIView(APIView):
+    """
+    Cambia el estado de muchas postulaciones en una sola petición:
+    {"ids": [1, 2, ...], "estado": "en_revision"}. Solo se aplican las
+    transiciones válidas (ver Postulacion.TRANSICIONES) y se devuelve el
+    resultado de cada id.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = [TokenAuthenticationCacheada]
+
+    def post(self, request):
+        estado = request.data.get('estado')
+        if estado not in dict(Postulacion.ESTADO_CHOICES):
+            return Response({'error': 'El campo "estado" es requerido y debe ser un estado válido.'}, status=status.HTTP_400_BAD_REQUEST)
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+            return Response({'error': 'El campo "ids" debe ser una lista de ids de postulación.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > Postulacion.MAXIMO_LOTE:
+            return Response({'error': f'Como máximo {Postulacion.MAXIMO_LOTE} postulaciones por petición.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        resultados = Postulacion.cambiar_estado_en_lote(ids, estado, request.user)
+        return Response({
+            'estado': estado,
+            'actualizadas': sum(1 for resultado in resultados if resultado['resultado'] == 'actualizada'),
+            'resultados': resultados,
+        }, status=status.HTTP_200_OK)
+
 class ConversacionListAPIView(generics.ListAPIView):
     """ Devuelve la lista de conversaciones del usuario autenticado. """
     serializer_class = ConversacionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        # Filtra las conversaciones donde el usuario actual es un participante
-        return self.request.user.conversaciones.all().order_by('-fecha_modificacion')
+        # Filtra las conversaciones donde el usuario actual es un participante.
+        # Último mensaje y no leídos están desnormalizados, así que una página
+        # completa se resuelve con la consulta principal y un prefetch.
+        usuario = self.request.user
+        no_leidos = ParticipanteConversacion.objects.filter(
+            conversacion_id=OuterRef('pk'), usuario=usuario
+        ).values('no_leidos')[:1]
+        return usuario.conversaciones.select_related('servicio_relacionado').prefetch_related(
+            Prefetch('participantes', queryset=Usuario.objects.only('id', 'username'))
+        ).annotate(
+            no_leidos=Coalesce(Subquery(no_leidos), 0)
+        ).order_by('-fecha_modificacion')
 
 
 class MensajeListCreateAPIView(generics.ListCreateAPIView):
     """ Devuelve los mensajes de una conversación o crea un nuevo mensaje. """
     serializer_class = MensajeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Historial por cursor: ?antes_de=<id> para cargar anteriores, ?despues_de=<id> para nuevos
+    pagination_class = MensajeKeysetPagination
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Solo los participantes leen o escriben; para los demás la conversación no existe
+        if not obtener_cache_membresias().es_participante(self.kwargs['conversacion_id'], request.user.id):
+            raise NotFound('La conversación no existe.')
 
     def get_queryset(self):
         # Obtenemos el ID de la conversación desde la URL
         conversacion_id = self.kwargs['conversacion_id']
-        # Filtramos los mensajes de esa conversación
-        mensajes = Mensaje.objects.filter(conversacion_id=conversacion_id)
-        
-        # Marcar mensajes como leídos
-        # Obtenemos los mensajes que no son del usuario actual y no están leídos
-        mensajes_no_leidos = mensajes.filter(leido=False).exclude(autor=self.request.user)
-        mensajes_no_leidos.update(leido=True)
+        # Filtramos los mensajes de esa conversación. Leer ya no escribe nada:
+        # el estado de lectura se avanza con MarcarLeidoAPIView.
+        return Mensaje.objects.filter(conversacion_id=conversacion_id).select_related('autor')
 
-        return mensajes
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['marcas_lectura'] = dict(ParticipanteConversacion.objects.filter(
+            conversacion_id=self.kwargs['conversacion_id']
+        ).values_list('usuario_id', 'ultimo_leido'))
+        return context
 
     def perform_create(self, serializer):
         # Asignamos el autor y la conversación automáticamente
         conversacion_id = self.kwargs['conversacion_id']
-        conversacion = Conversacion.objects.get(id=conversacion_id)
-        serializer.save(autor=self.request.user, conversacion=conversacion)
+        serializer.instance = registrar_mensaje(
+            conversacion_id, self.request.user, serializer.validated_data['contenido']
+        )
+
+
+class PresenciaAPIView(APIView):
+    """ Presencia de varios usuarios en una sola petición: ?ids=1,2,3 (ver usuarios/presencia.py). """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            ids = list(dict.fromkeys(int(valor) for valor in request.query_params.get('ids', '').split(',') if valor.strip()))
+        except ValueError:
+            return Response({'error': 'El parámetro "ids" debe ser una lista de números separados por comas.'}, status=status.HTTP_400_BAD_REQUEST)
+        maximo = presencia.ajuste('MAXIMO_IDS', 200)
+        if len(ids) > maximo:
+            return Response({'error': f'Como máximo {maximo} usuarios por petición.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(presencia.estado(ids), status=status.HTTP_200_OK)
+
+class MarcarLeidoAPIView(APIView):
+    """
+    Avanza la marca de lectura del usuario en una conversación hasta
+    `mensaje_id` (o hasta el último mensaje si no se envía). La marca nunca
+    retrocede y solo se escribe cuando realmente cambia.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, conversacion_id=None):
+        try:
+            membresia = ParticipanteConversacion.objects.get(conversacion_id=conversacion_id, usuario=request.user)
+        except ParticipanteConversacion.DoesNotExist:
+            return Response({'error': 'La conversación no existe.'}, status=status.HTTP_404_NOT_FOUND)
+
+        mensajes = Mensaje.objects.filter(conversacion_id=conversacion_id)
+        mensaje_id = request.data.get('mensaje_id')
+        if mensaje_id is not None:
+            try:
+                mensajes = mensajes.filter(id__lte=int(mensaje_id))
+            except (TypeError, ValueError):
+                return Response({'error': 'El campo "mensaje_id" debe ser un número.'}, status=status.HTTP_400_BAD_REQUEST)
+        # Nos quedamos con un mensaje que exista en la conversación
+        hasta = mensajes.order_by('-id').values_list('id', flat=True).first() or 0
+
+        if hasta > membresia.ultimo_leido:
+            ParticipanteConversacion.avanzar_lectura(conversacion_id, request.user.id, hasta)
+        return Response({'ultimo_leido': max(hasta, membresia.ultimo_leido)}, status=status.HTTP_200_OK)
 
 
 # usuarios/views.py
@@ -365,38 +636,24 @@ class IniciarConversacionAPIView(APIView):
         except Usuario.DoesNotExist:
             return Response({'error': 'El usuario no existe.'}, status=status.HTTP_404_NOT_FOUND)
 
-        # --- LÓGICA CORREGIDA ---
+        servicio = None
         if servicio_id:
-            # Buscamos encadenando los filtros
-            conversacion = Conversacion.objects.filter(
-                participantes=usuario_actual
-            ).filter(
-                participantes=otro_usuario
-            ).filter(
-                servicio_relacionado_id=servicio_id
-            )
-        else:
-            # Hacemos lo mismo para la búsqueda genérica
-            conversacion = Conversacion.objects.filter(
-                participantes=usuario_actual
-            ).filter(
-                participantes=otro_usuario
-            ).filter(
-                servicio_relacionado__isnull=True
-            )
-        
-        if conversacion.exists():
-            conv = conversacion.first()
-        else:
-            conv = Conversacion.objects.create()
-            conv.participantes.add(usuario_actual, otro_usuario)
-            
-            if servicio_id:
-                try:
-                    servicio = ServicioOfrecido.objects.get(id=servicio_id)
-                    conv.servicio_relacionado = servicio
-                    conv.save()
-                except ServicioOfrecido.DoesNotExist:
-                    pass 
-
-        return Response({'conversacion_id': conv.id}, status=status.HTTP_200_OK)
\ No newline at end of file
+            # Si el servicio no existe, la conversación queda sin servicio ligado
+            servicio = ServicioOfrecido.objects.filter(id=servicio_id).first()
+
+        # Búsqueda por la clave única del par: un solo acceso al índice y sin
+        # duplicados aunque lleguen dos peticiones a la vez.
+        conv, _ = Conversacion.objects.obtener_o_crear_entre(usuario_actual, otro_usuario, servicio)
+
+        return Response({'conversacion_id': conv.id}, status=status.HTTP_200_OK)
+
+
+# --- Vistas de Operación ---
+
+class MetricasAutenticacionAPIView(APIView):
+    """ Aciertos y fallos de la caché de tokens de este proceso (solo staff). """
+    authentication_classes = [TokenAuthenticationCacheada]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(obtener_resolutor().metricas())